@@ -0,0 +1,98 @@
+'''
+Micro-benchmark of the generation of the elasticsearch bulk actions. The
+column-wise document_generator is timed against the row-by-row generator it
+replaced (iterrows, with every value cast on its own) on a synthetic frame of
+employee documents. The bulk helpers are left out: the actions are only
+consumed, so the timings are those of building the documents.
+
+    python -m schedule.benchmark.bench_documents --rows 1000000 --baseline-rows 100000
+
+The row-by-row generator is much slower, so it is timed on the first
+baseline_rows rows only; the actions of both generators are compared on
+those rows.
+'''
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+from schedule.main.elasticsearch.elastic_bulk_upload import document_generator
+from schedule.main.elasticsearch.schema import EMPLOYEE_INDEX, EMPLOYEE_ID_FIELD, EMPLOYEE_FIELDS
+
+# Number of distinct values of each text field in the synthetic frame
+DISTINCT_VALUES = 50
+
+def generate_documents(n_rows, seed=0):
+    '''
+    Returns a synthetic frame with the employee document fields: text fields
+    drawn from a few distinct values, with missing phone numbers and emails,
+    and integer ids.
+    '''
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame({name: rng.choice([f"{name}_{i}" for i in range(DISTINCT_VALUES)], n_rows)
+                       .astype(object) for name in EMPLOYEE_FIELDS})
+    df["employee_id"] = np.arange(n_rows)
+    df["org_id"] = rng.integers(0, 5000, n_rows)
+    df["dept_id"] = rng.integers(0, 100, n_rows)
+    df.loc[::7, "phone_number"] = np.nan
+    df.loc[::11, "email"] = None
+    return df
+
+def row_document_generator(df, index, doc_type, id_field, fields):
+    '''
+    The generator document_generator replaced: one document per row of
+    iterrows, each value cast with int() or str().
+    '''
+    for idx, row in df.iterrows():
+        source = {name: int(row[name]) if ftype is int else str(row[name])
+                  for name, ftype in fields.items()}
+        yield {
+            "_index": index,
+            "_type": doc_type,
+            "_id": source[id_field],
+            "_source": source}
+
+def time_generator(generator):
+    ''' Consumes a generator of actions; returns the actions and the seconds it took. '''
+    start = time.perf_counter()
+    actions = list(generator)
+    return actions, time.perf_counter() - start
+
+def run_benchmark(n_rows, baseline_rows, seed=0):
+    '''
+    Times both generators and checks that they build the same actions.
+    Returns:
+        A dict with the number of documents and documents per second of
+        each generator, and whether their actions are identical.
+    '''
+    df = generate_documents(n_rows, seed=seed)
+    actions, seconds = time_generator(document_generator(
+        df, EMPLOYEE_INDEX, EMPLOYEE_INDEX, EMPLOYEE_ID_FIELD, EMPLOYEE_FIELDS))
+    baseline_df = df.iloc[:baseline_rows]
+    baseline_actions, baseline_seconds = time_generator(row_document_generator(
+        baseline_df, EMPLOYEE_INDEX, EMPLOYEE_INDEX, EMPLOYEE_ID_FIELD, EMPLOYEE_FIELDS))
+    return {
+        "column_wise": {"documents": len(actions), "seconds": seconds,
+                        "documents_per_second": len(actions) / seconds},
+        "row_by_row": {"documents": len(baseline_actions), "seconds": baseline_seconds,
+                       "documents_per_second": len(baseline_actions) / baseline_seconds},
+        "identical": actions[:len(baseline_actions)] == baseline_actions,
+    }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the generation of the elasticsearch documents.")
+    parser.add_argument("--rows", type=int, default=1000000, help="number of documents")
+    parser.add_argument("--baseline-rows", type=int, default=100000,
+                        help="number of documents built by the row-by-row generator")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the synthetic frame")
+    args = parser.parse_args(argv)
+    results = run_benchmark(args.rows, min(args.baseline_rows, args.rows), seed=args.seed)
+    for name in ["row_by_row", "column_wise"]:
+        result = results[name]
+        print(f"{name:<12} {result['documents']:>9} documents in {result['seconds']:7.2f}s "
+              f"({result['documents_per_second']:,.0f} documents/s)")
+    print(f"identical actions: {results['identical']}")
+
+if __name__ == "__main__":
+    main()
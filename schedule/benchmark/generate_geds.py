@@ -0,0 +1,216 @@
+'''
+Generator of synthetic GEDS data. The generated csv has the columns listed in
+DataConfig.COLUMNS_TO_KEEP, so it can be read by prepare_data like the real
+dataset. Every department gets a random org chart of bounded depth and
+fan-out; employees are spread unevenly over the organizations, and a share of
+the organization names are common names (e.g. "Corporate Services Branch")
+that repeat within and across departments, as they do in GEDS.
+'''
+import numpy as np
+import pandas as pd
+
+from schedule.config import DataConfig
+
+# Themes of the departments (english, french)
+DEPARTMENT_THEMES = [
+    ("Agriculture", "Agriculture"), ("Environment", "Environnement"), ("Fisheries", "Pêches"),
+    ("Health", "Santé"), ("Immigration", "Immigration"), ("Justice", "Justice"),
+    ("Transport", "Transports"), ("Veterans Affairs", "Anciens Combattants"),
+    ("Heritage", "Patrimoine"), ("Employment", "Emploi"), ("Natural Resources", "Ressources naturelles"),
+    ("Public Safety", "Sécurité publique"), ("Indigenous Services", "Services aux Autochtones"),
+    ("Innovation", "Innovation"), ("Statistics", "Statistique"), ("Public Services", "Services publics"),
+]
+# Subjects of the organizations (english, french)
+TOPICS = [
+    ("Finance", "finances"), ("Human Resources", "ressources humaines"), ("Policy", "politiques"),
+    ("Information Technology", "technologie de l'information"), ("Communications", "communications"),
+    ("Legal Services", "services juridiques"), ("Audit", "vérification"), ("Operations", "opérations"),
+    ("Programs", "programmes"), ("Research", "recherche"), ("Strategic Planning", "planification stratégique"),
+    ("Corporate Services", "services ministériels"), ("Security", "sécurité"), ("Data", "données"),
+    ("Client Services", "services aux clients"), ("Evaluation", "évaluation"),
+]
+# Kind of organization at each level below the department (english, french)
+LEVELS = [
+    ("Branch", "Direction générale"), ("Directorate", "Direction"), ("Division", "Division"),
+    ("Section", "Section"), ("Unit", "Unité"), ("Team", "Équipe"),
+]
+REGIONS = [
+    ("Ontario", "Ontario", "Toronto", "Toronto", "M5V 3L9"), ("Quebec", "Québec", "Montreal", "Montréal", "H2Z 1B1"),
+    ("Ontario", "Ontario", "Ottawa", "Ottawa", "K1A 0J9"), ("Quebec", "Québec", "Gatineau", "Gatineau", "J8X 4C1"),
+    ("British Columbia", "Colombie-Britannique", "Vancouver", "Vancouver", "V6B 4N7"),
+    ("Alberta", "Alberta", "Edmonton", "Edmonton", "T5J 4C3"), ("Nova Scotia", "Nouvelle-Écosse", "Halifax", "Halifax", "B3J 3K5"),
+    ("Manitoba", "Manitoba", "Winnipeg", "Winnipeg", "R3C 4T3"),
+]
+JOB_TITLES = [
+    ("Analyst", "Analyste"), ("Senior Analyst", "Analyste principal"), ("Manager", "Gestionnaire"),
+    ("Director", "Directeur"), ("Director General", "Directeur général"), ("Advisor", "Conseiller"),
+    ("Administrative Assistant", "Adjoint administratif"), ("Developer", "Développeur"),
+    ("Program Officer", "Agent de programme"), ("Team Leader", "Chef d'équipe"),
+]
+FIRST_NAMES = ["Alex", "Marie", "Jean", "Sarah", "Mohamed", "Li", "Emily", "Luc", "Priya", "Olivier",
+               "Chloé", "David", "Fatima", "Noah", "Isabelle", "Wei", "Gabriel", "Amira", "Liam", "Sophie"]
+LAST_NAMES = ["Smith", "Tremblay", "Roy", "Gagnon", "Lee", "Wilson", "Martin", "Brown", "Côté", "Bouchard",
+              "Singh", "Nguyen", "Pelletier", "Taylor", "Morin", "Wong", "Lavoie", "Campbell", "Khan", "Fortin"]
+ROOT_EN, ROOT_FR = "Government of Canada", "Gouvernement du Canada"
+
+def generate_geds(n_employees, n_departments=50, tree_depth=6, fan_out=6, employees_per_org=8,
+                  name_collision_rate=0.1, noise_rate=0.02, seed=0):
+    '''
+    Generates a synthetic GEDS dataset.
+    Args:
+        n_employees: the number of employees (rows).
+        n_departments: the number of departments.
+        tree_depth: the maximum number of organization levels below a
+            department.
+        fan_out: the maximum number of child organizations of an
+            organization.
+        employees_per_org: the average number of employees per organization,
+            which sets the number of organizations.
+        name_collision_rate: the share of organizations given a common name
+            instead of a unique one.
+        noise_rate: the share of org units written with a parenthesized
+            acronym or extra spaces in the org structures, and of employees
+            without a job title.
+        seed: the seed of the random generator.
+    Returns:
+        A pandas dataframe with the DataConfig.COLUMNS_TO_KEEP columns.
+    '''
+    rng = np.random.default_rng(seed)
+    departments = generate_departments(n_departments)
+    # Departments vary a lot in size
+    weights = rng.lognormal(0, 1, n_departments)
+    weights /= weights.sum()
+    n_orgs = max(n_employees // employees_per_org, n_departments)
+    orgs_per_department = rng.multinomial(n_orgs - n_departments, weights) + 1
+    orgs = pd.concat([generate_org_chart(rng, dept_idx, department, n_dept_orgs, tree_depth, fan_out,
+                                         name_collision_rate, noise_rate)
+                      for dept_idx, (department, n_dept_orgs)
+                      in enumerate(zip(departments, orgs_per_department))], ignore_index=True)
+    # Employees are spread unevenly over the organizations
+    org_weights = rng.lognormal(0, 1, len(orgs))
+    employee_orgs = orgs.iloc[rng.choice(len(orgs), n_employees, p=org_weights / org_weights.sum())]
+    employee_orgs = employee_orgs.reset_index(drop=True)
+    first_names = np.array(FIRST_NAMES, dtype=object)[rng.integers(len(FIRST_NAMES), size=n_employees)]
+    last_names = np.array(LAST_NAMES, dtype=object)[rng.integers(len(LAST_NAMES), size=n_employees)]
+    ids = pd.Series(np.arange(n_employees)).astype(str).to_numpy(dtype=object)
+    titles = rng.integers(len(JOB_TITLES), size=n_employees)
+    missing_titles = rng.random(n_employees) < noise_rate
+    regions = rng.integers(len(REGIONS), size=n_employees)
+    region = lambda field: np.array([r[field] for r in REGIONS], dtype=object)[regions]
+    street_numbers = pd.Series(rng.integers(1, 999, size=n_employees)).astype(str).to_numpy(dtype=object)
+    phones = pd.Series(rng.integers(0, 10000, size=n_employees)).astype(str).str.zfill(4).to_numpy(dtype=object)
+    columns = [
+        last_names,
+        first_names,
+        np.where(missing_titles, np.nan, np.array([t[0] for t in JOB_TITLES], dtype=object)[titles]),
+        np.where(missing_titles, np.nan, np.array([t[1] for t in JOB_TITLES], dtype=object)[titles]),
+        "613-555-" + phones,
+        first_names + "." + last_names + ids + "@canada.gc.ca",
+        street_numbers + " Wellington Street",
+        street_numbers + " rue Wellington",
+        region(0), region(1), region(2), region(3), region(4),
+        employee_orgs["department_acronym"].to_numpy(),
+        employee_orgs["department_en"].to_numpy(),
+        employee_orgs["department_fr"].to_numpy(),
+        employee_orgs["org_acronym"].to_numpy(),
+        employee_orgs["org_name_en"].to_numpy(),
+        employee_orgs["org_name_fr"].to_numpy(),
+        employee_orgs["org_structure_en"].to_numpy(),
+        employee_orgs["org_structure_fr"].to_numpy(),
+    ]
+    return pd.DataFrame(dict(zip(DataConfig.COLUMNS_TO_KEEP, columns)))
+
+def generate_departments(n_departments):
+    ''' Returns a list of (acronym, english name, french name) for each department. '''
+    departments = []
+    for i in range(n_departments):
+        theme_en, theme_fr = DEPARTMENT_THEMES[i % len(DEPARTMENT_THEMES)]
+        # Themes are reused with a number once they run out
+        suffix = f" {i // len(DEPARTMENT_THEMES) + 1}" if i >= len(DEPARTMENT_THEMES) else ""
+        acronym = "".join(word[0] for word in theme_en.split()).upper() + f"C{i}"
+        departments.append((acronym, f"{theme_en} Canada{suffix}", f"{theme_fr} Canada{suffix}"))
+    return departments
+
+def generate_org_chart(rng, dept_idx, department, n_orgs, tree_depth, fan_out, name_collision_rate,
+                       noise_rate):
+    '''
+    Generates the organizations of a department: a random tree with at most
+    n_orgs nodes, rooted at the department itself, where every organization
+    has at most fan_out children and sits at most tree_depth levels below the
+    department.
+    Returns:
+        A pandas dataframe with one row per organization.
+    '''
+    acronym, dept_en, dept_fr = department
+    names = [(dept_en, dept_fr)]
+    parents = [-1]
+    depths = [0]
+    n_children = [0]
+    # Organizations that can still receive children
+    open_nodes = [0] if tree_depth > 0 and fan_out > 0 else []
+    for _ in range(n_orgs - 1):
+        if not open_nodes:
+            break
+        slot = rng.integers(len(open_nodes))
+        parent = open_nodes[slot]
+        node = len(names)
+        names.append(generate_org_name(rng, depths[parent], node, name_collision_rate))
+        parents.append(parent)
+        depths.append(depths[parent] + 1)
+        n_children.append(0)
+        n_children[parent] += 1
+        if n_children[parent] >= fan_out:
+            open_nodes[slot] = open_nodes[-1]
+            open_nodes.pop()
+        if depths[node] < tree_depth:
+            open_nodes.append(node)
+    structures_en, structures_fr = [], []
+    for node in range(len(names)):
+        path = []
+        while node != -1:
+            path.append(names[node])
+            node = parents[node]
+        path = path[::-1]
+        structures_en.append(format_structure(rng, [ROOT_EN] + [en for en, _ in path], noise_rate))
+        structures_fr.append(format_structure(rng, [ROOT_FR] + [fr for _, fr in path], noise_rate))
+    return pd.DataFrame({
+        "department_acronym": acronym,
+        "department_en": dept_en,
+        "department_fr": dept_fr,
+        "org_acronym": [f"{acronym}-{node}" for node in range(len(names))],
+        "org_name_en": [en for en, _ in names],
+        "org_name_fr": [fr for _, fr in names],
+        "org_structure_en": structures_en,
+        "org_structure_fr": structures_fr,
+    })
+
+def generate_org_name(rng, parent_depth, node, name_collision_rate):
+    ''' Returns the (english, french) name of an organization at the level below parent_depth. '''
+    level_en, level_fr = LEVELS[min(parent_depth, len(LEVELS) - 1)]
+    topic_en, topic_fr = TOPICS[rng.integers(len(TOPICS))]
+    if rng.random() < name_collision_rate:
+        # A common name, shared by many organizations
+        return f"{topic_en} {level_en}", f"{level_fr} des {topic_fr}"
+    return f"{topic_en} {level_en} {node}", f"{level_fr} des {topic_fr} {node}"
+
+def format_structure(rng, path, noise_rate):
+    '''
+    Joins the org units of a path into an org structure string, adding a
+    parenthesized acronym or extra spaces to some units as in GEDS.
+    '''
+    units = []
+    for unit in path:
+        draw = rng.random()
+        if draw < noise_rate / 2:
+            unit = f"{unit} ({''.join(word[0] for word in unit.split()).upper()})"
+        elif draw < noise_rate:
+            unit = unit + "  "
+        units.append(unit)
+    return " : ".join(units)
+
+def write_geds_csv(path, n_employees, **kwargs):
+    '''
+    Generates a synthetic GEDS dataset and writes it to a csv. Keyword
+    arguments are passed to generate_geds.
+    '''
+    generate_geds(n_employees, **kwargs).to_csv(path, index=False)
@@ -0,0 +1,190 @@
+'''
+End-to-end benchmark of the pipeline on synthetic GEDS data. For each size,
+a dataset is generated and every stage of a full refresh is run on it in a
+fresh process: prepare_data, prepare_org_chart, the employee, department and
+organization table builders (into a sqlite database in the work directory),
+and the generation of the elasticsearch documents, which are sent to an
+in-process stub. The wall time, CPU time, peak memory and throughput of each
+stage are written to a JSON file that later runs can be compared against:
+
+    python -m schedule.benchmark.run_benchmark --sizes 10000 100000 1000000 \
+        --output ./data/benchmark/baseline.json
+    python -m schedule.benchmark.run_benchmark --sizes 10000 100000 \
+        --output ./data/benchmark/latest.json --compare ./data/benchmark/baseline.json
+'''
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from schedule.config import DataConfig, PipelineConfig, SQLAlchemyConfig
+from schedule.benchmark.generate_geds import write_geds_csv
+from schedule.benchmark.stub_elasticsearch import StubElasticsearch
+from schedule.main.prepare_data import prepare_data
+from schedule.main.prepare_org_chart import prepare_org_chart
+from schedule.main.employee.employee_table import create_employee_table
+from schedule.main.department.department_table import create_department_table
+from schedule.main.organization.organization_table import create_organization_table
+from schedule.main.organization.org_chart_index import OrgChartIndex
+from schedule.main.elasticsearch.elastic_bulk_upload import (
+    merge_dataframes, bulk_upload_employees, bulk_upload_organizations, bulk_upload_suggestions)
+from schedule.main.suggestions import get_suggestion_df, write_suggestion_index
+from schedule.main.utils.instrumentation import RunReport, to_builtin, write_atomically
+
+DEFAULT_SIZES = [10000, 100000, 1000000]
+DEFAULT_WORKDIR = "./data/benchmark"
+
+def run_benchmark(sizes, workdir=DEFAULT_WORKDIR, seed=0, workers=1, trace_memory=False):
+    '''
+    Benchmarks the pipeline on synthetic datasets of the given sizes.
+    Args:
+        sizes: a list of numbers of employees.
+        workdir: the directory the datasets and databases are written to.
+        seed: the seed of the synthetic data generator.
+        workers: the number of org chart worker processes (see
+            PipelineConfig.ORG_CHART_WORKERS).
+        trace_memory: whether to record the peak python allocations of each
+            stage (slower).
+    Returns:
+        A dict holding the environment and the report of each size.
+    '''
+    os.makedirs(workdir, exist_ok=True)
+    results = {
+        "created_at": time.time(),
+        "environment": {
+            "python": platform.python_version(),
+            "pandas": pd.__version__,
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+        },
+        "settings": {"seed": seed, "workers": workers, "trace_memory": trace_memory},
+        "runs": [],
+    }
+    for n_employees in sizes:
+        print(f"Benchmarking {n_employees} employees")
+        # A fresh process per size, so the peak memory of a run is its own
+        context = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+            run = executor.submit(benchmark_size, n_employees, workdir, seed, workers,
+                                  trace_memory).result()
+        results["runs"].append(run)
+    return results
+
+def benchmark_size(n_employees, workdir, seed=0, workers=1, trace_memory=False):
+    '''
+    Runs every stage on a synthetic dataset of n_employees rows; run in a
+    worker process since it overrides the configuration. Returns the run
+    report as a dict, along with the number of employees.
+    '''
+    csv_path = os.path.join(workdir, f"geds_{n_employees}_{seed}.csv")
+    db_name = os.path.join(workdir, f"benchmark_{n_employees}")
+    DataConfig.ORIGINAL_DATA_PATH = csv_path
+    DataConfig.USE_FRAME_CACHE = False
+    # Synthetic employees must not get ids in the registry of the real data
+    DataConfig.ID_REGISTRY_PATH = ""
+    PipelineConfig.ORG_CHART_WORKERS = workers
+    SQLAlchemyConfig.DB_DIALECT = "sqlite"
+    SQLAlchemyConfig.DB_NAME = db_name
+    if os.path.exists(db_name + ".db"):
+        os.remove(db_name + ".db")
+    report = RunReport(trace_memory=trace_memory)
+    with report.stage("generate_geds") as stage:
+        # Datasets are generated once per size and seed, then reused
+        stage.details["reused"] = os.path.isfile(csv_path)
+        if not stage.details["reused"]:
+            write_geds_csv(csv_path, n_employees, seed=seed)
+        stage.rows_out = n_employees
+    with report.stage("prepare_data") as stage:
+        df = prepare_data()
+        stage.rows_out = len(df)
+    with report.stage("prepare_org_chart", rows_in=len(df)):
+        org_chart_en, org_chart_fr = prepare_org_chart(df)
+    with report.stage("index_org_charts"):
+        org_index_en = OrgChartIndex(org_chart_en)
+        org_index_fr = OrgChartIndex(org_chart_fr)
+    with report.stage("create_employee_table", rows_in=len(df)) as stage:
+        create_employee_table(df)
+        stage.rows_out = len(df)
+    with report.stage("create_department_table", rows_in=len(df)) as stage:
+        dept_df = create_department_table(df, org_chart_en, org_chart_fr, org_index_en, org_index_fr)
+        stage.rows_out = len(dept_df)
+    with report.stage("create_organization_table", rows_in=len(df)) as stage:
+        org_df = create_organization_table(df, org_chart_en, org_chart_fr, org_index_en=org_index_en)
+        stage.rows_out = len(org_df)
+    with report.stage("elastic_documents", rows_in=len(df)) as stage:
+        es = StubElasticsearch()
+        emp_docs, org_docs = merge_dataframes(df, org_df, dept_df)
+        bulk_upload_employees(emp_docs, es)
+        bulk_upload_organizations(org_docs, es)
+        stage.rows_out = es.documents
+        stage.details["bytes"] = es.bytes
+        stage.details["requests"] = es.requests
+    with report.stage("suggestions", rows_in=len(emp_docs) + len(org_docs)) as stage:
+        es = StubElasticsearch()
+        suggestion_df = get_suggestion_df(emp_docs, org_docs)
+        bulk_upload_suggestions(suggestion_df, es)
+        stage.rows_out = write_suggestion_index(suggestion_df, db_name + "_suggestions.db")
+        stage.details["bytes"] = es.bytes
+    report.finish("success")
+    run = report.to_dict()
+    run["n_employees"] = n_employees
+    run["org_chart_nodes"] = {"en": len(org_chart_en), "fr": len(org_chart_fr)}
+    return run
+
+def compare_results(baseline, results):
+    '''
+    Prints the wall time and peak memory of each stage next to those of a
+    baseline, for the sizes found in both.
+    '''
+    baseline_runs = dict((run["n_employees"], run) for run in baseline["runs"])
+    for run in results["runs"]:
+        baseline_run = baseline_runs.get(run["n_employees"])
+        if baseline_run is None:
+            print(f"{run['n_employees']} employees: not in the baseline")
+            continue
+        print(f"{run['n_employees']} employees: {baseline_run['wall_time']:.2f}s -> {run['wall_time']:.2f}s")
+        baseline_stages = dict((stage["name"], stage) for stage in baseline_run["stages"])
+        for stage in run["stages"]:
+            before = baseline_stages.get(stage["name"])
+            if before is None:
+                print(f"    {stage['name']:<28} {stage['wall_time']:8.2f}s (new stage)")
+                continue
+            ratio = stage["wall_time"] / before["wall_time"] if before["wall_time"] else float("nan")
+            print(f"    {stage['name']:<28} {before['wall_time']:8.2f}s -> {stage['wall_time']:8.2f}s "
+                  f"(x{ratio:.2f}), peak rss {format_bytes(before['peak_rss_bytes'])} -> "
+                  f"{format_bytes(stage['peak_rss_bytes'])}")
+
+def format_bytes(value):
+    return "n/a" if value is None else f"{value / 2 ** 20:.0f}MiB"
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the pipeline on synthetic GEDS data.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES,
+                        help="numbers of employees to benchmark")
+    parser.add_argument("--output", default=os.path.join(DEFAULT_WORKDIR, "benchmark.json"),
+                        help="path of the JSON results")
+    parser.add_argument("--compare", help="path of earlier JSON results to compare with")
+    parser.add_argument("--workdir", default=DEFAULT_WORKDIR,
+                        help="directory of the generated datasets and databases")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the data generator")
+    parser.add_argument("--workers", type=int, default=1, help="org chart worker processes")
+    parser.add_argument("--trace-memory", action="store_true",
+                        help="record the peak python allocations of each stage")
+    args = parser.parse_args(argv)
+    results = run_benchmark(args.sizes, args.workdir, seed=args.seed, workers=args.workers,
+                            trace_memory=args.trace_memory)
+    write_atomically(args.output, json.dumps(results, indent=2, default=to_builtin))
+    print(f"Benchmark results saved to {args.output}")
+    if args.compare:
+        with open(args.compare) as f:
+            compare_results(json.load(f), results)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,36 @@
+'''
+An in-process stand-in for the elasticsearch client, so the documents sent to
+elasticsearch can be generated, serialized and sent through the bulk helpers
+without a cluster. Every bulk request succeeds.
+'''
+from elasticsearch.serializer import JSONSerializer
+
+class StubTransport:
+    def __init__(self):
+        self.serializer = JSONSerializer()
+
+class StubElasticsearch:
+    '''
+    Accepts bulk requests and counts the documents and bytes received.
+    '''
+    def __init__(self):
+        self.transport = StubTransport()
+        self.documents = 0
+        self.bytes = 0
+        self.requests = 0
+
+    def bulk(self, body, **kwargs):
+        ''' Acknowledges every action of a bulk request body (newline delimited json). '''
+        lines = body.splitlines()
+        items = []
+        line = 0
+        while line < len(lines):
+            # Each action is a line like {"index": {...}}, followed by the
+            # document itself unless the action is a delete.
+            op_type = lines[line][2:lines[line].index('"', 2)]
+            items.append({op_type: {"status": 200 if op_type == "delete" else 201}})
+            line += 1 if op_type == "delete" else 2
+        self.documents += len(items)
+        self.bytes += len(body.encode("utf-8"))
+        self.requests += 1
+        return {"took": 0, "errors": False, "items": items}
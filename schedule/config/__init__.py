@@ -21,6 +21,13 @@ class SQLAlchemyConfig:
 class DataConfig:
     GEDS_DATA_URL = config.get('data', 'geds_data_url')
     ORIGINAL_DATA_PATH = config.get('data', 'original_data_path')
+    DOWNLOAD_PATH = config.get('data', 'download_path')
+    DOWNLOAD_MAX_AGE = float(config.get('data', 'download_max_age'))
+    DOWNLOAD_TIMEOUT = float(config.get('data', 'download_timeout'))
+    FETCH_CHUNK_SIZE = int(config.get('data', 'fetch_chunk_size'))
+    USE_FRAME_CACHE = config.getboolean('data', 'use_frame_cache')
+    FRAME_CACHE_DIR = config.get('data', 'frame_cache_dir')
+    ID_REGISTRY_PATH = config.get('data', 'id_registry_path')
     COLUMNS_TO_KEEP = ast.literal_eval(config.get('data', 'columns_to_keep'))
     COLUMN_ALIASES = ast.literal_eval(config.get('data', 'column_name_aliases'))
     ORG_SPECIAL_CHARACTERS = ast.literal_eval(config.get('data', 'org_special_characters'))
@@ -29,6 +36,32 @@ class DataConfig:
 class ElasticConfig:
     ELASTIC_URL = config.get('elasticsearch', 'elastic_url')
     ELASTIC_TIMEOUT = int(config.get('elasticsearch', 'timeout'))
+    THREAD_COUNT = int(config.get('elasticsearch', 'thread_count'))
+    CHUNK_SIZE = int(config.get('elasticsearch', 'chunk_size'))
+    MAX_CHUNK_BYTES = int(config.get('elasticsearch', 'max_chunk_bytes'))
+    MAX_RETRIES = int(config.get('elasticsearch', 'max_retries'))
+    INITIAL_BACKOFF = float(config.get('elasticsearch', 'initial_backoff'))
+    MAX_BACKOFF = float(config.get('elasticsearch', 'max_backoff'))
+    NUMBER_OF_REPLICAS = int(config.get('elasticsearch', 'number_of_replicas'))
+    INDEX_VERSIONS_TO_KEEP = int(config.get('elasticsearch', 'index_versions_to_keep'))
+
+class PipelineConfig:
+    REFRESH_MODE = config.get('pipeline', 'refresh_mode')
+    SNAPSHOT_PATH = config.get('pipeline', 'snapshot_path')
+    SHARDED = config.getboolean('pipeline', 'sharded')
+    CHECKPOINT_DIR = config.get('pipeline', 'checkpoint_dir') or None
+    DEPARTMENTS = [acronym.strip() for acronym in config.get('pipeline', 'departments').split(',')
+                   if acronym.strip()]
+    ORG_CHART_COMPRESSION = config.get('pipeline', 'org_chart_compression')
+    ORG_CHART_WORKERS = int(config.get('pipeline', 'org_chart_workers'))
+    CHUNK_SIZE = int(config.get('pipeline', 'chunk_size'))
+    CHUNK_DIR = config.get('pipeline', 'chunk_dir')
+    SUGGESTION_INDEX_PATH = config.get('pipeline', 'suggestion_index_path')
+    REPORT_PATH = config.get('pipeline', 'report_path')
+    PROMETHEUS_TEXTFILE_PATH = config.get('pipeline', 'prometheus_textfile_path') or None
+    TRACE_MEMORY = config.getboolean('pipeline', 'trace_memory')
+    PROFILE_STAGE = config.get('pipeline', 'profile_stage') or None
+    PROFILE_PATH = config.get('pipeline', 'profile_path')
 
 class TestConfig:
     TEST_DATA_PATH = config.get('data', 'test_data_path')
\ No newline at end of file
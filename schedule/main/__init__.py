@@ -1,28 +1,386 @@
-from schedule.main.prepare_data import prepare_data
+from schedule.config import DataConfig, ElasticConfig, PipelineConfig, SQLAlchemyConfig
+from schedule.main.prepare_data import prepare_data, update_geds_data
 from schedule.main.prepare_org_chart import prepare_org_chart
 
-from schedule.main.employee.employee_table import create_employee_table
-from schedule.main.department.department_table import create_department_table
-from schedule.main.organization.organization_table import create_organization_table
-from schedule.main.elasticsearch.elastic_bulk_upload import elastic_bulk_upload
+from schedule.main.sharding import build_shards, select_departments
+from schedule.main.chunked import prepare_chunks, get_structure_df
 
-def main():
+from schedule.main.employee.employee_table import (
+    create_employee_table, update_employee_table, EMPLOYEE_COLUMNS)
+from schedule.main.department.department_table import (
+    load_department_table, update_department_table, get_department_df, serialize_department_org_charts,
+    CHART_METRIC_COLUMNS, DEPARTMENT_COLUMNS)
+from schedule.main.organization.organization_table import (
+    load_organization_table, update_organization_table, get_organization_df, ORGANIZATION_COLUMNS)
+from schedule.main.organization.org_closure import (
+    create_org_closure_table, update_org_closure_table, CLOSURE_COLUMNS)
+from schedule.main.organization.org_chart_index import OrgChartIndex
+from schedule.main.elasticsearch.elastic_bulk_upload import (
+    elastic_bulk_upload, elastic_bulk_update, merge_dataframes, get_suggestion_frames)
+from schedule.main.suggestions import get_suggestion_df, write_suggestion_index, update_suggestion_index
+from schedule.main.utils.snapshot import (
+    take_snapshot, hash_rows, hash_organizations, hash_departments, compute_delta, load_snapshot, save_snapshot)
+from schedule.main.utils.instrumentation import RunReport
+from schedule.main.utils.db_utils import get_engine, select_keys, has_columns
+from schedule.main.utils.checkpoints import Checkpoints, StopPipeline, get_settings, hash_file
+from schedule.main.utils.frame_cache import get_cache_key
+from schedule.main.utils.fetch_data import is_processed, mark_processed
+
+# Names of the stages, in the order they run in. A run goes through the
+# stages of its refresh mode: full, sharded or delta.
+STAGES = ["prepare_data", "prepare_org_chart", "index_org_charts", "build_shards", "build_departments",
+          "build_organizations", "compute_delta", "create_employee_table", "create_department_table",
+          "create_organization_table", "create_org_closure_table", "update_department_table",
+          "update_org_closure_table", "update_organization_table",
+          "update_employee_table", "elastic_bulk_upload", "elastic_bulk_update", "write_suggestion_index",
+          "save_snapshot"]
+
+def main(from_stage=None, only_stage=None):
     '''
     The main function to be run in the scheduled job. Everything required in
-    the workflow should be called from here.
+    the workflow should be called from here. Each stage is measured and a
+    report of the run is written once it ends, whether it succeeded or not.
+    Stages whose inputs did not change since they last succeeded are
+    restored from their checkpoint or skipped (see checkpoints.py).
+    Args:
+        from_stage: the name of a stage to resume the run from; it and every
+            stage after it are run.
+        only_stage: the name of the only stage to run.
+    '''
+    report = RunReport(trace_memory=PipelineConfig.TRACE_MEMORY,
+                       profile_stage=PipelineConfig.PROFILE_STAGE,
+                       profile_path=PipelineConfig.PROFILE_PATH)
+    checkpoints = Checkpoints(PipelineConfig.CHECKPOINT_DIR, from_stage=from_stage,
+                              only_stage=only_stage)
+    status = "failed"
+    try:
+        try:
+            run_pipeline(report, checkpoints)
+        except StopPipeline:
+            pass
+        checkpoints.check_target_reached()
+        status = "success"
+    finally:
+        report.finish(status)
+        report.write_json(PipelineConfig.REPORT_PATH)
+        if PipelineConfig.PROMETHEUS_TEXTFILE_PATH:
+            report.write_prometheus(PipelineConfig.PROMETHEUS_TEXTFILE_PATH)
+
+def run_pipeline(report, checkpoints):
+    '''
+    Runs every stage of the workflow, recording them in the given RunReport.
+    '''
+    # Fetch GEDS data and write to csv, unless the run targets a stage: it
+    # then works on the data of the runs it completes
+    if checkpoints.target is None:
+        with report.stage("fetch_geds") as stage:
+            download = update_geds_data()
+            stage.details.update(download)
+        if (download["status"] != "local" and not download["changed"] and not PipelineConfig.DEPARTMENTS
+                and is_processed(DataConfig.DOWNLOAD_PATH)):
+            print("The GEDS data did not change since the last run, nothing to do")
+            return
+    snapshot = None
+    if PipelineConfig.REFRESH_MODE == "delta" and not PipelineConfig.DEPARTMENTS:
+        snapshot = load_snapshot(PipelineConfig.SNAPSHOT_PATH)
+        if snapshot is None:
+            print("No snapshot of a previous run was found, running a full refresh")
+        elif not has_current_tables():
+            print("The tables were written by an earlier version of the pipeline, running a full refresh")
+            snapshot = None
+    # Full refreshes can work through the employees in chunks (see chunked.py)
+    chunked = PipelineConfig.CHUNK_SIZE > 0 and snapshot is None and not PipelineConfig.DEPARTMENTS
+    if PipelineConfig.CHUNK_SIZE > 0 and not chunked:
+        print("Only full refreshes run in chunks, loading the whole GEDS data")
+    def run_prepare_data(stage):
+        df = prepare_chunks() if chunked else prepare_data()
+        stage.rows_out = len(df)
+        return df
+    df = checkpoints.run(report, "prepare_data", run_prepare_data, save=False,
+                         source=lambda: get_cache_key(DataConfig.ORIGINAL_DATA_PATH, DataConfig))
+    if PipelineConfig.DEPARTMENTS:
+        # The snapshot describes the whole dataset, so it is left as is
+        rebuild_departments(df, PipelineConfig.DEPARTMENTS, report)
+        return
+    if snapshot is None and PipelineConfig.SHARDED:
+        org_df, dept_df = sharded_refresh(df, checkpoints, report)
+    elif snapshot is None:
+        org_df, dept_df = full_refresh(df, checkpoints, report)
+    else:
+        org_df, dept_df = delta_refresh(df, snapshot, checkpoints, report)
+    # Record what was written so the next run can compute a delta
+    checkpoints.run(report, "save_snapshot",
+                    lambda stage: save_snapshot(take_snapshot(df, org_df, dept_df), PipelineConfig.SNAPSHOT_PATH),
+                    rows_in=len(df), writes=True, save=False)
+    if checkpoints.target is None:
+        mark_processed(DataConfig.DOWNLOAD_PATH)
+
+def build_org_charts(df, checkpoints, report, rows_in=None):
+    '''
+    Builds the org charts, and indexes them so later stages can look up
+    departments and paths to organizations without searching the trees.
+    Returns the english org chart and the english and french indexes.
     '''
-    # Fetch GEDS data and write to csv 
-    df = prepare_data()
-    # Create the employees table
-    create_employee_table(df)
     # Load the org chart
-    org_chart_en, org_chart_fr = prepare_org_chart(df)
+    org_chart_en, org_chart_fr = checkpoints.run(
+        report, "prepare_org_chart", lambda stage: prepare_org_chart(df), inputs=["prepare_data"],
+        rows_in=len(df) if rows_in is None else rows_in)
+    # The indexes are quicker to build than to load
+    org_index_en, org_index_fr = checkpoints.run(
+        report, "index_org_charts", lambda stage: (OrgChartIndex(org_chart_en), OrgChartIndex(org_chart_fr)),
+        inputs=["prepare_org_chart"], save=False)
+    return org_chart_en, org_index_en, org_index_fr
+
+def full_refresh(df, checkpoints, report):
+    '''
+    Rebuilds every table and elasticsearch index from scratch. Returns the
+    organizations and departments dataframes.
+    Args:
+        df: a pandas dataframe, as returned by prepare_data, or a ChunkedFrame
+            (see chunked.py).
+    '''
+    structure_df = get_structure_df(df)
+    org_chart_en, org_index_en, org_index_fr = build_org_charts(structure_df, checkpoints, report,
+                                                                rows_in=len(df))
+    def build_departments(stage):
+        dept_df = serialize_department_org_charts(get_department_df(structure_df), org_index_en, org_index_fr)
+        stage.rows_out = len(dept_df)
+        stage.details["org_charts"] = get_chart_metrics(dept_df)
+        return dept_df
+    dept_df = checkpoints.run(report, "build_departments", build_departments,
+                              inputs=["index_org_charts"], rows_in=len(df),
+                              settings={"compression": PipelineConfig.ORG_CHART_COMPRESSION})
+    def build_organizations(stage):
+        org_df = get_organization_df(structure_df, org_chart_en, org_index_en=org_index_en)
+        stage.rows_out = len(org_df)
+        return org_df
+    org_df = checkpoints.run(report, "build_organizations", build_organizations,
+                             inputs=["index_org_charts"], rows_in=len(df))
+    load_tables(df, org_df, dept_df, ["build_departments", "build_organizations"], checkpoints, report)
+    return org_df, dept_df
+
+def sharded_refresh(df, checkpoints, report):
+    '''
+    Rebuilds every table and elasticsearch index from scratch, like
+    full_refresh, building the org charts one department at a time in a pool
+    of processes (see sharding.py). Returns the organizations and departments
+    dataframes.
+    '''
+    def run_build_shards(stage):
+        org_df, dept_df = build_shards(get_structure_df(df))
+        stage.rows_out = len(org_df)
+        stage.details["org_charts"] = get_chart_metrics(dept_df)
+        return org_df, dept_df
+    org_df, dept_df = checkpoints.run(report, "build_shards", run_build_shards, inputs=["prepare_data"],
+                                      rows_in=len(df),
+                                      settings={"compression": PipelineConfig.ORG_CHART_COMPRESSION})
+    load_tables(df, org_df, dept_df, ["build_shards"], checkpoints, report)
+    return org_df, dept_df
+
+def load_tables(df, org_df, dept_df, inputs, checkpoints, report):
+    '''
+    Replaces the tables and elasticsearch indices with the employees,
+    organizations and departments of a full refresh.
+    Args:
+        inputs: the names of the stages org_df and dept_df come from.
+    '''
+    sql_settings = get_settings(SQLAlchemyConfig)
+    # Create the employees table
+    def load_employees(stage):
+        create_employee_table(df)
+        stage.rows_out = len(df)
+    checkpoints.run(report, "create_employee_table", load_employees, inputs=["prepare_data"],
+                    settings=sql_settings, rows_in=len(df), writes=True)
     # Create departments table
-    dept_df = create_department_table(df, org_chart_en, org_chart_fr)
+    def load_departments(stage):
+        load_department_table(dept_df)
+        stage.rows_out = len(dept_df)
+    checkpoints.run(report, "create_department_table", load_departments, inputs=inputs,
+                    settings=sql_settings, writes=True)
     # Create organizations table
-    org_df = create_organization_table(df, org_chart_en, org_chart_fr)
+    def load_organizations(stage):
+        load_organization_table(org_df)
+        stage.rows_out = len(org_df)
+    checkpoints.run(report, "create_organization_table", load_organizations, inputs=inputs,
+                    settings=sql_settings, writes=True)
+    def load_closure(stage):
+        stage.rows_out = len(create_org_closure_table(org_df))
+    checkpoints.run(report, "create_org_closure_table", load_closure, inputs=inputs,
+                    settings=sql_settings, writes=True)
     # Upload data to elasticsearch
-    elastic_bulk_upload(df, org_df, dept_df)
+    def upload(stage):
+        stats = elastic_bulk_upload(df, org_df, dept_df)
+        stage.rows_out = sum(index_stats["success"] for index_stats in stats.values())
+    checkpoints.run(report, "elastic_bulk_upload", upload, inputs=inputs,
+                    settings=get_settings(ElasticConfig), rows_in=len(df), writes=True)
+    # Write the suggestions served without elasticsearch
+    run_write_suggestions(lambda: get_suggestion_frames(df, org_df, dept_df), inputs, checkpoints, report,
+                          rows_in=len(df))
+
+def run_write_suggestions(get_suggestions, inputs, checkpoints, report, rows_in=None):
+    '''
+    Runs the stage writing the suggestion file (see suggestions.py), unless no
+    suggestion_index_path is configured.
+    Args:
+        get_suggestions: a function returning the suggestions, as a dataframe
+            or an iterable of them.
+        inputs: the names of the stages the suggestions come from.
+    '''
+    if not PipelineConfig.SUGGESTION_INDEX_PATH:
+        return
+    def write_suggestions(stage):
+        stage.rows_out = write_suggestion_index(get_suggestions(), PipelineConfig.SUGGESTION_INDEX_PATH)
+    checkpoints.run(report, "write_suggestion_index", write_suggestions, inputs=inputs,
+                    settings={"path": PipelineConfig.SUGGESTION_INDEX_PATH}, rows_in=rows_in, writes=True)
+
+def delta_refresh(df, snapshot, checkpoints, report):
+    '''
+    Only writes the employees, organizations and departments that were
+    inserted, updated or deleted since the run that produced the snapshot.
+    Returns the organizations and departments dataframes.
+    '''
+    org_chart_en, org_index_en, org_index_fr = build_org_charts(df, checkpoints, report)
+    def run_compute_delta(stage):
+        # Departments: only serialize the org charts of departments whose org
+        # structure changed
+        dept_df = get_department_df(df)
+        dept_delta = compute_delta(snapshot["departments"], hash_departments(df))
+        changed = dept_df["dept_id"].isin(dept_delta["inserts"] + dept_delta["updates"])
+        changed_depts = serialize_department_org_charts(dept_df[changed], org_index_en, org_index_fr)
+        stage.details["org_charts"] = get_chart_metrics(changed_depts)
+        # Employees are compared using the documents sent to elasticsearch,
+        # which contain every column of the employees table
+        org_df = get_organization_df(df, org_chart_en, org_index_en=org_index_en)
+        emp_docs, org_docs = merge_dataframes(df, org_df, dept_df)
+        return {
+            "dept_df": dept_df,
+            "changed_depts": changed_depts,
+            "dept_delta": dept_delta,
+            "org_df": org_df,
+            "org_delta": compute_delta(snapshot["organizations"], hash_organizations(org_df)),
+            "emp_docs": emp_docs,
+            "emp_delta": compute_delta(snapshot["employees"], hash_rows(emp_docs, "employee_id")),
+            "org_docs": org_docs,
+        }
+    # The delta is relative to the snapshot, so it is part of the fingerprint
+    delta = checkpoints.run(report, "compute_delta", run_compute_delta, inputs=["index_org_charts"],
+                            rows_in=len(df),
+                            settings={"compression": PipelineConfig.ORG_CHART_COMPRESSION,
+                                      "snapshot": hash_file(PipelineConfig.SNAPSHOT_PATH)})
+    dept_delta, org_delta, emp_delta = delta["dept_delta"], delta["org_delta"], delta["emp_delta"]
+    changed_org_ids = org_delta["inserts"] + org_delta["updates"]
+    changed_emp_ids = emp_delta["inserts"] + emp_delta["updates"]
+    sql_settings = get_settings(SQLAlchemyConfig)
+    def update_departments(stage):
+        update_department_table(delta["changed_depts"], dept_delta["deletes"])
+        stage.rows_out = len(delta["changed_depts"]) + len(dept_delta["deletes"])
+    checkpoints.run(report, "update_department_table", update_departments, inputs=["compute_delta"],
+                    settings=sql_settings, writes=True)
+    def update_closure(stage):
+        # The departments of the changed organizations, before and after the
+        # change, since the table still holds their previous departments
+        org_df = delta["org_df"]
+        dept_ids = set(org_df.loc[org_df["org_id"].isin(changed_org_ids), "dept_id"].tolist())
+        dept_ids.update(select_keys(get_engine(), "organizations", "dept_id", "org_id",
+                                    list(changed_org_ids) + list(org_delta["deletes"])))
+        stage.rows_out = len(update_org_closure_table(org_df, sorted(dept_ids)))
+    checkpoints.run(report, "update_org_closure_table", update_closure, inputs=["compute_delta"],
+                    settings=sql_settings, writes=True)
+    def update_organizations(stage):
+        changed_orgs = delta["org_df"][delta["org_df"]["org_id"].isin(changed_org_ids)]
+        update_organization_table(changed_orgs, org_delta["deletes"])
+        stage.rows_out = len(changed_orgs) + len(org_delta["deletes"])
+    checkpoints.run(report, "update_organization_table", update_organizations, inputs=["compute_delta"],
+                    settings=sql_settings, writes=True)
+    def update_employees(stage):
+        changed_emps = df[df["employee_id"].isin(changed_emp_ids)]
+        update_employee_table(changed_emps, emp_delta["deletes"])
+        stage.rows_out = len(changed_emps) + len(emp_delta["deletes"])
+    checkpoints.run(report, "update_employee_table", update_employees, inputs=["compute_delta"],
+                    settings=sql_settings, writes=True)
+    def update_documents(stage):
+        emp_docs, org_docs = delta["emp_docs"], delta["org_docs"]
+        stats = elastic_bulk_update(emp_docs[emp_docs["employee_id"].isin(changed_emp_ids)],
+                                    org_docs[org_docs["org_id"].isin(changed_org_ids)],
+                                    emp_delta["deletes"], org_delta["deletes"])
+        stage.rows_out = sum(index_stats["success"] for index_stats in stats.values())
+    checkpoints.run(report, "elastic_bulk_update", update_documents, inputs=["compute_delta"],
+                    settings=get_settings(ElasticConfig), writes=True)
+    # The delta has every document at hand, so the suggestion file is rewritten whole
+    run_write_suggestions(lambda: get_suggestion_df(delta["emp_docs"], delta["org_docs"]), ["compute_delta"],
+                          checkpoints, report, rows_in=len(delta["emp_docs"]) + len(delta["org_docs"]))
+    for name, entity_delta in [("departments", dept_delta), ("organizations", org_delta),
+                               ("employees", emp_delta)]:
+        print(f"{name}: {len(entity_delta['inserts'])} inserted, {len(entity_delta['updates'])} updated, "
+              f"{len(entity_delta['deletes'])} deleted")
+    return delta["org_df"], delta["dept_df"]
+
+def rebuild_departments(df, departments, report):
+    '''
+    Rebuilds the given departments only: their rows are upserted into the
+    tables and elasticsearch indices, and the organizations and employees
+    they no longer have are deleted. Other departments are left untouched.
+    Args:
+        df: a pandas dataframe, as returned by prepare_data.
+        departments: a list of department acronyms.
+        report: the RunReport of the run.
+    '''
+    if not has_current_tables():
+        raise RuntimeError("Cannot rebuild departments before a full refresh has created the "
+                           "tables with their current columns")
+    with report.stage("select_departments", rows_in=len(df)) as stage:
+        df = select_departments(df, departments)
+        stage.rows_out = len(df)
+    if not len(df):
+        print("Nothing to rebuild")
+        return
+    with report.stage("build_shards", rows_in=len(df)) as stage:
+        org_df, dept_df = build_shards(df)
+        stage.rows_out = len(org_df)
+        stage.details["org_charts"] = get_chart_metrics(dept_df)
+    dept_ids = dept_df["dept_id"].tolist()
+    with report.stage("update_department_table") as stage:
+        update_department_table(dept_df, [])
+        stage.rows_out = len(dept_df)
+    with report.stage("update_organization_table") as stage:
+        deleted_org_ids = get_deleted_ids("organizations", "org_id", dept_ids, org_df["org_id"])
+        update_organization_table(org_df, deleted_org_ids)
+        stage.rows_out = len(org_df) + len(deleted_org_ids)
+    with report.stage("update_org_closure_table") as stage:
+        stage.rows_out = len(update_org_closure_table(org_df, dept_ids))
+    with report.stage("update_employee_table") as stage:
+        deleted_emp_ids = get_deleted_ids("employees", "employee_id", dept_ids, df["employee_id"])
+        update_employee_table(df, deleted_emp_ids)
+        stage.rows_out = len(df) + len(deleted_emp_ids)
+    with report.stage("elastic_bulk_update") as stage:
+        emp_docs, org_docs = merge_dataframes(df, org_df, dept_df)
+        stats = elastic_bulk_update(emp_docs, org_docs, deleted_emp_ids, deleted_org_ids)
+        stage.rows_out = sum(index_stats["success"] for index_stats in stats.values())
+    if PipelineConfig.SUGGESTION_INDEX_PATH:
+        with report.stage("update_suggestion_index") as stage:
+            stage.rows_out = update_suggestion_index(get_suggestion_df(emp_docs, org_docs), dept_ids,
+                                                     PipelineConfig.SUGGESTION_INDEX_PATH)
+    print(f"Rebuilt {len(dept_df)} departments: {org_df['org_id'].nunique()} organizations and "
+          f"{len(df)} employees written, {len(deleted_org_ids)} organizations and "
+          f"{len(deleted_emp_ids)} employees deleted")
+
+def get_deleted_ids(table_name, key, dept_ids, current_ids):
+    ''' Returns the ids of the rows of the given departments that are not in current_ids. '''
+    current_ids = set(int(i) for i in current_ids)
+    return [i for i in select_keys(get_engine(), table_name, key, "dept_id", dept_ids)
+            if i not in current_ids]
+
+def has_current_tables():
+    ''' Returns whether every table exists with the columns the pipeline writes. '''
+    engine = get_engine()
+    return all(has_columns(engine, table, columns) for table, columns in [
+        ("employees", EMPLOYEE_COLUMNS), ("organizations", ORGANIZATION_COLUMNS),
+        ("departments", DEPARTMENT_COLUMNS), ("org_closure", CLOSURE_COLUMNS)])
+
+def get_chart_metrics(dept_df):
+    ''' Returns the size and serialization time of each department's org charts. '''
+    metrics = dept_df[["dept_id", "department_en"] + CHART_METRIC_COLUMNS]
+    return metrics.astype(object).where(metrics.notna(), None).to_dict("records")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,190 @@
+'''
+Out-of-core execution of full refreshes. The GEDS csv is read and preprocessed
+a chunk of employees at a time, and the chunks are kept on disk; the employees
+table and the employee documents are then written from them a chunk at a
+time, so memory use is bounded by the chunk size rather than the size of the
+dataset.
+
+Only the distinct org structures of the employees are held in memory, with
+the number of employees sharing each one: they are all the org charts, the
+organizations and the departments are built from. The org_id and dept_id keys
+number the compound organization names and department names of the whole
+dataset, gathered while the chunks are written, so they are the ones an
+in-memory run gives; with the id registry enabled, every id is looked up in
+the registry instead, as prepare_data does.
+'''
+import glob
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+
+from schedule.config import DataConfig, PipelineConfig
+from schedule.main.prepare_data import (
+    update_geds_data, preprocess_columns, create_table_keys, assign_group_keys, get_key_categories,
+    get_key_ids, apply_key_ids)
+from schedule.main.prepare_org_chart import EMPLOYEE_COUNT_COLUMN
+from schedule.main.utils.dtype_plan import apply_dtype_plan, ID_COLUMNS, ID_DTYPE
+from schedule.main.utils.frame_cache import get_cache_key
+from schedule.main.utils.id_registry import open_id_registry
+
+# Columns of the org structure frame, besides the keys and employee counts:
+# everything the org charts, organizations and departments are built from
+STRUCTURE_COLUMNS = ["department_en", "department_fr", "org_name_en", "org_name_fr",
+                     "compound_name_en", "compound_name_fr", "org_structure_en", "org_structure_fr",
+                     "job_title_en", "job_title_fr"]
+CHUNKED_FRAME_NAME = "chunked_frame.pkl"
+# Stands in for the missing values of the structure columns while grouping, as
+# groupby leaves out rows with missing keys (dropna=False needs pandas 1.1)
+MISSING_KEY = "\x00"
+
+class ChunkedFrame:
+    '''
+    The prepared GEDS dataset, kept on disk as chunks of preprocessed
+    employees. Iterating over it yields the chunks with their keys, like
+    prepare_data would return them; indexing it with a list of columns
+    returns a ChunkedFrame whose chunks only hold these columns.
+    Args:
+        paths: the paths of the pickled chunks, in order.
+        structure: a pandas dataframe with one row per distinct org structure
+            (see get_structure_df).
+        categories: the names numbered by the keys, as returned by
+            prepare_data.get_key_categories.
+        n_rows: the number of employees.
+        columns: the columns the chunks are restricted to, or None.
+        key_ids: the registry ids of the categories, as returned by
+            prepare_data.get_key_ids, or None if the id registry is disabled.
+    '''
+    def __init__(self, paths, structure, categories, n_rows, columns=None, key_ids=None):
+        self.paths = paths
+        self.structure = structure
+        self.categories = categories
+        self.n_rows = n_rows
+        self.columns = columns
+        self.key_ids = key_ids
+
+    def __len__(self):
+        return self.n_rows
+
+    def __getitem__(self, columns):
+        return ChunkedFrame(self.paths, self.structure, self.categories, self.n_rows, list(columns),
+                            self.key_ids)
+
+    def __iter__(self):
+        # Employees are numbered by the registry in the order of the chunks,
+        # so every pass over them gets the same ids
+        registry = open_id_registry() if self.key_ids is not None else None
+        try:
+            for path in self.paths:
+                chunk = create_table_keys(pd.read_pickle(path), self.categories)
+                if registry is not None:
+                    chunk = apply_key_ids(chunk, self.key_ids)
+                    chunk["employee_id"] = registry.get_employee_ids(chunk)
+                chunk = chunk.astype(dict((column, ID_DTYPE) for column in ID_COLUMNS))
+                yield chunk if self.columns is None else chunk[self.columns]
+        finally:
+            # Registering employees is idempotent, so the ids of a pass cut
+            # short are kept too
+            if registry is not None:
+                registry.close()
+
+    def with_key_ids(self, key_ids):
+        ''' Returns a ChunkedFrame with the given registry ids in place of the positional keys. '''
+        return ChunkedFrame(self.paths, apply_key_ids(self.structure, key_ids), self.categories,
+                            self.n_rows, self.columns, key_ids)
+
+def prepare_chunks(chunk_size=None):
+    '''
+    Returns the prepared GEDS dataset as a ChunkedFrame. The chunks written by
+    an earlier run over the same csv and configuration are reused if the frame
+    cache is enabled; they hold positional keys, and the ids of the id
+    registry are applied to them when they are read.
+    Args:
+        chunk_size: the number of employees per chunk; defaults to the
+            configured chunk_size.
+    '''
+    if chunk_size is None:
+        chunk_size = PipelineConfig.CHUNK_SIZE
+    if os.path.isfile(DataConfig.ORIGINAL_DATA_PATH):
+        print("Geds data is already here, load from csv")
+    else:
+        update_geds_data()
+    cache_key = get_cache_key(DataConfig.ORIGINAL_DATA_PATH, DataConfig)
+    directory = os.path.join(PipelineConfig.CHUNK_DIR, f"geds_{cache_key}_{chunk_size}")
+    frame_path = os.path.join(directory, CHUNKED_FRAME_NAME)
+    if DataConfig.USE_FRAME_CACHE and os.path.isfile(frame_path):
+        print("Loaded the prepared geds chunks from the cache")
+        return apply_id_registry(pd.read_pickle(frame_path))
+    # Chunks of other versions of the data are not needed any more
+    for stale_directory in glob.glob(os.path.join(PipelineConfig.CHUNK_DIR, "geds_*")):
+        shutil.rmtree(stale_directory)
+    os.makedirs(directory)
+    paths, structure, n_rows = [], None, 0
+    for idx, chunk in enumerate(pd.read_csv(DataConfig.ORIGINAL_DATA_PATH, chunksize=chunk_size)):
+        # The index of the chunks runs on across the csv, so the employee ids
+        # are the ones of an in-memory run
+        chunk = preprocess_columns(chunk)
+        paths.append(os.path.join(directory, f"chunk_{idx:05d}.pkl"))
+        chunk.to_pickle(paths[-1])
+        structure = merge_structures(structure, get_structure_counts(chunk))
+        n_rows += len(chunk)
+    categories = get_key_categories(structure)
+    structure = apply_dtype_plan(assign_group_keys(structure, categories))
+    print(f"Prepared {n_rows} employees in {len(paths)} chunks of {chunk_size}, with "
+          f"{len(structure)} distinct org structures")
+    chunked_df = ChunkedFrame(paths, structure, categories, n_rows)
+    # Written last, so a partial set of chunks is never reused
+    pd.to_pickle(chunked_df, frame_path + ".part")
+    os.replace(frame_path + ".part", frame_path)
+    return apply_id_registry(chunked_df)
+
+def apply_id_registry(chunked_df):
+    '''
+    Returns chunked_df with the organization and department ids of the id
+    registry, registering the new ones; the employees are registered as the
+    chunks are read. Returns chunked_df as is if the registry is disabled.
+    '''
+    registry = open_id_registry()
+    if registry is None:
+        return chunked_df
+    with registry:
+        return chunked_df.with_key_ids(get_key_ids(registry, chunked_df.categories))
+
+def get_structure_counts(df):
+    '''
+    Returns the distinct STRUCTURE_COLUMNS of df, in the order they first
+    appear in, with the number of rows sharing them in EMPLOYEE_COUNT_COLUMN.
+    '''
+    counts = pd.Series(1, index=df.index, name=EMPLOYEE_COUNT_COLUMN)
+    return sum_by_structure(df, counts)
+
+def merge_structures(structure, chunk_structure):
+    '''
+    Adds the org structures of a chunk to those of the chunks before it,
+    summing the employee counts of the structures found in both.
+    '''
+    if structure is None:
+        return chunk_structure
+    merged = pd.concat([structure, chunk_structure], ignore_index=True)
+    return sum_by_structure(merged, merged[EMPLOYEE_COUNT_COLUMN])
+
+def sum_by_structure(df, counts):
+    '''
+    Sums counts over the distinct STRUCTURE_COLUMNS of df, in the order they
+    first appear in; missing values are grouped like any other value.
+    Returns:
+        A pandas dataframe with the STRUCTURE_COLUMNS and the sums in
+        EMPLOYEE_COUNT_COLUMN.
+    '''
+    keys = [df[column].fillna(MISSING_KEY) for column in STRUCTURE_COLUMNS]
+    sums = counts.groupby(keys, sort=False).sum().rename(EMPLOYEE_COUNT_COLUMN).reset_index()
+    sums[STRUCTURE_COLUMNS] = sums[STRUCTURE_COLUMNS].replace(MISSING_KEY, np.nan)
+    return sums
+
+def get_structure_df(df):
+    '''
+    Returns the frame the org charts, organizations and departments are built
+    from: the org structures of a ChunkedFrame, or the dataframe itself.
+    '''
+    return df.structure if isinstance(df, ChunkedFrame) else df
@@ -1,58 +1,153 @@
-import json
+import time
 
-from sqlalchemy import create_engine
-from sqlalchemy.types import Integer, Text
+import numpy as np
+from sqlalchemy.types import Integer, LargeBinary, Text
 
-from schedule.config import SQLAlchemyConfig
-from schedule.main.utils.db_utils import assemble_sqlalchemy_url
+from schedule.config import PipelineConfig
+from schedule.main.utils.db_utils import get_engine, upsert_rows
+from schedule.main.utils.sql_loader import load_table
+from schedule.main.organization.org_chart_index import OrgChartIndex
+from schedule.main.utils.parallel import get_worker_count, map_in_processes
+from schedule.main.utils.serialization import compress, dumps, get_codec
 
-def create_department_table(df, org_chart_en, org_chart_fr):
+# Columns of the departments table and their sql types
+DEPARTMENT_DTYPES = {
+    "dept_id": Integer,
+    "department_en": Text,
+    "department_fr": Text,
+    "org_chart_en": Text,
+    "org_chart_fr": Text,
+    # The org charts compressed with org_chart_encoding ("gzip" or "zstd"),
+    # so they can be served as is; NULL when compression is disabled.
+    "org_chart_en_compressed": LargeBinary,
+    "org_chart_fr_compressed": LargeBinary,
+    "org_chart_encoding": Text,
+}
+DEPARTMENT_COLUMNS = list(DEPARTMENT_DTYPES)
+# Size and serialization time of the org charts, kept in the departments
+# dataframe for the run report but not written to the database.
+CHART_METRIC_COLUMNS = [f"org_chart_{lang}_{metric}" for lang in ["en", "fr"]
+                        for metric in ["bytes", "compressed_bytes", "seconds"]]
+
+def create_department_table(df, org_chart_en, org_chart_fr, org_index_en=None, org_index_fr=None):
     '''
-    Creates the department table in the database.
+    Creates the department table in the database. OrgChartIndex objects of the
+    org charts can be passed in to reuse ones built by an earlier stage.
     '''
+    if org_index_en is None:
+        org_index_en = OrgChartIndex(org_chart_en)
+    if org_index_fr is None:
+        org_index_fr = OrgChartIndex(org_chart_fr)
     # Create database connection
-    engine = create_engine(assemble_sqlalchemy_url(SQLAlchemyConfig))
-    # Keep unique departments as rows
-    dept_df = df[["dept_id", "department_en", "department_fr"]].drop_duplicates()
-    # Create column to hold serialized org chart
-    dept_df["org_chart_en"] = dept_df["department_en"].apply(
-        lambda x: get_department_org_chart(x, org_chart_en))
-    dept_df["org_chart_fr"] = dept_df["department_fr"].apply(
-        lambda x: get_department_org_chart(x, org_chart_fr))
+    dept_df = get_department_df(df)
+    dept_df = serialize_department_org_charts(dept_df, org_index_en, org_index_fr)
+    load_department_table(dept_df)
+    return dept_df
+
+def load_department_table(dept_df):
+    ''' Replaces the departments table with the departments of dept_df. '''
     # Now write department's dataframe to another table in our database. In the
     # current use case, we only need to access each department's org chart from
     # the root.
-    dept_df[["dept_id", "department_en", "department_fr", "org_chart_en", "org_chart_fr"]].to_sql(
-        "departments",
-        engine,
-        if_exists="replace",
-        index=False,
-        dtype={
-            "dept_id": Integer,
-            "department_en": Text,
-            "department_fr": Text,
-            "org_chart_en": Text, 
-            "org_chart_fr": Text,
-        })
+    load_table(dept_df[DEPARTMENT_COLUMNS], "departments", DEPARTMENT_DTYPES,
+               primary_key="dept_id")
+
+def update_department_table(dept_df, deleted_ids):
+    '''
+    Upserts the given departments into the departments table and deletes the
+    departments whose id is in deleted_ids.
+    '''
+    upsert_rows(get_engine(), "departments", "dept_id", dept_df[DEPARTMENT_COLUMNS],
+                DEPARTMENT_DTYPES, deleted_keys=deleted_ids)
+
+def get_department_df(df):
+    ''' Returns a dataframe with one row per department. '''
+    # Keep unique departments as rows
+    return df[["dept_id", "department_en", "department_fr"]].drop_duplicates()
+
+def serialize_department_org_charts(dept_df, org_index_en, org_index_fr, workers=None):
+    '''
+    Adds columns holding the serialized english and french org chart of each
+    department, compressed with the configured codec, along with their size
+    and the time spent serializing them (see CHART_METRIC_COLUMNS). The
+    departments of each language are split into one batch per worker process.
+    '''
+    if workers is None:
+        workers = get_worker_count(PipelineConfig.ORG_CHART_WORKERS)
+    dept_df = dept_df.copy()
+    codec = get_codec(PipelineConfig.ORG_CHART_COMPRESSION)
+    dept_df["org_chart_encoding"] = codec if codec != "none" else None
+    langs = [("en", org_index_en), ("fr", org_index_fr)]
+    batches = [(lang, batch) for lang, _ in langs
+               for batch in np.array_split(np.arange(len(dept_df)), max(workers, 1))]
+    org_charts = dict((lang, org_index.org_chart) for lang, org_index in langs)
+    tasks = [(dept_df[f"department_{lang}"].iloc[batch].tolist(), org_charts[lang], codec)
+             for lang, batch in batches]
+    results = map_in_processes(serialize_org_charts_batch, tasks, workers)
+    for lang, _ in langs:
+        # Batches are merged back in order
+        add_org_chart_columns(dept_df, lang, [result for (batch_lang, _), result
+                                              in zip(batches, results) if batch_lang == lang])
+        print_org_chart_summary(dept_df, lang)
     return dept_df
 
-def get_department_org_chart(department, org_chart):
+def add_org_chart_columns(dept_df, lang, results):
     '''
-    Gets the org chart assiciated with a department name.
+    Adds the org chart columns of a language to dept_df, in place.
     Args:
-        department: a string containing the department name.
-        org_chart: a python dict containing the org chart.
+        dept_df: a pandas dataframe of departments.
+        lang: the language of the org charts ("en" or "fr").
+        results: the dicts returned by serialize_org_charts for consecutive
+            batches of the departments of dept_df.
+    '''
+    for column in results[0]:
+        dept_df[f"org_chart_{lang}{column}"] = [value for result in results
+                                                for value in result[column]]
+
+def print_org_chart_summary(dept_df, lang):
+    ''' Prints the number, size and serialization time of the org charts of a language. '''
+    unmatched = dept_df[f"org_chart_{lang}"].isna().sum()
+    if unmatched:
+        print(f"could not find the org chart of {unmatched} departments ({lang})")
+    print(f"Serialized {len(dept_df) - unmatched} org charts ({lang}) in "
+          f"{dept_df[f'org_chart_{lang}_seconds'].sum():.2f}s: "
+          f"{dept_df[f'org_chart_{lang}_bytes'].sum():.0f} bytes, "
+          f"{dept_df[f'org_chart_{lang}_compressed_bytes'].sum():.0f} compressed")
+
+def serialize_org_charts_batch(departments, org_chart, codec):
+    ''' Serializes the org charts of a batch of departments; run in a worker process. '''
+    return serialize_org_charts(departments, OrgChartIndex(org_chart), codec)
+
+def serialize_org_charts(departments, org_index, codec):
+    '''
+    Serializes the org chart of each department.
+    Args:
+        departments: a list of department names.
+        org_index: an OrgChartIndex of the org chart.
+        codec: the compression codec, as returned by serialization.get_codec.
     Returns:
-        dept_org_chart: the org chart for the department being searched.
-    '''
-
-    # Find the department matching the search; from context we know department will be
-    # unique and at the first level of the tree.
-    dept = [dept for dept in org_chart
-                     if dept.get("name") == department]
-    if dept:
-        dept = dept[0]
-        # Return serialized json 
-        return json.dumps(dept)
-    return json.dumps(org_chart)
-    
\ No newline at end of file
+        A dict of column suffix to list of values, one per department: the
+        json ("") and compressed ("_compressed") org charts, and their
+        metrics ("_bytes", "_compressed_bytes", "_seconds"). Departments
+        missing from the org chart get None.
+    '''
+    # Department names are looked up in a dict, and the nested dicts of every
+    # department are built in a single pass over the tree.
+    roots = [org_index.find_department(department) for department in departments]
+    found = [root for root in roots if root is not None]
+    trees = iter(org_index.org_chart.to_dicts(found))
+    charts = {"": [], "_compressed": [], "_bytes": [], "_compressed_bytes": [], "_seconds": []}
+    for root in roots:
+        if root is None:
+            for values in charts.values():
+                values.append(None)
+            continue
+        start = time.perf_counter()
+        chart = dumps(next(trees))
+        compressed = compress(chart, codec)
+        charts[""].append(chart)
+        charts["_compressed"].append(compressed)
+        charts["_bytes"].append(len(chart.encode("utf-8")))
+        charts["_compressed_bytes"].append(len(compressed) if compressed is not None else None)
+        charts["_seconds"].append(time.perf_counter() - start)
+    return charts
@@ -0,0 +1,127 @@
+'''
+Parallel bulk indexing into elasticsearch. Actions are split into batches
+that are sent concurrently by a pool of threads, each using the streaming
+bulk helper so that rejected (429) documents are retried with exponential
+backoff. Every call returns statistics on the documents that failed.
+'''
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from contextlib import contextmanager
+from itertools import islice
+
+from elasticsearch import helpers
+
+from schedule.config import ElasticConfig
+
+# Maximum number of failed documents whose details are kept in the stats
+MAX_REPORTED_FAILURES = 100
+# Settings applied to an index while it is being bulk loaded
+BULK_LOAD_SETTINGS = {"refresh_interval": "-1", "number_of_replicas": 0}
+
+def bulk_index(es, actions, bulk_load_indices=()):
+    '''
+    Sends bulk actions to elasticsearch in parallel.
+
+    Args:
+        es:
+            An instance of the ES client.
+        actions:
+            An iterable of bulk actions (dicts, as accepted by the bulk helpers).
+        bulk_load_indices:
+            Names of the indices being (re)loaded in full; refreshes and
+            replicas are disabled on them for the duration of the load.
+
+    Returns:
+        stats:
+            A dict with the number of documents that succeeded and failed, the
+            number of failures per status and error type, and the details of
+            the first MAX_REPORTED_FAILURES failed documents.
+    '''
+    with bulk_load_settings(es, bulk_load_indices):
+        return run_bulk(es, actions)
+
+def run_bulk(es, actions):
+    ''' Sends the actions in batches from a thread pool; see bulk_index. '''
+    stats = {"success": 0, "failed": 0, "errors": Counter(), "failures": []}
+    actions = iter(actions)
+    batches = iter(lambda: list(islice(actions, ElasticConfig.CHUNK_SIZE)), [])
+    with ThreadPoolExecutor(max_workers=ElasticConfig.THREAD_COUNT) as executor:
+        in_flight = set()
+        for batch in batches:
+            # Bound the number of batches held in memory
+            if len(in_flight) >= 2 * ElasticConfig.THREAD_COUNT:
+                done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    merge_stats(stats, future.result())
+            in_flight.add(executor.submit(index_batch, es, batch))
+        for future in in_flight:
+            merge_stats(stats, future.result())
+    stats["errors"] = dict(stats["errors"])
+    return stats
+
+def index_batch(es, batch):
+    '''
+    Indexes one batch of actions, retrying rejected documents. Returns the
+    stats of the batch.
+    '''
+    stats = {"success": 0, "failed": 0, "errors": Counter(), "failures": []}
+    for ok, item in helpers.streaming_bulk(
+            es, batch,
+            chunk_size=ElasticConfig.CHUNK_SIZE,
+            max_chunk_bytes=ElasticConfig.MAX_CHUNK_BYTES,
+            max_retries=ElasticConfig.MAX_RETRIES,
+            initial_backoff=ElasticConfig.INITIAL_BACKOFF,
+            max_backoff=ElasticConfig.MAX_BACKOFF,
+            raise_on_error=False,
+            raise_on_exception=False):
+        op_type, info = item.copy().popitem()
+        # Deleting a document that is already gone is not a failure
+        if ok or (op_type == "delete" and info.get("status") == 404):
+            stats["success"] += 1
+            continue
+        stats["failed"] += 1
+        error = info.get("error")
+        error_type = error.get("type") if isinstance(error, dict) else "exception"
+        stats["errors"][f"{info.get('status')} {error_type}"] += 1
+        if len(stats["failures"]) < MAX_REPORTED_FAILURES:
+            stats["failures"].append({
+                "op_type": op_type,
+                "_index": info.get("_index"),
+                "_id": info.get("_id"),
+                "status": info.get("status"),
+                "error": error if isinstance(error, dict) else str(error)})
+    return stats
+
+def merge_stats(stats, batch_stats):
+    ''' Adds the stats of a batch to the running totals. '''
+    stats["success"] += batch_stats["success"]
+    stats["failed"] += batch_stats["failed"]
+    stats["errors"].update(batch_stats["errors"])
+    room = MAX_REPORTED_FAILURES - len(stats["failures"])
+    stats["failures"].extend(batch_stats["failures"][:room])
+
+@contextmanager
+def bulk_load_settings(es, indices):
+    '''
+    Disables refreshes and replicas on the given indices for the duration of a
+    bulk load, creating indices that do not exist yet, then restores the
+    previous settings and refreshes the indices.
+    '''
+    previous = {}
+    for index in indices:
+        if es.indices.exists(index=index):
+            current = es.indices.get_settings(index=index)[index]["settings"]["index"]
+            # A missing refresh_interval means the default; null restores it
+            previous[index] = {
+                "refresh_interval": current.get("refresh_interval"),
+                "number_of_replicas": current.get("number_of_replicas", 1)}
+            es.indices.put_settings(index=index, body={"index": BULK_LOAD_SETTINGS})
+        else:
+            previous[index] = {"refresh_interval": None, "number_of_replicas": 1}
+            es.indices.create(index=index, body={"settings": {"index": BULK_LOAD_SETTINGS}})
+    try:
+        yield
+    finally:
+        for index, settings in previous.items():
+            es.indices.put_settings(index=index, body={"index": settings})
+            es.indices.refresh(index=index)
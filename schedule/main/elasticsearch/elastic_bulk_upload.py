@@ -1,20 +1,105 @@
-from elasticsearch import Elasticsearch, helpers
+import pandas as pd
+from elasticsearch import Elasticsearch
 
 from schedule.config import ElasticConfig
+from schedule.main.elasticsearch.bulk_indexer import bulk_index
+from schedule.main.elasticsearch.index_manager import (
+    create_versioned_index, swap_alias, prune_old_indices)
+from schedule.main.elasticsearch.schema import (
+    EMPLOYEE_INDEX, EMPLOYEE_ID_FIELD, EMPLOYEE_FIELDS,
+    ORGANIZATION_INDEX, ORGANIZATION_ID_FIELD, ORGANIZATION_FIELDS,
+    SUGGESTION_INDEX, SUGGESTION_ID_FIELD, SUGGESTION_FIELDS, SUGGESTION_ANALYSIS,
+    build_suggestion_mapping, cast_documents)
+from schedule.main.suggestions import (
+    get_suggestion_df, get_employee_suggestions, get_organization_suggestions, get_suggestion_ids)
 
 def elastic_bulk_upload(df, org_df, dept_df):
     '''
-    Performs a bulk upload to an elasticsearch instance.
+    Performs a bulk upload to an elasticsearch instance. Each index is loaded
+    into a new version that replaces the live one only once it is complete
+    (see index_manager.py), and the suggestions of the employees and
+    organizations are loaded into the suggestion index (see suggestions.py).
+    Returns a dict of the indexing stats of each index (see
+    bulk_indexer.bulk_index).
+    Args:
+        df: a pandas dataframe of employees, or an iterable of chunks of
+            them (see chunked.py), merged and uploaded one at a time.
+        org_df: a pandas dataframe with one row per organization.
+        dept_df: a pandas dataframe with one row per department.
     '''
     # Include merged data in the employees and organization dataframes
-    df, org_df = merge_dataframes(df, org_df, dept_df)
+    if isinstance(df, pd.DataFrame):
+        df, org_df = merge_dataframes(df, org_df, dept_df)
+        suggestions = [get_suggestion_df(df, org_df)]
+    else:
+        suggestions = get_suggestion_frames(df, org_df, dept_df)
+        org_df, dept_df = get_document_lookups(org_df, dept_df)
+        df = (merge_employees(chunk, org_df, dept_df) for chunk in df)
+        org_df = merge_organizations(org_df, dept_df)
     # Create an instance of the ES client
-    es = Elasticsearch([ElasticConfig.ELASTIC_URL],
-                        timeout=ElasticConfig.ELASTIC_TIMEOUT)
-    # Upload the employee data to elastic search in bulk
-    bulk_upload_employees(df, es)
-    # Upload organization data to elastic search in bulk
-    bulk_upload_organizations(org_df, es)
+    es = get_elastic_client()
+    return {
+        # Upload the employee data to elastic search in bulk
+        EMPLOYEE_INDEX: load_index_version(df, es, EMPLOYEE_INDEX, EMPLOYEE_ID_FIELD, EMPLOYEE_FIELDS),
+        # Upload organization data to elastic search in bulk
+        ORGANIZATION_INDEX: load_index_version(
+            org_df, es, ORGANIZATION_INDEX, ORGANIZATION_ID_FIELD, ORGANIZATION_FIELDS),
+        # Upload the suggestions, with the mapping of the completion suggester
+        SUGGESTION_INDEX: load_index_version(
+            (get_suggestion_documents(frame) for frame in suggestions), es, SUGGESTION_INDEX,
+            SUGGESTION_ID_FIELD, SUGGESTION_FIELDS, mapping=build_suggestion_mapping(SUGGESTION_FIELDS),
+            analysis=SUGGESTION_ANALYSIS),
+    }
+
+def load_index_version(df, es, alias, id_field, fields, mapping=None, analysis=None):
+    '''
+    Loads a dataframe into a new version of an index, then swaps the alias
+    clients search over to it and prunes old versions. If any document fails,
+    the new version is dropped and the alias keeps pointing to the previous one.
+    The mapping and analysis settings of the index default to those of
+    index_manager.create_versioned_index.
+    '''
+    index = create_versioned_index(es, alias, fields, mapping=mapping, analysis=analysis)
+    stats = bulk_upload_documents(df, es, index, alias, id_field, fields, bulk_load=True)
+    if stats["failed"]:
+        es.indices.delete(index=index)
+        raise RuntimeError(f"{stats['failed']} documents failed to index into {index}; "
+                           f"the {alias} alias was left unchanged")
+    swap_alias(es, alias, index)
+    prune_old_indices(es, alias)
+    return stats
+
+def elastic_bulk_update(df, org_df, deleted_employee_ids, deleted_org_ids):
+    '''
+    Applies a partial update to elasticsearch: (re)indexes the given employees
+    and organizations, which must already be merged with merge_dataframes, and
+    deletes the documents of the given ids; their suggestions are updated
+    likewise. Returns a dict of the indexing stats of each index.
+    '''
+    es = get_elastic_client()
+    stats = {
+        EMPLOYEE_INDEX: merge_stats_dicts(
+            bulk_upload_employees(df, es),
+            bulk_delete_documents(deleted_employee_ids, EMPLOYEE_INDEX, es)),
+        ORGANIZATION_INDEX: merge_stats_dicts(
+            bulk_upload_organizations(org_df, es),
+            bulk_delete_documents(deleted_org_ids, ORGANIZATION_INDEX, es)),
+    }
+    # Indexing into a missing alias would create an index with a dynamic mapping
+    if not es.indices.exists_alias(name=SUGGESTION_INDEX):
+        print(f"There is no {SUGGESTION_INDEX} index yet; it is loaded by the next full refresh")
+        return stats
+    deleted_suggestion_ids = (get_suggestion_ids("employee", deleted_employee_ids)
+                              + get_suggestion_ids("organization", deleted_org_ids))
+    stats[SUGGESTION_INDEX] = merge_stats_dicts(
+        bulk_upload_suggestions(get_suggestion_df(df, org_df), es),
+        bulk_delete_documents(deleted_suggestion_ids, SUGGESTION_INDEX, es))
+    return stats
+
+def get_elastic_client():
+    ''' Returns an instance of the ES client. '''
+    return Elasticsearch([ElasticConfig.ELASTIC_URL],
+                         timeout=ElasticConfig.ELASTIC_TIMEOUT)
 
 def merge_dataframes(df, org_df, dept_df):
     '''
@@ -22,80 +107,152 @@ def merge_dataframes(df, org_df, dept_df):
     their organization/department names, as well as the traversal path from root
     to their organization unit.
     '''
+    org_df, dept_df = get_document_lookups(org_df, dept_df)
+    return merge_employees(df, org_df, dept_df), merge_organizations(org_df, dept_df)
+
+def get_document_lookups(org_df, dept_df):
+    '''
+    Returns the organization and department columns the documents are merged
+    with, as used by merge_employees and merge_organizations.
+    '''
+    # An org_id can appear once per distinct org structure; keep one row per id
+    # (the last, which is the one a sequential upload used to leave in the index)
+    # so that each document is indexed once and the result does not depend on
+    # the order parallel bulk requests complete in. The headcount weighs the
+    # suggestions of organizations.
+    org_df = org_df[["org_id", "org_name_en", "org_name_fr", "dept_id", "org_chart_path", "total_headcount"]]
+    org_df = org_df.drop_duplicates("org_id", keep="last")
+    dept_df = dept_df[["dept_id", "department_en", "department_fr"]]
+    return org_df, dept_df
+
+def merge_employees(df, org_df, dept_df):
+    '''
+    Attaches the names of their organization and department, and the path to
+    their organization, to employees. org_df and dept_df are the lookups
+    returned by get_document_lookups.
+    '''
     # Keep only the subsets that will be used.
     df = df[["employee_id", "last_name", "first_name", "full_name", "job_title_en", "job_title_fr",
              "phone_number", "email", "address_en", "address_fr", "province_en",
              "province_fr", "city_en", "city_fr", "postal_code", "org_id", "dept_id"]]
-    org_df = org_df[["org_id", "org_name_en", "org_name_fr", "dept_id", "org_chart_path"]]
-    dept_df = dept_df[["dept_id", "department_en", "department_fr"]]
     # Attach organization and department info to the employees dataframe
     df = df.merge(dept_df, left_on='dept_id', right_on='dept_id')
     # Note: the reason for subsetting org_df here is to avoid pandas convention of
     # applying _x and _y to two columns with the same name in different dataframes.
-    df = df.merge(org_df[["org_id", "org_name_en", "org_name_fr", "org_chart_path"]],
-                         left_on='org_id',
-                         right_on='org_id')
-    # Construct org df also
-    org_df = org_df.merge(dept_df, left_on='dept_id', right_on='dept_id')
-    return df, org_df
+    return df.merge(org_df[["org_id", "org_name_en", "org_name_fr", "org_chart_path"]],
+                    left_on='org_id',
+                    right_on='org_id')
+
+def merge_organizations(org_df, dept_df):
+    ''' Attaches the names of their department to organizations (see get_document_lookups). '''
+    return org_df.merge(dept_df, left_on='dept_id', right_on='dept_id')
+
+def get_suggestion_frames(df, org_df, dept_df):
+    '''
+    Generates the suggestions of the employees and organizations (see
+    suggestions.get_suggestion_df), a chunk of employees at a time if df is
+    an iterable of chunks, or all at once.
+    '''
+    if isinstance(df, pd.DataFrame):
+        yield get_suggestion_df(*merge_dataframes(df, org_df, dept_df))
+        return
+    org_df, dept_df = get_document_lookups(org_df, dept_df)
+    yield get_organization_suggestions(merge_organizations(org_df, dept_df))
+    for chunk in df:
+        yield get_employee_suggestions(merge_employees(chunk, org_df, dept_df))
+
+def get_suggestion_documents(suggestion_df):
+    '''
+    Returns the suggestion documents of a suggestions dataframe: the keys and
+    weight of each suggestion make up the input of the completion suggester,
+    with its kind as a context.
+    '''
+    suggest = [{"input": keys, "weight": int(weight), "contexts": {"kind": [kind]}}
+               for keys, weight, kind in zip(suggestion_df["keys"], suggestion_df["weight"],
+                                             suggestion_df["kind"])]
+    return suggestion_df.assign(suggest=suggest)
 
 def bulk_upload_employees(df, es):
     ''' Uploads employees to elasticsearch. '''
-    def employee_data_generator(df):
-        ''' Generator for employee data. '''
-        for idx, row in df.iterrows():
-            yield {
-                "_index": "employee",
-                "_type": "employee",
-                "_id": int(row["employee_id"]),
-                "_source": {
-                    "employee_id": int(row["employee_id"]),
-                    "last_name": str(row["last_name"]),
-                    "first_name": str(row["first_name"]),
-                    "full_name": str(row["full_name"]),
-                    "job_title_en": str(row["job_title_en"]),
-                    "job_title_fr": str(row["job_title_fr"]),
-                    "phone_number": str(row["phone_number"]),
-                    "email": str(row["email"]),
-                    "address_en": str(row["address_en"]),
-                    "address_fr": str(row["address_fr"]),
-                    "province_en": str(row["province_en"]),
-                    "province_fr": str(row["province_fr"]),
-                    "city_en": str(row["city_en"]),
-                    "city_fr": str(row["city_fr"]),
-                    "postal_code": str(row["postal_code"]),
-                    "org_name_en": str(row["org_name_en"]),
-                    "org_name_fr": str(row["org_name_fr"]),
-                    "org_chart_path": str(row["org_chart_path"]),
-                    "department_en": str(row["department_en"]),
-                    "department_fr": str(row["department_fr"]),
-                    "org_id": str(row["org_id"]),
-                    "dept_id": str(row["dept_id"])}
-                }
-    try:
-        res = helpers.bulk(es, employee_data_generator(df))
-        print("SUCCESS: RESULT\n", res)
-    except Exception as e:
-        print("EXCEPTION:\n", e)
+    return bulk_upload_documents(df, es, EMPLOYEE_INDEX, EMPLOYEE_INDEX, EMPLOYEE_ID_FIELD,
+                                 EMPLOYEE_FIELDS)
 
 def bulk_upload_organizations(df, es):
-    ''' Uploads employees to elasticsearch. '''
-    def organization_data_generator(df):
-        ''' Generator for employee data. '''
-        for idx, row in df.iterrows():
+    ''' Uploads organizations to elasticsearch. '''
+    return bulk_upload_documents(df, es, ORGANIZATION_INDEX, ORGANIZATION_INDEX,
+                                 ORGANIZATION_ID_FIELD, ORGANIZATION_FIELDS)
+
+def bulk_upload_suggestions(suggestion_df, es):
+    ''' Uploads suggestions (see suggestions.get_suggestion_df) to elasticsearch. '''
+    return bulk_upload_documents(get_suggestion_documents(suggestion_df), es, SUGGESTION_INDEX,
+                                 SUGGESTION_INDEX, SUGGESTION_ID_FIELD, SUGGESTION_FIELDS)
+
+def bulk_upload_documents(df, es, index, doc_type, id_field, fields, bulk_load=False):
+    '''
+    Uploads the rows of a dataframe as documents of an index. If bulk_load is
+    set, the index is being loaded in full and is tuned for indexing speed
+    during the upload. Returns the indexing stats.
+    '''
+    stats = bulk_index(es, document_generator(df, index, doc_type, id_field, fields),
+                       bulk_load_indices=[index] if bulk_load else [])
+    print_stats(index, stats)
+    return stats
+
+def document_generator(df, index, doc_type, id_field, fields, chunksize=10000):
+    '''
+    Generator for the bulk index actions of a dataframe. The fields are cast
+    column-wise once, then documents are built a chunk at a time so only
+    chunksize documents are held in memory.
+    Args:
+        df: a pandas dataframe containing the document fields, or an iterable
+            of such dataframes, cast one at a time.
+        index: a string containing the name of the index (or alias).
+        doc_type: a string containing the mapping type of the documents.
+        id_field: a string containing the field used as the document id.
+        fields: a dict of field name to type, as defined in schema.py.
+    '''
+    names = list(fields)
+    for frame in [df] if isinstance(df, pd.DataFrame) else df:
+        docs = cast_documents(frame, fields)
+        for start in range(0, len(docs), chunksize):
+            chunk = docs.iloc[start:start + chunksize]
+            # Building dicts from per-column python lists avoids any per-row
+            # pandas overhead.
+            for values in zip(*(chunk[name].tolist() for name in names)):
+                source = dict(zip(names, values))
+                yield {
+                    "_index": index,
+                    "_type": doc_type,
+                    "_id": source[id_field],
+                    "_source": source}
+
+def bulk_delete_documents(ids, index, es):
+    ''' Deletes the documents with the given ids from an index. '''
+    def delete_action_generator(ids):
+        ''' Generator for delete actions. '''
+        for doc_id in ids:
             yield {
-                "_index": "organization",
-                "_type": "organization",
-                "_id": int(row["org_id"]),
-                "_source": {
-                    "org_id": int(row["org_id"]),
-                    "org_name_en": str(row["org_name_en"]),
-                    "org_name_fr": str(row["org_name_fr"]),
-                    "org_chart_path": str(row["org_chart_path"]),
-                    "department_en": str(row["department_en"]),
-                    "department_fr": str(row["department_fr"])},}
-    try:
-        res = helpers.bulk(es, organization_data_generator(df))
-        print("SUCCESS: RESULT\n", res)
-    except Exception as e:
-        print("EXCEPTION:\n", e)
+                "_op_type": "delete",
+                "_index": index,
+                "_type": index,
+                "_id": doc_id if isinstance(doc_id, str) else int(doc_id)}
+    stats = bulk_index(es, delete_action_generator(ids))
+    print_stats(index, stats)
+    return stats
+
+def merge_stats_dicts(*all_stats):
+    ''' Combines the indexing stats of several bulk_index calls. '''
+    merged = {"success": 0, "failed": 0, "errors": {}, "failures": []}
+    for stats in all_stats:
+        merged["success"] += stats["success"]
+        merged["failed"] += stats["failed"]
+        for error, count in stats["errors"].items():
+            merged["errors"][error] = merged["errors"].get(error, 0) + count
+        merged["failures"].extend(stats["failures"])
+    return merged
+
+def print_stats(index, stats):
+    ''' Prints a summary of the indexing stats of an index. '''
+    print(f"{index}: {stats['success']} documents succeeded, {stats['failed']} failed")
+    for error, count in stats["errors"].items():
+        print(f"    {count} x {error}")
@@ -0,0 +1,96 @@
+'''
+Blue/green management of the elasticsearch indices. Every full load writes
+into a new versioned index (e.g. employee_20200501120000_1) that searches
+cannot see; once it is loaded, the alias searched by clients (e.g. employee) is
+moved to it in a single atomic request and old versions are deleted.
+
+A version is named after its alias, the time it was created at and a number
+telling apart the versions created within the same second. Only indices named
+so are versions of an alias: other indices whose name starts with the alias
+are never pruned.
+'''
+import re
+import time
+
+from schedule.config import ElasticConfig
+from schedule.main.elasticsearch.schema import build_mapping
+
+# Format of the creation time in the name of a version
+VERSION_TIME_FORMAT = "%Y%m%d%H%M%S"
+
+def create_versioned_index(es, alias, fields, mapping=None, analysis=None):
+    '''
+    Creates a new, empty version of an index with an explicit mapping.
+    Args:
+        es: an instance of the ES client.
+        alias: a string containing the name clients search, which is also the
+            mapping type of the documents.
+        fields: a dict of field name to python type, as defined in schema.py.
+        mapping: the mapping of the documents; defaults to the one
+            schema.build_mapping derives from fields.
+        analysis: the analysis settings (custom analyzers) of the index, if any.
+    Returns:
+        index: a string containing the name of the new index.
+    '''
+    created_at = time.strftime(VERSION_TIME_FORMAT)
+    # Loads started within the same second are numbered on from the last one
+    versions = [parse_version(alias, index) for index in get_versions(es, alias)]
+    number = max((number for version_time, number in versions if version_time == created_at), default=0) + 1
+    index = f"{alias}_{created_at}_{number}"
+    settings = {"number_of_replicas": ElasticConfig.NUMBER_OF_REPLICAS}
+    if analysis is not None:
+        settings["analysis"] = analysis
+    # Mappings are keyed by type, as expected by Elasticsearch 6.x
+    es.indices.create(index=index, body={
+        "settings": {"index": settings},
+        "mappings": {alias: build_mapping(fields) if mapping is None else mapping},
+    })
+    return index
+
+def swap_alias(es, alias, index):
+    '''
+    Atomically points an alias at a new index, removing it from the indices
+    it pointed to before. An index named like the alias (written by versions of
+    this job that did not use aliases) is deleted in the same request.
+    '''
+    actions = [{"add": {"index": index, "alias": alias}}]
+    if es.indices.exists_alias(name=alias):
+        for old_index in es.indices.get_alias(name=alias):
+            actions.append({"remove": {"index": old_index, "alias": alias}})
+    elif es.indices.exists(index=alias):
+        actions.append({"remove_index": {"index": alias}})
+    es.indices.update_aliases(body={"actions": actions})
+
+def prune_old_indices(es, alias, keep=None):
+    '''
+    Deletes the oldest versions of an index, keeping the most recent ones and
+    any version the alias currently points to.
+    Args:
+        es: an instance of the ES client.
+        alias: a string containing the name of the alias.
+        keep: the number of versions to keep; defaults to the configured value.
+    '''
+    if keep is None:
+        keep = ElasticConfig.INDEX_VERSIONS_TO_KEEP
+    versions = get_versions(es, alias)[::-1]
+    live = set(es.indices.get_alias(name=alias)) if es.indices.exists_alias(name=alias) else set()
+    stale = [index for index in versions[keep:] if index not in live]
+    if stale:
+        es.indices.delete(index=",".join(stale))
+    return stale
+
+def get_versions(es, alias):
+    ''' Returns the names of the versions of an index, oldest first. '''
+    versions = [(parse_version(alias, index), index) for index in es.indices.get_alias(index=f"{alias}_*")]
+    return [index for version, index in sorted(version for version in versions if version[0] is not None)]
+
+def parse_version(alias, index):
+    '''
+    Returns the creation time (as named) and number of a version of alias, or
+    None if index is not one. Versions created by earlier versions of this job
+    have no number, and count as the first of their second.
+    '''
+    match = re.fullmatch(rf"{re.escape(alias)}_(\d{{14}})(?:_(\d+))?", index)
+    if match is None:
+        return None
+    return match.group(1), int(match.group(2) or 1)
@@ -0,0 +1,143 @@
+'''
+Fields of the documents indexed into elasticsearch. Each index maps its field
+names to the python type the field is cast to before upload; the order of the
+fields is the order they appear in the document. Fields typed dict hold
+objects that are sent as they are.
+'''
+import numpy as np
+import pandas as pd
+
+EMPLOYEE_INDEX = "employee"
+EMPLOYEE_ID_FIELD = "employee_id"
+EMPLOYEE_FIELDS = {
+    "employee_id": int,
+    "last_name": str,
+    "first_name": str,
+    "full_name": str,
+    "job_title_en": str,
+    "job_title_fr": str,
+    "phone_number": str,
+    "email": str,
+    "address_en": str,
+    "address_fr": str,
+    "province_en": str,
+    "province_fr": str,
+    "city_en": str,
+    "city_fr": str,
+    "postal_code": str,
+    "org_name_en": str,
+    "org_name_fr": str,
+    "org_chart_path": str,
+    "department_en": str,
+    "department_fr": str,
+    "org_id": str,
+    "dept_id": str,
+}
+
+ORGANIZATION_INDEX = "organization"
+ORGANIZATION_ID_FIELD = "org_id"
+ORGANIZATION_FIELDS = {
+    "org_id": int,
+    "org_name_en": str,
+    "org_name_fr": str,
+    "org_chart_path": str,
+    "department_en": str,
+    "department_fr": str,
+}
+
+SUGGESTION_INDEX = "suggestion"
+SUGGESTION_ID_FIELD = "suggestion_id"
+SUGGESTION_FIELDS = {
+    "suggestion_id": str,
+    "kind": str,
+    "entity_id": int,
+    "name_en": str,
+    "name_fr": str,
+    "context_en": str,
+    "context_fr": str,
+    "dept_id": int,
+    "weight": int,
+    "suggest": dict,
+}
+# Analyzers of the suggestion index: names are matched without accents or
+# case, and are indexed by the prefixes of their words for search-as-you-type
+# queries
+SUGGESTION_ANALYSIS = {
+    "filter": {
+        "suggestion_edge_ngram": {"type": "edge_ngram", "min_gram": 1, "max_gram": 20},
+    },
+    "analyzer": {
+        "suggestion_folding": {
+            "type": "custom", "tokenizer": "standard", "filter": ["lowercase", "asciifolding"]},
+        "suggestion_prefixes": {
+            "type": "custom", "tokenizer": "standard",
+            "filter": ["lowercase", "asciifolding", "suggestion_edge_ngram"]},
+    },
+}
+
+def cast_documents(df, fields):
+    '''
+    Returns a dataframe holding only the document fields, each cast column-wise
+    to its type. Strings are cast the same way str() casts a single value, so
+    missing values become "nan"/"None".
+    Args:
+        df: a pandas dataframe containing at least the document fields.
+        fields: a dict of field name to python type (int, str or dict).
+    '''
+    return pd.DataFrame({name: df[name] if ftype is dict
+                         else df[name].astype("int64") if ftype is int
+                         else cast_strings(df[name])
+                         for name, ftype in fields.items()}, index=df.index)
+
+def cast_strings(values):
+    '''
+    Casts a column to str. Missing values of a string dtype column (see
+    dtype_plan.STRING_DTYPE) become "nan", like those of the object column
+    read_csv gives.
+    '''
+    if isinstance(values.dtype, pd.StringDtype):
+        values = values.astype(object).where(values.notna(), np.nan)
+    return values.astype(str)
+
+def build_mapping(fields):
+    '''
+    Returns an explicit mapping for the documents of an index. Dynamic mapping
+    is disabled; every string is a text field with a keyword subfield for exact
+    matches and sorting, analyzed in english or french when the field name ends
+    with _en or _fr.
+    Args:
+        fields: a dict of field name to python type (int or str).
+    '''
+    properties = {}
+    for name, ftype in fields.items():
+        if ftype is int:
+            properties[name] = {"type": "long"}
+            continue
+        properties[name] = {
+            "type": "text",
+            "fields": {"keyword": {"type": "keyword", "ignore_above": 256}}}
+        if name.endswith("_en"):
+            properties[name]["analyzer"] = "english"
+        elif name.endswith("_fr"):
+            properties[name]["analyzer"] = "french"
+    return {"dynamic": "strict", "properties": properties}
+
+def build_suggestion_mapping(fields):
+    '''
+    Returns the mapping of the suggestion index (see suggestions.py): the names
+    are analyzed for search-as-you-type queries, and the suggest field feeds
+    the completion suggester, with the kind of entity as a context so clients
+    can ask for employees or organizations only. The analyzers are defined in
+    SUGGESTION_ANALYSIS.
+    '''
+    mapping = build_mapping(dict((name, ftype) for name, ftype in fields.items() if ftype is not dict))
+    properties = mapping["properties"]
+    properties["kind"] = {"type": "keyword"}
+    for name in ["name_en", "name_fr"]:
+        properties[name] = {
+            "type": "text", "analyzer": "suggestion_prefixes", "search_analyzer": "suggestion_folding",
+            "fields": {"keyword": {"type": "keyword", "ignore_above": 256}}}
+    properties["suggest"] = {
+        "type": "completion", "analyzer": "suggestion_folding",
+        "contexts": [{"name": "kind", "type": "category"}]}
+    return mapping
@@ -1,41 +1,44 @@
-from sqlalchemy import create_engine
 from sqlalchemy.types import Integer, Text
 
-from schedule.config import SQLAlchemyConfig
-from schedule.main.utils.db_utils import assemble_sqlalchemy_url
+from schedule.main.utils.db_utils import get_engine, upsert_rows
+from schedule.main.utils.sql_loader import load_table
+
+# Columns of the employees table and their sql types
+EMPLOYEE_DTYPES = {
+    "employee_id": Integer,
+    "last_name": Text,
+    "first_name": Text,
+    "job_title_en": Text,
+    "job_title_fr": Text,
+    "phone_number": Text,
+    "email": Text,
+    "address_en": Text,
+    "address_fr": Text,
+    "province_en": Text,
+    "province_fr": Text,
+    "city_en": Text,
+    "city_fr": Text,
+    "postal_code": Text,
+    "org_id": Integer,
+    "dept_id": Integer,
+}
+EMPLOYEE_COLUMNS = list(EMPLOYEE_DTYPES)
 
 
 def create_employee_table(df):
     '''
     Creates the employees table in the database.
     '''
-    engine = create_engine(assemble_sqlalchemy_url(SQLAlchemyConfig))
     # Keep only a subset of the employee dataframe
-    df = df[["employee_id", "last_name", "first_name", "job_title_en", "job_title_fr",
-        "phone_number", "email", "address_en", "address_fr", "province_en", "province_fr",
-        "city_en", "city_fr", "postal_code", "org_id", "dept_id"]]
+    df = df[EMPLOYEE_COLUMNS]
     # Create employees table (english)
-    df.to_sql(
-        "employees",
-        engine,
-        if_exists="replace",
-        index=False,
-        chunksize=1000,
-        dtype={
-            "employee_id": Integer,
-            "last_name": Text,
-            "first_name": Text,
-            "job_title_en": Text,
-            "job_title_fr": Text,
-            "phone_number": Text,
-            "email": Text,
-            "address_en": Text,
-            "address_fr": Text,
-            "province_en": Text,
-            "province_fr": Text,
-            "city_en": Text,
-            "city_fr": Text,
-            "postal_code": Text,
-            "org_id": Integer,
-            "dept_id": Integer,
-        })
\ No newline at end of file
+    load_table(df, "employees", EMPLOYEE_DTYPES, primary_key="employee_id",
+               indexes=["org_id", "dept_id"])
+
+def update_employee_table(df, deleted_ids):
+    '''
+    Upserts the given employees into the employees table and deletes the
+    employees whose id is in deleted_ids.
+    '''
+    upsert_rows(get_engine(), "employees", "employee_id", df[EMPLOYEE_COLUMNS],
+                EMPLOYEE_DTYPES, deleted_keys=deleted_ids)
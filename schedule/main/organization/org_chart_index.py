@@ -0,0 +1,130 @@
+from schedule.main.utils.normalization import name_key
+
+class OrgChartIndex:
+    '''
+    An index over the org chart that maps every department name to its root
+    node, and every organization name within a department to its node and to
+    the path (a list of child indices starting at the department root) used to
+    reach it. The nodes and paths of a department are computed at most once,
+    the first time they are queried, so all later lookups are dictionary
+    lookups.
+
+    Departments and organizations are looked up by normalization.name_key, so
+    differences in case, spacing, special characters and parenthesized text
+    between the name columns and the org structure do not matter. When several
+    nodes of a department share a key, the first node in post-order wins; this
+    is the node get_path_to_node returns.
+
+        Args:
+            org_chart:
+                An OrgTree containing the org chart.
+    '''
+    def __init__(self, org_chart):
+        self.org_chart = org_chart
+        # The key of each distinct name of the chart
+        self.label_keys = [name_key(label) for label in org_chart.labels]
+        self.departments = {}
+        self._department_keys = {}
+        for root in org_chart.roots.tolist():
+            # Keep the first tree when two departments share a name
+            self.departments.setdefault(org_chart.label(root), root)
+            self._department_keys.setdefault(self.label_keys[org_chart.name_ids[root]], root)
+        # Keys of the names looked up so far
+        self._keys = {}
+        self._nodes = {}
+        self._paths = {}
+
+    def __contains__(self, department):
+        return department in self.departments
+
+    def key(self, name):
+        ''' Returns the name_key of a name, computing it once per distinct name. '''
+        key = self._keys.get(name)
+        if key is None:
+            key = self._keys[name] = name_key(name)
+        return key
+
+    def get_department(self, department):
+        ''' Returns the root node of a department, or None if it is unknown. '''
+        return self.departments.get(department)
+
+    def find_department(self, department):
+        '''
+        Returns the root node of a department, comparing names by their key if
+        there is no department of that exact name, or None if it is unknown.
+        '''
+        root = self.departments.get(department)
+        if root is None and isinstance(department, str):
+            root = self._department_keys.get(self.key(department))
+        return root
+
+    def get_nodes(self, department):
+        '''
+        Returns a dict of {org name key: node} for every node of a department,
+        or None if the department is unknown.
+        '''
+        root = self.find_department(department)
+        if root is None:
+            return None
+        if root not in self._nodes:
+            self._nodes[root] = index_nodes(self.org_chart, root, self.label_keys)
+        return self._nodes[root]
+
+    def get_node(self, department, org_name):
+        '''
+        Returns the node of an organization within a department, or None if
+        the department is unknown or the organization is not in its tree.
+        '''
+        nodes = self.get_nodes(department)
+        if nodes is None or not isinstance(org_name, str):
+            return None
+        return nodes.get(self.key(org_name))
+
+    def get_paths(self, department):
+        '''
+        Returns a dict of {org name key: path} for every node of a department,
+        or None if the department is unknown.
+        '''
+        root = self.find_department(department)
+        if root is None:
+            return None
+        if root not in self._paths:
+            self._paths[root] = {key: self.org_chart.path(node)
+                                 for key, node in self.get_nodes(department).items()}
+        return self._paths[root]
+
+    def get_path(self, department, org_name):
+        '''
+        Returns the path to an organization within a department. The path is
+        empty if the organization is not in the department's tree, and None if
+        the department is unknown.
+        '''
+        paths = self.get_paths(department)
+        if paths is None:
+            return None
+        if not isinstance(org_name, str):
+            return []
+        return paths.get(self.key(org_name), [])
+
+def index_nodes(org_chart, root, label_keys):
+    '''
+    Maps the key of every node name of a department to its node.
+
+        Args:
+            org_chart:
+                An OrgTree containing the org chart.
+            root:
+                The root node of the department.
+            label_keys:
+                The name_key of each of the chart's labels.
+
+        Returns:
+            nodes:
+                A dict mapping each key to the first node with that key in
+                post-order.
+    '''
+    subtree = org_chart.subtree(root)
+    nodes = {}
+    for node in subtree[org_chart.postorder[subtree].argsort()].tolist():
+        nodes.setdefault(label_keys[org_chart.name_ids[node]], node)
+    return nodes
@@ -0,0 +1,84 @@
+'''
+The org_closure table: one row for every organization and each of its
+ancestors in the english org chart (itself included, at depth 0), so the
+organizations under or above an organization are found with an indexed
+lookup instead of walking the org chart of its department.
+
+The closure is worked out from the nested set numbers of the organizations
+(see organization_table.attach_nested_sets), so it can be rebuilt from the
+organizations dataframe alone, one department at a time.
+'''
+import pandas as pd
+from sqlalchemy.types import Integer
+
+from schedule.main.utils.db_utils import get_engine, upsert_rows
+from schedule.main.utils.sql_loader import load_table
+
+# Columns of the org_closure table and their sql types
+CLOSURE_DTYPES = {
+    "ancestor_id": Integer,
+    "descendant_id": Integer,
+    "depth": Integer,
+    "dept_id": Integer,
+}
+CLOSURE_COLUMNS = list(CLOSURE_DTYPES)
+
+def create_org_closure_table(org_df):
+    ''' Replaces the org_closure table with the closure of the organizations of org_df. '''
+    closure_df = get_closure_df(org_df)
+    load_table(closure_df, "org_closure", CLOSURE_DTYPES,
+               indexes=[("ancestor_id", "depth"), "descendant_id", "dept_id"])
+    return closure_df
+
+def update_org_closure_table(org_df, dept_ids):
+    '''
+    Replaces the rows of the given departments in the org_closure table with
+    the closure of their organizations in org_df; departments that are not in
+    org_df any more lose their rows.
+    '''
+    closure_df = get_closure_df(org_df[org_df["dept_id"].isin(dept_ids)])
+    upsert_rows(get_engine(), "org_closure", "dept_id", closure_df, CLOSURE_DTYPES,
+                deleted_keys=dept_ids)
+    return closure_df
+
+def get_closure_df(org_df):
+    '''
+    Returns the ancestor/descendant pairs of the organizations of org_df.
+    Args:
+        org_df: a pandas dataframe, as returned by get_organization_df.
+    Returns:
+        A pandas dataframe with the CLOSURE_COLUMNS: the org_id of the
+        ancestor and of the descendant, the number of levels between them in
+        the org chart, and their department. Organizations that are not in
+        the org chart have no rows.
+    '''
+    orgs = org_df[["org_id", "dept_id", "lft", "rgt", "org_chart_depth"]].dropna().astype("int64")
+    nodes = orgs.drop(columns="org_id").drop_duplicates(["dept_id", "lft"]).sort_values(["dept_id", "lft"])
+    dept_ids, lfts = nodes["dept_id"].tolist(), nodes["lft"].tolist()
+    rgts, depths = nodes["rgt"].tolist(), nodes["org_chart_depth"].tolist()
+    ancestors, descendants, distances = [], [], []
+    # In pre-order, the ancestors of a node are the nodes before it whose
+    # subtree has not ended yet
+    open_nodes = []
+    for node in range(len(nodes)):
+        while open_nodes and (dept_ids[open_nodes[-1]] != dept_ids[node]
+                              or rgts[open_nodes[-1]] < lfts[node]):
+            open_nodes.pop()
+        open_nodes.append(node)
+        for ancestor in open_nodes:
+            ancestors.append(ancestor)
+            descendants.append(node)
+            distances.append(depths[node] - depths[ancestor])
+    node_keys = nodes[["dept_id", "lft"]].reset_index(drop=True)
+    pairs = pd.DataFrame({
+        "dept_id": node_keys["dept_id"].to_numpy()[descendants],
+        "ancestor_lft": node_keys["lft"].to_numpy()[ancestors],
+        "descendant_lft": node_keys["lft"].to_numpy()[descendants],
+        "depth": distances,
+    })
+    # Several organizations can share a node
+    org_ids = orgs[["dept_id", "lft", "org_id"]].drop_duplicates()
+    pairs = pairs.merge(org_ids.rename(columns={"lft": "ancestor_lft", "org_id": "ancestor_id"}))
+    pairs = pairs.merge(org_ids.rename(columns={"lft": "descendant_lft", "org_id": "descendant_id"}))
+    pairs = pairs.sort_values("depth", kind="stable").drop_duplicates(["ancestor_id", "descendant_id"])
+    return pairs.sort_values(["ancestor_id", "depth", "descendant_id"])[CLOSURE_COLUMNS].reset_index(drop=True)
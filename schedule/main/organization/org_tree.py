@@ -0,0 +1,274 @@
+'''
+Array-backed org chart. Every node of the chart is a position in a set of
+parallel numpy arrays (parent, first child, next sibling, interned name,
+depth, org_id...), so moving between parents and children is a lookup and the
+nodes of any subtree are a contiguous range of the pre-order (Euler tour)
+numbering. The nested {"name", "_children"} dicts stored in the departments
+table are only produced when a chart is serialized.
+'''
+import numpy as np
+import pandas as pd
+
+from schedule.main.utils.normalization import name_key
+from schedule.main.utils.serialization import dumps
+
+# Value of the node arrays where there is no parent/child/sibling/org_id
+NO_NODE = -1
+
+class OrgTree:
+    '''
+    A forest with one tree per department. Built with OrgTree.from_paths.
+
+    Like the charts produced so far, each department root has a single child
+    named after the department itself, under which the organizations of the
+    department hang; paths to organizations (see path) count that level.
+
+    Attributes:
+        names: the list of distinct raw names of the nodes.
+        labels: the names as shown in the chart (trailing spaces removed).
+        name_ids: the index of each node's name in names/labels.
+        parent, first_child, next_sibling: node indices, or NO_NODE.
+        child_position: the position of each node among its siblings.
+        depth: the depth of each node, department roots being at depth 0.
+        root: the department root of each node.
+        org_id: the org_id matched to each node, or NO_NODE.
+        direct_headcount, total_headcount: the number of employees of each
+            node, and of its whole subtree.
+        job_title_count: the number of distinct job titles in each subtree.
+        descendant_org_count: the number of nodes below each node.
+        size: the number of nodes in the subtree of each node.
+        tin, tout: each node's subtree is the range [tin, tout) of the
+            pre-order numbering; preorder maps that numbering back to nodes.
+        postorder: the post-order number of each node.
+        roots: the department roots, in order.
+    '''
+    def __init__(self, names, name_ids, parent, level_offsets):
+        self.names = names
+        self.labels = [name.rstrip() for name in names]
+        self.name_ids = name_ids
+        self.parent = parent
+        self.level_offsets = level_offsets
+        n_nodes = len(parent)
+        self.org_id = np.full(n_nodes, NO_NODE, dtype=np.int64)
+        self.direct_headcount = np.zeros(n_nodes, dtype=np.int64)
+        self.total_headcount = np.zeros(n_nodes, dtype=np.int64)
+        self.job_title_count = np.zeros(n_nodes, dtype=np.int64)
+        self.depth = np.zeros(n_nodes, dtype=np.int32)
+        for level, (start, end) in enumerate(self.levels()):
+            self.depth[start:end] = level
+        self._link_siblings()
+        self._number_nodes()
+
+    @classmethod
+    def from_paths(cls, df):
+        '''
+        Builds the org chart from the paths of the org structure, one level at
+        a time. Departments, and the children of every node, are ordered by
+        the name_key of their name (then by name), so the chart, and the
+        paths and pre-order numbers of its nodes, do not depend on the order
+        of the rows of df.
+        Args:
+            df: a pandas dataframe with one org unit per column, the first
+                column being the root shared by every department ("Government
+                of Canada") which is left out of the chart. Paths stop at their
+                first missing value.
+        '''
+        values = df.to_numpy(dtype=object)
+        if values.shape[1] < 2:
+            return cls([], np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), [0])
+        # Department roots hold their department as their only child
+        values = values[:, [1] + list(range(1, values.shape[1]))]
+        is_name = np.frompyfunc(lambda value: isinstance(value, str), 1, 1)(values).astype(bool)
+        active = np.logical_and.accumulate(is_name, axis=1)
+        # Intern the names, numbering them in the order of their key
+        name_codes = np.full(values.shape, NO_NODE, dtype=np.int64)
+        codes, names = pd.factorize(values[is_name])
+        order = sorted(range(len(names)), key=lambda name_id: (name_key(names[name_id]), names[name_id]))
+        ranks = np.empty(len(names), dtype=np.int64)
+        ranks[order] = np.arange(len(names))
+        name_codes[is_name] = ranks[codes]
+        names = names[order]
+        n_names = max(len(names), 1)
+        # Every row descends the tree one level per column; a node is a
+        # distinct (parent, name) pair at its level. Nodes are numbered in
+        # the order of these pairs, so siblings follow the order of the names.
+        row_node = np.full(len(values), NO_NODE, dtype=np.int64)
+        parents, name_ids, level_offsets = [], [], [0]
+        for level in range(values.shape[1]):
+            rows = np.flatnonzero(active[:, level])
+            if not len(rows):
+                break
+            keys = (row_node[rows] + 1) * n_names + name_codes[rows, level]
+            unique_keys, node_codes = np.unique(keys, return_inverse=True)
+            row_node[rows] = node_codes + level_offsets[-1]
+            parents.append(unique_keys // n_names - 1)
+            name_ids.append(unique_keys % n_names)
+            level_offsets.append(level_offsets[-1] + len(unique_keys))
+        if not parents:
+            return cls([], np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), [0])
+        return cls(list(names), np.concatenate(name_ids), np.concatenate(parents), level_offsets)
+
+    def __len__(self):
+        return len(self.parent)
+
+    def levels(self):
+        ''' Yields the (start, end) range of the nodes at each depth. '''
+        return zip(self.level_offsets[:-1], self.level_offsets[1:])
+
+    def _link_siblings(self):
+        ''' Fills in first_child, next_sibling and child_position. '''
+        n_nodes = len(self)
+        self.first_child = np.full(n_nodes, NO_NODE, dtype=np.int64)
+        self.next_sibling = np.full(n_nodes, NO_NODE, dtype=np.int64)
+        self.child_position = np.zeros(n_nodes, dtype=np.int64)
+        # Group the nodes by parent, keeping their order within each group
+        order = np.argsort(self.parent, kind="stable")
+        grouped_parents = self.parent[order]
+        same_parent = grouped_parents[1:] == grouped_parents[:-1]
+        self.next_sibling[order[:-1][same_parent]] = order[1:][same_parent]
+        group_start = np.r_[True, ~same_parent] if n_nodes else np.zeros(0, dtype=bool)
+        has_parent = group_start & (grouped_parents != NO_NODE)
+        self.first_child[grouped_parents[has_parent]] = order[has_parent]
+        positions = np.arange(n_nodes)
+        self.child_position[order] = positions - np.maximum.accumulate(
+            np.where(group_start, positions, 0))
+        self.roots = order[grouped_parents == NO_NODE]
+
+    def _number_nodes(self):
+        ''' Fills in size, root, and the pre-order and post-order numbers. '''
+        n_nodes = len(self)
+        self.size = np.ones(n_nodes, dtype=np.int64)
+        levels = list(self.levels())
+        # Subtree sizes, deepest level first
+        for start, end in reversed(levels[1:]):
+            np.add.at(self.size, self.parent[start:end], self.size[start:end])
+        # Pre-order numbers, top level first: a node comes right after its
+        # parent and the subtrees of its earlier siblings.
+        self.tin = np.zeros(n_nodes, dtype=np.int64)
+        self.root = np.arange(n_nodes, dtype=np.int64)
+        for start, end in levels:
+            nodes = np.arange(start, end)
+            nodes = nodes[np.argsort(self.parent[nodes], kind="stable")]
+            sizes = self.size[nodes]
+            offsets = np.cumsum(sizes) - sizes
+            group_start = np.r_[True, self.parent[nodes][1:] != self.parent[nodes][:-1]]
+            offsets -= np.maximum.accumulate(np.where(group_start, offsets, 0))
+            if start == 0:
+                self.tin[nodes] = offsets
+            else:
+                self.tin[nodes] = self.tin[self.parent[nodes]] + 1 + offsets
+                self.root[nodes] = self.root[self.parent[nodes]]
+        self.tout = self.tin + self.size
+        self.preorder = np.empty(n_nodes, dtype=np.int64)
+        self.preorder[self.tin] = np.arange(n_nodes)
+        # Nodes before a node in post-order are those before it in pre-order
+        # other than its ancestors, plus its descendants.
+        self.postorder = self.tin - self.depth + self.size - 1
+        self.descendant_org_count = self.size - 1
+
+    def subtree_sums(self, values):
+        '''
+        Returns the sum of a value over the subtree of every node.
+        Args:
+            values: a numpy array holding a value per node.
+        '''
+        # Subtrees are ranges of the pre-order numbering
+        cumulative = np.r_[0, np.cumsum(values[self.preorder])]
+        return cumulative[self.tout] - cumulative[self.tin]
+
+    def subtree_distinct_counts(self, nodes, values):
+        '''
+        Returns the number of distinct values found in the subtree of every
+        node, given the values held directly by each node.
+        Args:
+            nodes, values: sequences of the same length pairing a node with a
+                value it holds.
+        '''
+        pairs = pd.DataFrame({"node": nodes, "value": values}).drop_duplicates()
+        levels = [pairs]
+        # Hand every value up to the ancestors, one level at a time
+        while len(pairs):
+            pairs = pairs.assign(node=self.parent[pairs["node"].to_numpy()])
+            pairs = pairs[pairs["node"] != NO_NODE].drop_duplicates()
+            levels.append(pairs)
+        counts = pd.concat(levels).drop_duplicates()["node"].value_counts()
+        distinct_counts = np.zeros(len(self), dtype=np.int64)
+        distinct_counts[counts.index.to_numpy(dtype=np.int64)] = counts.to_numpy()
+        return distinct_counts
+
+    def label(self, node):
+        ''' Returns the name of a node as shown in the chart. '''
+        return self.labels[self.name_ids[node]]
+
+    def children(self, node):
+        ''' Returns the children of a node, in order. '''
+        children = []
+        child = self.first_child[node]
+        while child != NO_NODE:
+            children.append(child)
+            child = self.next_sibling[child]
+        return children
+
+    def subtree(self, node):
+        ''' Returns the nodes of the subtree of a node, in pre-order. '''
+        return self.preorder[self.tin[node]:self.tout[node]]
+
+    def is_ancestor(self, ancestor, node):
+        ''' Returns whether ancestor is node or one of its ancestors. '''
+        return self.tin[ancestor] <= self.tin[node] < self.tout[ancestor]
+
+    def path(self, node):
+        '''
+        Returns the path to a node from its department root: the position of
+        each node on the way among its siblings.
+        '''
+        path = []
+        while self.parent[node] != NO_NODE:
+            path.append(int(self.child_position[node]))
+            node = self.parent[node]
+        return path[::-1]
+
+    def to_dict(self, node):
+        ''' Returns the subtree of a node as nested {"name", "_children"} dicts. '''
+        return self._dict_builder()(int(node))
+
+    def to_dicts(self, nodes):
+        ''' Returns the subtrees of several nodes; cheaper than calling to_dict on each. '''
+        to_dict = self._dict_builder()
+        return [to_dict(int(node)) for node in nodes]
+
+    def to_list(self):
+        ''' Returns the whole chart as a list of department dicts. '''
+        return self.to_dicts(self.roots.tolist())
+
+    def _dict_builder(self):
+        ''' Returns a function building the nested dict of a node. '''
+        # Plain lists are much faster to index from python than numpy arrays
+        labels = [self.labels[name_id] for name_id in self.name_ids.tolist()]
+        first_child = self.first_child.tolist()
+        next_sibling = self.next_sibling.tolist()
+        org_ids = [str(org_id) if org_id != NO_NODE else None for org_id in self.org_id.tolist()]
+        direct_headcount = self.direct_headcount.tolist()
+        total_headcount = self.total_headcount.tolist()
+        job_title_count = self.job_title_count.tolist()
+        descendant_org_count = self.descendant_org_count.tolist()
+        def to_dict_rec(node):
+            # Keys are in the order of the charts built so far
+            res = {"name": labels[node]}
+            child = first_child[node]
+            if child != NO_NODE:
+                res["_children"] = []
+                while child != NO_NODE:
+                    res["_children"].append(to_dict_rec(child))
+                    child = next_sibling[child]
+            res["org_id"] = org_ids[node]
+            res["direct_headcount"] = direct_headcount[node]
+            res["total_headcount"] = total_headcount[node]
+            res["job_title_count"] = job_title_count[node]
+            res["descendant_org_count"] = descendant_org_count[node]
+            return res
+        return to_dict_rec
+
+    def to_json(self, node=None):
+        ''' Serializes the subtree of a node, or the whole chart if node is None. '''
+        return dumps(self.to_list() if node is None else self.to_dict(node))
@@ -1,52 +1,136 @@
 import json
 
-from sqlalchemy import create_engine
+import numpy as np
+import pandas as pd
 from sqlalchemy.types import Integer, Text
 
-from schedule.config import SQLAlchemyConfig
-from schedule.main.utils.db_utils import assemble_sqlalchemy_url
-from schedule.main.organization.search import get_path_to_node
+from schedule.main.utils.db_utils import get_engine, upsert_rows
+from schedule.main.utils.sql_loader import load_table
+from schedule.main.organization.org_chart_index import OrgChartIndex
+from schedule.main.organization.org_tree import NO_NODE
 
-def create_organization_table(df, org_chart_en, org_chart_fr, tree_depth=7):
+# Columns of the organizations table and their sql types
+ORGANIZATION_DTYPES = {
+    "org_id": Integer,
+    "org_name_en": Text,
+    "org_name_fr": Text,
+    "dept_id": Integer,
+    "org_chart_path": Text,
+    "direct_headcount": Integer,
+    "total_headcount": Integer,
+    "job_title_count": Integer,
+    "descendant_org_count": Integer,
+    "lft": Integer,
+    "rgt": Integer,
+}
+ORGANIZATION_COLUMNS = list(ORGANIZATION_DTYPES)
+
+def create_organization_table(df, org_chart_en, org_chart_fr, tree_depth=7, org_index_en=None):
+    '''
+    Creates the organization table in the database. An OrgChartIndex of the
+    english org chart can be passed in to reuse one built by an earlier stage.
+    '''
+    org_df = get_organization_df(df, org_chart_en, org_index_en=org_index_en)
+    load_organization_table(org_df)
+    return org_df
+
+def load_organization_table(org_df):
+    ''' Replaces the organizations table with the organizations of org_df. '''
+    # # Write org_df to the database
+    # Subtrees are ranges of lft within a department (see attach_nested_sets)
+    load_table(org_df[ORGANIZATION_COLUMNS], "organizations", ORGANIZATION_DTYPES,
+               primary_key="org_id", indexes=[("dept_id", "lft")])
+
+def update_organization_table(org_df, deleted_ids):
+    '''
+    Upserts the given organizations into the organizations table and deletes
+    the organizations whose id is in deleted_ids.
+    '''
+    upsert_rows(get_engine(), "organizations", "org_id", org_df[ORGANIZATION_COLUMNS],
+                ORGANIZATION_DTYPES, deleted_keys=deleted_ids)
+
+def get_organization_df(df, org_chart_en, org_index_en=None):
     '''
-    Creates the organization table in the database.
+    Returns a dataframe with one row per organization, including the path to
+    the organization in the english org chart, its headcounts and its nested
+    set numbers.
     '''
-    engine = create_engine(assemble_sqlalchemy_url(SQLAlchemyConfig))
     # Get a dataframe with unique organizations
     org_df = df[["org_id", "org_name_en", "org_name_fr", "dept_id", "department_en", "department_fr", "org_structure_en", "org_structure_fr"]].drop_duplicates()
-    # Get the paths to each org unit and store them in a table column
-    # TODO: try normalizing text to avoid things like capital letters preventing
-    # the search from being successful
-    org_df = generate_org_paths(org_df, org_chart_en, "en")
-    # # Write org_df to the database
-    org_df[["org_id", "org_name_en", "org_name_fr", "dept_id", "org_chart_path"]].to_sql(
-        "organizations",
-        engine,
-        if_exists="replace",
-        index=False,
-        chunksize=1000,
-        dtype={
-            "org_id": Integer,
-            "org_name_en": Text,
-            "org_name_fr": Text,
-            "dept_id": Integer,
-            "org_chart_path": Text,
-        })
-    return org_df
+    # Get the paths to each org unit and store them in a table column; names
+    # are matched to the org chart by their normalized key (see OrgChartIndex)
+    if org_index_en is None:
+        org_index_en = OrgChartIndex(org_chart_en)
+    org_df = generate_org_paths(org_df, org_chart_en, "en", org_index=org_index_en)
+    nodes = get_org_nodes(org_df, org_index_en, "en")
+    org_df = attach_org_headcounts(org_df, org_index_en, "en", nodes=nodes)
+    return attach_nested_sets(org_df, org_index_en.org_chart, nodes)
 
-def generate_org_paths(df, org_chart, lang):
+def generate_org_paths(df, org_chart, lang, org_index=None):
     '''
     Generates the path to each business unit in the org chart.
     '''
-    def get_org_path(row, org_chart):
-        ''' Finds the relevant org chart to search, then returns the path
-            to that org chart.'''
-        dept = [dept for dept in org_chart
-                     if dept.get("name") == row[f"department_{lang}"]]
-        if dept:
-            path_to_node = get_path_to_node(row[f"org_name_{lang}"], dept[0])
-            return json.dumps(path_to_node)
-        return None
+    if org_index is None:
+        org_index = OrgChartIndex(org_chart)
+    paths = [org_index.get_path(dept, org_name) for dept, org_name
+             in zip(df[f"department_{lang}"], df[f"org_name_{lang}"])]
     # Serialize the path to the node as a string
-    df["org_chart_path"] = df.apply(get_org_path, axis=1, args=(org_chart,))
-    return df
\ No newline at end of file
+    df["org_chart_path"] = [json.dumps(path) if path is not None else None
+                            for path in paths]
+    return df
+
+def get_org_nodes(df, org_index, lang):
+    '''
+    Returns the node of each business unit in the org chart, or NO_NODE for
+    units that are not in the chart, as a numpy array.
+    '''
+    nodes = [org_index.get_node(dept, org_name) for dept, org_name
+             in zip(df[f"department_{lang}"], df[f"org_name_{lang}"])]
+    return np.array([node if node is not None else NO_NODE for node in nodes], dtype=np.int64)
+
+def attach_org_headcounts(df, org_index, lang, nodes=None):
+    '''
+    Copies the headcounts of each business unit's node in the org chart (see
+    prepare_org_chart.attach_headcounts); they are missing for units that are
+    not in the chart. The nodes can be passed in if get_org_nodes was called
+    already.
+    '''
+    if nodes is None:
+        nodes = get_org_nodes(df, org_index, lang)
+    org_chart = org_index.org_chart
+    columns = ["direct_headcount", "total_headcount", "job_title_count", "descendant_org_count"]
+    return attach_node_values(df, nodes, dict((column, getattr(org_chart, column)) for column in columns))
+
+def attach_nested_sets(df, org_chart, nodes):
+    '''
+    Numbers each business unit as in a nested set: lft is the pre-order number
+    of its node within its department's org chart and rgt the last number of
+    its subtree, so the units under a unit (itself included) are those of its
+    department whose lft is between its lft and rgt. The depth of the node is
+    kept in org_chart_depth, for the closure table (see org_closure.py).
+    Args:
+        df: a pandas dataframe of business units.
+        org_chart: the OrgTree the nodes belong to.
+        nodes: the node of each unit, as returned by get_org_nodes.
+    '''
+    # Pre-order numbers are contiguous within each department root
+    offset = org_chart.tin[org_chart.root]
+    return attach_node_values(df, nodes, {
+        "lft": org_chart.tin - offset,
+        "rgt": org_chart.tout - 1 - offset,
+        "org_chart_depth": org_chart.depth,
+    })
+
+def attach_node_values(df, nodes, columns):
+    '''
+    Adds a nullable integer column to df for each array of node values in
+    columns, holding the value of each row's node; values are missing for
+    rows without a node.
+    '''
+    found = nodes != NO_NODE
+    for column, node_values in columns.items():
+        values = pd.array(np.zeros(len(df), dtype=np.int64), dtype="Int64")
+        values[found] = node_values[nodes[found]]
+        values[~found] = pd.NA
+        df[column] = values
+    return df
@@ -1,23 +1,76 @@
 import os
 
+import numpy as np
 import pandas as pd
 
 from schedule.config import DataConfig
 
-from schedule.main.utils.fetch_data import fetch_geds
+from schedule.main.utils.fetch_data import download_if_changed, read_geds_zip
+from schedule.main.utils.frame_cache import get_cache_key, load_cached_frame, save_cached_frame
+from schedule.main.utils.dtype_plan import apply_dtype_plan, ID_DTYPE
+from schedule.main.utils.id_registry import open_id_registry, KINDS
+from schedule.main.utils.normalization import clean_name, map_unique
+
+# Columns holding the names numbered by the org_id and dept_id keys
+KEY_COLUMNS = {"org_id": "compound_name_en", "dept_id": "department_en"}
 
 def prepare_data():
-    ''' Returns the prepared dataframe. '''
+    '''
+    Returns the prepared dataframe, with the ids of the id registry if it is
+    enabled (see id_registry.py).
+    '''
     # If geds data already exists, load it from csv; otherwise fetch it from url.
     if os.path.isfile(DataConfig.ORIGINAL_DATA_PATH):
         print("Geds data is already here, load from csv")
-        df = load_from_csv()
     else:
-        # Fetch the GEDS csv, then write it to disk
-        df = fetch_geds(DataConfig.GEDS_DATA_URL)
-        df.to_csv(DataConfig.ORIGINAL_DATA_PATH)
-    df = preprocess_columns(df)
-    return create_table_keys(df)
+        update_geds_data()
+    if not DataConfig.USE_FRAME_CACHE:
+        return apply_id_registry(apply_dtype_plan(create_table_keys(preprocess_columns(load_from_csv()))))
+    # Reuse the frame prepared by a previous run from the same csv and config
+    cache_key = get_cache_key(DataConfig.ORIGINAL_DATA_PATH, DataConfig)
+    df = load_cached_frame(DataConfig.FRAME_CACHE_DIR, cache_key)
+    if df is not None:
+        print("Loaded the prepared geds data from the cache")
+        # Frames cached before the dtype plan changed are converted on load
+        return apply_id_registry(apply_dtype_plan(df))
+    df = apply_dtype_plan(create_table_keys(preprocess_columns(load_from_csv())))
+    # The cached frame keeps the positional ids, so it never holds ids the
+    # registry does not
+    save_cached_frame(df, DataConfig.FRAME_CACHE_DIR, cache_key)
+    return apply_id_registry(df)
+
+def update_geds_data():
+    '''
+    Brings the GEDS csv up to date with the dataset published at the GEDS url.
+    The zipped dataset is only downloaded when the server reports a change
+    (see download_if_changed), and the csv is only written again from a newer
+    zip. With a negative download_max_age, an existing csv is used as is.
+    Returns:
+        The dict returned by download_if_changed, with the status "local" if
+        the existing csv was used as is.
+    '''
+    if DataConfig.DOWNLOAD_MAX_AGE < 0 and os.path.isfile(DataConfig.ORIGINAL_DATA_PATH):
+        return {"status": "local", "changed": False, "bytes": 0}
+    download = download_if_changed(DataConfig.GEDS_DATA_URL, DataConfig.DOWNLOAD_PATH,
+                                   max_age=DataConfig.DOWNLOAD_MAX_AGE, timeout=DataConfig.DOWNLOAD_TIMEOUT)
+    print(f"Geds data {download['status'].replace('_', ' ')} ({download['bytes']} bytes received)")
+    if (not os.path.isfile(DataConfig.ORIGINAL_DATA_PATH)
+            or os.path.getmtime(DataConfig.ORIGINAL_DATA_PATH) < os.path.getmtime(DataConfig.DOWNLOAD_PATH)):
+        # Stream the GEDS csv to disk
+        write_geds_to_csv(DataConfig.DOWNLOAD_PATH, DataConfig.ORIGINAL_DATA_PATH)
+    return download
+
+def write_geds_to_csv(zip_path, path):
+    '''
+    Parses the zipped GEDS dataset chunk by chunk and appends each chunk to a
+    csv, so the full dataset never needs to be held in memory.
+    '''
+    # Write to a temporary file first so an interrupted extraction is never
+    # mistaken for a complete copy of the data on the next run.
+    partial_path = path + ".part"
+    for idx, chunk in enumerate(read_geds_zip(zip_path, chunksize=DataConfig.FETCH_CHUNK_SIZE)):
+        chunk.to_csv(partial_path, mode="w" if idx == 0 else "a", header=(idx == 0), index=False)
+    os.replace(partial_path, path)
 
 def load_from_csv():
     ''' Returns a pandas dataframe containing the employee data. '''
@@ -37,12 +90,10 @@ def preprocess_columns(df):
     # Alias the column names to something sql friendly
     df.columns = DataConfig.COLUMN_ALIASES
     # Standardize the format of organization/department names because they will
-    # be used downstream to specify the org chart tree.
-    remove_pattern = "|".join(DataConfig.ORG_SPECIAL_CHARACTERS)
-    cols_to_format = ["department_en", "department_fr", "org_name_en", "org_name_fr"]
-    df[cols_to_format] = df[cols_to_format].replace(remove_pattern, ' ', regex=False)
-    # Strip white spaces from end of strings
-    df[cols_to_format] = df[cols_to_format].apply(lambda x: x.str.strip())
+    # be used downstream to specify the org chart tree. Each distinct name is
+    # cleaned once.
+    for col in ["department_en", "department_fr", "org_name_en", "org_name_fr"]:
+        df[col] = map_unique(df[col], clean_name)
     # Create a compound name of "dept:org" in case two departments have
     # organizations with identical names.
     df["compound_name_en"] = df["department_en"] + ": " + df['org_name_en']
@@ -51,19 +102,70 @@ def preprocess_columns(df):
     df["full_name"] = df["first_name"] + " " + df["last_name"]
     return df
 
-def create_table_keys(df):
+def create_table_keys(df, categories=None):
     '''
     Creates unique integer keys for organizations and departments so tables can
     be linked later on.
+    Args:
+        df: a pandas dataframe, as returned by preprocess_columns.
+        categories: for frames holding part of the dataset, the names the keys
+            number, as returned by get_key_categories for the whole dataset;
+            by default the keys number the names found in df.
     '''
     # Use the index as the individaul id
     df["employee_id"] = df.index
-    # Create unique integers for organization names
-    df = df.assign(org_id=(df["compound_name_en"]).astype('category').cat.codes)
-    # Create unique integers for departments
-    df = df.assign(dept_id=(df["department_en"]).astype('category').cat.codes)
+    return assign_group_keys(df, categories)
+
+def assign_group_keys(df, categories=None):
+    '''
+    Adds the org_id and dept_id columns to df: the position of each row's
+    compound organization name and department name in the sorted names, or -1
+    if the name is missing. See create_table_keys.
+    '''
+    categories = categories or {}
+    # Create unique integers for organization names, then for departments
+    return df.assign(**dict(
+        (key, pd.Categorical(df[column], categories=categories.get(key)).codes)
+        for key, column in KEY_COLUMNS.items()))
+
+def apply_id_registry(df):
+    '''
+    Replaces the positional keys of df, as given by create_table_keys, with
+    the ids of the id registry; returns df as is if the registry is disabled.
+    '''
+    registry = open_id_registry()
+    if registry is None:
+        return df
+    with registry:
+        df = apply_key_ids(df, get_key_ids(registry, get_key_categories(df)))
+        df["employee_id"] = registry.get_employee_ids(df).astype(ID_DTYPE)
     return df
 
+def get_key_ids(registry, categories):
+    '''
+    Returns a dict of key (org_id, dept_id) to the registry ids of the names
+    it numbers, as a numpy array in the order of categories (see
+    get_key_categories).
+    '''
+    return dict((key, registry.get_ids(KINDS[key], names)) for key, names in categories.items())
+
+def apply_key_ids(df, key_ids):
+    '''
+    Replaces the positional org_id and dept_id of df with the ids returned by
+    get_key_ids; rows without a name keep -1.
+    '''
+    # A position of -1 picks the -1 appended to the ids
+    return df.assign(**dict((key, np.append(ids, -1)[df[key].to_numpy()].astype(ID_DTYPE))
+                            for key, ids in key_ids.items()))
+
+def get_key_categories(df):
+    '''
+    Returns a dict of key (org_id, dept_id) to the sorted distinct names it
+    numbers in df, as a pandas index.
+    '''
+    return dict((key, pd.Categorical(df[column].dropna().unique()).categories)
+                for key, column in KEY_COLUMNS.items())
+
 def get_contacts_table():
     ''' Returns the contact info table of the database. '''
     df = load_as_dataframe()
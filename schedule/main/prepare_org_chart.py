@@ -1,119 +1,214 @@
+import numpy as np
 import pandas as pd
 
-from schedule.main.department.flat_to_hierarchical import get_org_chart
+from schedule.config import PipelineConfig
+from schedule.main.organization.org_tree import OrgTree, NO_NODE
+from schedule.main.utils.normalization import map_unique, name_key, split_paths
+from schedule.main.utils.parallel import get_worker_count, map_in_processes
 
-def prepare_org_chart(df, tree_depth=7):
+# Separator used to join org units into a single key; it cannot appear in the
+# GEDS org structure strings.
+PATH_SEPARATOR = "\x1f"
+# Column of the number of employees a row stands for, in frames holding one
+# row per distinct org structure rather than one per employee (see chunked.py)
+EMPLOYEE_COUNT_COLUMN = "employee_count"
+
+def prepare_org_chart(df, tree_depth=7, workers=None):
     '''
     Creates hierarchical data of the organizational structure using the csv.
+    The english and french org charts are independent and can be built in
+    separate processes.
     Args:
         df: a pandas dataframe
         tree_depth: an int specifying how deep the org chart tree should go.
+        workers: the number of processes to use; defaults to the configured
+            org_chart_workers.
     Returns:
-        org_chart: a python dict-like object containing the org chart.
+        org_chart_en, org_chart_fr: the english and french OrgTree.
+    '''
+    if workers is None:
+        workers = get_worker_count(PipelineConfig.ORG_CHART_WORKERS)
+    # Only send the columns a language needs to its worker
+    tasks = [(df[[f"org_structure_{lang}", f"department_{lang}", f"org_name_{lang}",
+                  f"job_title_{lang}", "org_id"] + get_count_columns(df)], lang, tree_depth)
+             for lang in ["en", "fr"]]
+    org_chart_en, org_chart_fr = map_in_processes(build_org_chart, tasks, workers)
+    return org_chart_en, org_chart_fr
+
+def build_org_chart(df, lang, tree_depth=7, org_id_index=None, fallback_df=None):
     '''
-    # Start by getting a dataframe that contains unique organization structures
-    # in both languages
-    org_struc_en = df["org_structure_en"].str.replace('\(.*?\)', '').drop_duplicates()
-    org_struc_fr = df["org_structure_fr"].str.replace('\(.*?\)', '').drop_duplicates()
-    # Split org units into columns and keep a subset of them based on the
-    # desired tree depth.
-    org_struc_en = org_struc_en.str.split(" :", n=-1, expand=True)
-    org_struc_fr = org_struc_fr.str.split(" :", n=-1, expand=True)
-    # Column subset is the same in both languages
-    columns = [i for i in range(0, min(tree_depth + 1, len(org_struc_en.columns)), 1)]
-    org_struc_en = org_struc_en[columns]
-    org_struc_fr = org_struc_fr[columns]
+    Builds the org chart of one language.
+    Args:
+        df: a pandas dataframe containing the org_structure, department,
+            org_name and job_title columns of the language, and org_id.
+        lang: the language of the org chart ("en" or "fr").
+        tree_depth: an int specifying how deep the org chart tree should go.
+        org_id_index: the index used to match nodes to an org_id (see
+            build_org_id_index); built from df if None.
+        fallback_df: employees of other departments to count in this chart,
+            see attach_headcounts.
+    Returns:
+        org_chart: an OrgTree.
+    '''
+    # Start by getting the unique organization structures, and split each one
+    # into its org units, keeping a subset of them based on the desired tree
+    # depth.
+    org_struc = df[f"org_structure_{lang}"].dropna().drop_duplicates()
+    org_struc = split_paths(org_struc, max_units=tree_depth + 1)
+    columns = list(org_struc.columns)
     # Remove duplicates to generate org chart
-    org_struc_en = remove_duplicates(org_struc_en, columns)
-    org_struc_fr = remove_duplicates(org_struc_fr, columns)
-    # Get the org charts
-    org_chart_en = get_org_chart(org_struc_en)
-    org_chart_fr = get_org_chart(org_struc_fr)
-    # Remove any instances of None from the list of org charts
-    # TODO: check why one of the departments yields None
-    org_chart_en = [dept for dept in org_chart_en if dept is not None]
-    org_chart_fr = [dept for dept in org_chart_fr if dept is not None]
+    org_struc = remove_duplicates(org_struc, columns)
+    # Get the org chart
+    org_chart = OrgTree.from_paths(org_struc)
     # Attach an organization ID to every org chart node
-    df["org_name_en_lower"] = df["org_name_en"].str.lower()
-    # TODO: maybe just assign french org charts org_id's created from traversing
-    # the english tree to avoid character encoding errors.
-    # df["org_name_fr_lower"] = df["org_name_fr"].str.lower()
-    org_chart_en = attach_org_id(df, org_chart_en, lang="en")
-    # org_chart_fr = attach_org_id(df, org_chart_fr, lang="fr")
-    return org_chart_en, org_chart_fr
+    org_chart = attach_org_id(df, org_chart, lang=lang, org_id_index=org_id_index)
+    # Roll the employees of every organization up the org chart
+    return attach_headcounts(df, org_chart, lang=lang, fallback_df=fallback_df)
 
 def remove_duplicates(df, columns):
-    ''' Removes duplicate organizations. '''
-    # Need to restructure the dataframe to avoid duplicates when
-    # it is parsed into a dict-like object.
-    #==============================================================================
-    # Algorithm: if the number of 'Nones' between two consecutive rows differ by 1,
-    # keep the row with fewer 'Nones'. If they differ by more than one 'Nones', then 
-    # keep both because these are two different paths
-    #==============================================================================
-    # Dataframe to store the unique rows
-    unique_df = pd.DataFrame(columns=columns)
-    # Declare initial values
-    past_Nones = 0
-    current_Nones = 0
-    past_row = df.iloc[0]
-    # Loop over all rows in org_struc
-    for idx, row in df.iloc[1:].iterrows():
-        # Calculate past nones and present nones
-        for cid in range(1,len(row)):
-            if past_row[cid] is None:
-                past_Nones += 1
-            if row[cid] is None:
-                current_Nones += 1
-        # Check the difference between past nones and current nones
-        diff = past_Nones - current_Nones
-        # If diff > 0, then move onto the next row to check - Note that diff will
-        # always be 1 if diff > 0 because of the tree structure of the data
-        if diff > 0:
-            pass
-        # If diff <= 0, then the past row must be unique - add it to unique_dfs
-        else:
-            unique_df = unique_df.append(past_row)
-        # Update past row to be the current row
-        past_row = row
-        # Reset the None counts
-        past_Nones = 0
-        current_Nones = 0
-    return unique_df
+    '''
+    Removes duplicate organizations. A path through the org structure is
+    redundant if it is identical to, or a strict prefix of, another path, since
+    building the longer path creates every node of the shorter one.
+    Args:
+        df: a pandas dataframe with one org unit per column; paths shorter than
+            the number of columns are padded with None.
+        columns: the list of columns that make up a path.
+    Returns:
+        A pandas dataframe containing the paths that are not redundant, in their
+        original order.
+    '''
+    df = df[columns].drop_duplicates()
+    # The depth of a path is the number of org units it contains
+    depth = df.notna().sum(axis=1)
+    # Paths without any org unit do not describe anything
+    keep = depth > 0
+    # Grow a key for the prefix of every path one level at a time. A path of
+    # depth k is a strict prefix of another path exactly when its key equals
+    # the level-k key of a deeper path.
+    prefix = pd.Series("", index=df.index)
+    for level, col in enumerate(columns, start=1):
+        prefix = prefix + PATH_SEPARATOR + df[col].fillna("").astype(str)
+        deeper_prefixes = prefix[depth > level].unique()
+        keep &= ~((depth == level) & prefix.isin(deeper_prefixes))
+    return df[keep]
 
-def attach_org_id(df, org_chart, lang="en"):
+def attach_org_id(df, org_chart, lang="en", org_id_index=None):
     '''
-    For every node in the org chart, attaches a key that contains the
-    organization id of each business unit.
+    For every node in the org chart, attaches the organization id of the
+    business unit.
     Args:
         df: a pandas dataframe containing the geds dataset.
-        org_chart: a dict-like structure containing hierarchical org chart data.
+        org_chart: an OrgTree containing the org chart.
+        lang: the language of the org chart ("en" or "fr").
+        org_id_index: the index returned by build_org_id_index; built from df
+            if None.
     '''
-    for idx, chart in enumerate(org_chart):
-        recursive_add(chart, df, lang=lang)
-        # if idx > 1: break
+    if org_id_index is None:
+        org_id_index = build_org_id_index(df, lang=lang)
+    # Names are interned, so each distinct name is normalized once
+    keys = [name_key(label) for label in org_chart.labels]
+    node_keys = [keys[name_id] for name_id in org_chart.name_ids.tolist()]
+    unmatched = 0
+    for node, root in enumerate(org_chart.root.tolist()):
+        # Each root is a department; prefer matches within it so that
+        # identically named units in other departments are not picked up.
+        dept_index = org_id_index["departments"].get(node_keys[root], {})
+        org_id = dept_index.get(node_keys[node])
+        if org_id is None:
+            org_id = org_id_index["all"].get(node_keys[node])
+        if org_id is None:
+            unmatched += 1
+        else:
+            org_chart.org_id[node] = org_id
+    if unmatched:
+        print(f"could not find match for {unmatched} org chart nodes ({lang})")
     return org_chart
 
-def recursive_add(org_chart, df, lang="en"):
+def attach_headcounts(df, org_chart, lang="en", fallback_df=None):
     '''
-    Adds the org_id to each node of the org chart. This is used downstream to
-    perform fast lookup on data related to the organization. For example, given
-    the org_id, it is possible to look up information for all people on that
-    team.
+    Computes the direct and total headcount, the number of distinct job titles
+    and the number of descendant organizations of every node of the org chart.
+    Args:
+        df: a pandas dataframe containing the geds dataset.
+        org_chart: an OrgTree whose nodes have their org_id attached.
+        lang: the language of the org chart ("en" or "fr").
+        fallback_df: the org_id, department, job title (and employee count)
+            of employees of other departments whose organization has no
+            node in its own department, to count in this chart. Charts of a
+            single department use it, since df holds the employees of that
+            department only (see sharding.py).
     '''
-    if org_chart.get("_children") is None:
-        org_chart["org_id"] = get_org_id(org_chart['name'], df, lang=lang)
-#         print("org chart is ", org_chart)
+    if fallback_df is not None:
+        df = pd.concat([df[fallback_df.columns], fallback_df], ignore_index=True)
+    # When several nodes were matched to the same org_id (a department and
+    # the child named after it, for one), its employees are counted once,
+    # under the first node in post-order of the organization's own
+    # department; this is the node that the paths to organizations point to.
+    # Nodes of other departments, matched through the "all" index of
+    # build_org_id_index, only count them when the organization has no node
+    # in its own department: then the first of them in post-order of the
+    # department that comes first by name_key.
+    nodes = get_matched_nodes(df, org_chart, lang=lang)
+    nodes["other_department"] = ~nodes["own_department"]
+    nodes["postorder"] = org_chart.postorder[nodes["node"].to_numpy()]
+    nodes = nodes.sort_values(["other_department", "root_key", "postorder"], kind="stable")
+    nodes = nodes.drop_duplicates("org_id")
+    if EMPLOYEE_COUNT_COLUMN in df.columns:
+        headcounts = df.groupby("org_id")[EMPLOYEE_COUNT_COLUMN].sum()
     else:
-        for idx, child in enumerate(org_chart["_children"]):
-            recursive_add(child, df)
+        headcounts = df.groupby("org_id").size()
+    direct_headcount = np.zeros(len(org_chart), dtype=np.int64)
+    direct_headcount[nodes["node"].to_numpy()] = headcounts.reindex(nodes["org_id"]).fillna(0)
+    org_chart.direct_headcount = direct_headcount
+    org_chart.total_headcount = org_chart.subtree_sums(direct_headcount)
+    titles = df[["org_id", f"job_title_{lang}"]].dropna().drop_duplicates()
+    titles = nodes.merge(titles, on="org_id")
+    org_chart.job_title_count = org_chart.subtree_distinct_counts(
+        titles["node"].to_numpy(), titles[f"job_title_{lang}"].to_numpy())
+    return org_chart
+
+def get_matched_nodes(df, org_chart, lang="en"):
+    '''
+    Returns a dataframe of the nodes of the org chart that were matched to an
+    org_id, with their "node", "org_id", the name_key of their department
+    root ("root_key") and whether that is the department of the org_id in df
+    ("own_department").
+    '''
+    nodes = np.flatnonzero(org_chart.org_id != NO_NODE)
+    org_ids = org_chart.org_id[nodes]
+    keys = np.array([name_key(label) for label in org_chart.labels], dtype=object)
+    root_keys = keys[org_chart.name_ids[org_chart.root[nodes]]]
+    departments = df[["org_id", f"department_{lang}"]].dropna().drop_duplicates("org_id")
+    department_keys = pd.Series(map_unique(departments[f"department_{lang}"], name_key).to_numpy(dtype=object),
+                                index=departments["org_id"].to_numpy())
+    return pd.DataFrame({"node": nodes, "org_id": org_ids, "root_key": root_keys,
+                         "own_department": root_keys == department_keys.reindex(org_ids).to_numpy(dtype=object)})
+
+def get_count_columns(df):
+    ''' Returns [EMPLOYEE_COUNT_COLUMN] if df has it, else an empty list. '''
+    return [EMPLOYEE_COUNT_COLUMN] if EMPLOYEE_COUNT_COLUMN in df.columns else []
 
-def get_org_id(org_name, df, lang="en"):
+def build_org_id_index(df, lang="en"):
     '''
-    Given a dataframe containing organization names and org_id's, returns the
-    org id associated with a given name.
+    Builds hash indexes from organization name to org_id, so that every node
+    of the org chart can be matched in constant time.
+    Args:
+        df: a pandas dataframe containing the geds dataset.
+        lang: the language of the names to index ("en" or "fr").
+    Returns:
+        A dict with two keys: "departments", mapping each department name to a
+        dict of {org name: org_id} for that department, and "all", mapping
+        every org name to the org_id of its first occurrence in the dataset.
+        Names are keyed by normalization.name_key.
     '''
-    try:
-        return str(df[df[f"org_name_{lang}_lower"] == org_name.lower()].iloc[0]["org_id"])
-    except:
-        print("could not find match for ", org_name)
\ No newline at end of file
+    orgs = df[[f"department_{lang}", f"org_name_{lang}", "org_id"]].drop_duplicates()
+    orgs = orgs.dropna(subset=[f"department_{lang}", f"org_name_{lang}"])
+    dept_keys = map_unique(orgs[f"department_{lang}"], name_key).tolist()
+    org_keys = map_unique(orgs[f"org_name_{lang}"], name_key).tolist()
+    org_ids = orgs["org_id"].tolist()
+    index = {"departments": {}, "all": {}}
+    for dept_key, org_key, org_id in zip(dept_keys, org_keys, org_ids):
+        index["departments"].setdefault(dept_key, {}).setdefault(org_key, org_id)
+        index["all"].setdefault(org_key, org_id)
+    return index
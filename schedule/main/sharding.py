@@ -0,0 +1,224 @@
+'''
+Sharded execution of the org chart stages. The prepared frame is split by
+department, and the org charts, organizations and departments of every
+department are built independently in a pool of processes; the results are
+merged into the frames the SQL and elasticsearch loaders take. The same code
+rebuilds a chosen set of departments only.
+
+A department's chart is the same whether it is built alone or with the rest
+of the dataset, since the org structure of its employees starts with the
+department. Nodes that cannot be matched to an org_id within their department
+are matched against the whole dataset, as prepare_org_chart does. The
+employees of an organization without a node in its own department are
+counted under such a node of another department (see
+prepare_org_chart.attach_headcounts); the shards report these cases, and the
+departments that count them are built again with those employees.
+'''
+import numpy as np
+import pandas as pd
+
+from schedule.config import PipelineConfig
+from schedule.main.prepare_org_chart import (
+    build_org_chart, build_org_id_index, get_count_columns, get_matched_nodes)
+from schedule.main.organization.org_chart_index import OrgChartIndex
+from schedule.main.organization.organization_table import get_organization_df
+from schedule.main.department.department_table import (
+    get_department_df, serialize_org_charts, add_org_chart_columns, print_org_chart_summary)
+from schedule.main.utils.fetch_data import get_department_subset
+from schedule.main.utils.parallel import get_worker_count, map_in_processes
+from schedule.main.utils.serialization import get_codec
+
+# Batches of departments sent to each worker. Department sizes vary a lot, so
+# a few batches per worker balance the load better than one.
+BATCHES_PER_WORKER = 4
+# Columns needed to build the org charts, organizations and departments
+SHARD_COLUMNS = ["org_id", "dept_id"] + [f"{column}_{lang}" for lang in ["en", "fr"] for column in
+                                         ["org_structure", "department", "org_name", "job_title"]]
+
+def select_departments(df, subset):
+    '''
+    Returns the rows of the employees of the given departments. Departments
+    are selected whole: if rows of a dept_id carry other acronyms as well,
+    they are kept too.
+    Args:
+        df: a pandas dataframe, as returned by prepare_data.
+        subset: a department acronym or a collection of them, as accepted by
+            fetch_geds; None selects every department.
+    '''
+    subset = get_department_subset(subset)
+    if subset is None:
+        return df
+    selected = df["department_acronym"].isin(subset)
+    missing = subset - set(df.loc[selected, "department_acronym"].unique())
+    if missing:
+        print(f"no employees found in departments {sorted(missing)}")
+    return df[df["dept_id"].isin(df.loc[selected, "dept_id"].unique())]
+
+def build_shards(df, workers=None, tree_depth=7):
+    '''
+    Builds the organizations and departments of every department of df, one
+    department at a time, in a pool of processes.
+    Args:
+        df: a pandas dataframe, as returned by prepare_data, or the org
+            structures of a chunked run (see chunked.get_structure_df).
+        workers: the number of processes to use; defaults to the configured
+            org_chart_workers.
+        tree_depth: an int specifying how deep the org chart tree should go.
+    Returns:
+        org_df, dept_df: the organizations and departments dataframes, as
+            get_organization_df and serialize_department_org_charts return
+            them.
+    '''
+    if workers is None:
+        workers = get_worker_count(PipelineConfig.ORG_CHART_WORKERS)
+    codec = get_codec(PipelineConfig.ORG_CHART_COMPRESSION)
+    fallback_indexes = dict((lang, build_org_id_index(df, lang=lang)["all"]) for lang in ["en", "fr"])
+    df = df[SHARD_COLUMNS + get_count_columns(df)]
+    tasks = [(df[df["dept_id"].isin(dept_ids)], fallback_indexes, codec, tree_depth)
+             for dept_ids in split_departments(df, workers * BATCHES_PER_WORKER if workers > 1 else 1)]
+    results = map_in_processes(build_shard_batch, tasks, workers)
+    org_df = pd.concat([org_df for org_df, _, _ in results])
+    dept_df = pd.concat([dept_df for _, dept_df, _ in results])
+    fallbacks = get_fallbacks(pd.concat([candidates for _, _, candidates in results]))
+    if len(fallbacks):
+        org_df, dept_df = rebuild_with_fallbacks(df, org_df, dept_df, fallbacks, fallback_indexes,
+                                                 codec, tree_depth)
+    # The shards have categories of their own; give the merged frames the
+    # dtypes of df again
+    org_df = restore_dtypes(org_df, df)
+    dept_df = restore_dtypes(dept_df, df)
+    print(f"Built {len(dept_df)} departments and {org_df['org_id'].nunique()} organizations "
+          f"in {len(tasks)} batches")
+    for lang in ["en", "fr"]:
+        print_org_chart_summary(dept_df, lang)
+    return org_df, dept_df
+
+def split_departments(df, n_batches):
+    '''
+    Splits the departments of df into at most n_batches lists of dept_ids with
+    similar numbers of employees: departments are dealt largest first to the
+    batch with the fewest employees so far.
+    '''
+    sizes = df.groupby("dept_id", sort=False).size().sort_values(ascending=False, kind="stable")
+    n_batches = max(min(n_batches, len(sizes)), 1)
+    batches = [[] for _ in range(n_batches)]
+    totals = np.zeros(n_batches, dtype=np.int64)
+    for dept_id, size in sizes.items():
+        batch = totals.argmin()
+        batches[batch].append(dept_id)
+        totals[batch] += size
+    return [batch for batch in batches if batch]
+
+def build_shard_batch(df, fallback_indexes, codec, tree_depth=7):
+    ''' Builds every department of a batch; run in a worker process. '''
+    results = [build_shard(remove_unused_categories(shard), fallback_indexes, codec, tree_depth)
+               for _, shard in df.groupby("dept_id", sort=False)]
+    return tuple(pd.concat(frames) for frames in zip(*results))
+
+def build_shard(df, fallback_indexes, codec, tree_depth=7, fallback_dfs=None):
+    '''
+    Builds the org charts, organizations and departments of one department.
+    Args:
+        df: a pandas dataframe containing the SHARD_COLUMNS of the employees
+            of the department (and their employee count, for org structure
+            frames).
+        fallback_indexes: a dict of language to the "all" org_id index of the
+            whole dataset (see build_org_id_index).
+        codec: the compression codec, as returned by serialization.get_codec.
+        tree_depth: an int specifying how deep the org chart tree should go.
+        fallback_dfs: a dict of language to the employees of other
+            departments to count in the department's chart, as returned by
+            get_fallback_df.
+    Returns:
+        org_df, dept_df: the organizations and the department.
+        candidates: the fallback candidates of the department's charts (see
+            get_fallback_candidates).
+    '''
+    org_indexes = {}
+    candidates = []
+    for lang in ["en", "fr"]:
+        org_id_index = build_org_id_index(df, lang=lang)
+        org_id_index["all"] = fallback_indexes[lang]
+        org_chart = build_org_chart(df, lang, tree_depth, org_id_index=org_id_index,
+                                    fallback_df=(fallback_dfs or {}).get(lang))
+        org_indexes[lang] = OrgChartIndex(org_chart)
+        candidates.append(get_fallback_candidates(df, org_chart, lang))
+    org_df = get_organization_df(df, org_indexes["en"].org_chart, org_index_en=org_indexes["en"])
+    dept_df = get_department_df(df).copy()
+    dept_df["org_chart_encoding"] = codec if codec != "none" else None
+    for lang, org_index in org_indexes.items():
+        departments = dept_df[f"department_{lang}"].tolist()
+        add_org_chart_columns(dept_df, lang, [serialize_org_charts(departments, org_index, codec)])
+    candidates = pd.concat(candidates, ignore_index=True).assign(dept_id=df["dept_id"].iloc[0])
+    return org_df, dept_df, candidates
+
+def get_fallback_candidates(df, org_chart, lang):
+    '''
+    Returns what the chart of a department tells about the employees counted
+    under a node of another department (see
+    prepare_org_chart.attach_headcounts), as a dataframe with a "lang",
+    "org_id" and "root_key" column: a row without root_key for each
+    organization of df that has no node in its own department, and a row
+    with the root_key of the node for each organization of another
+    department matched to a node of the chart.
+    '''
+    nodes = get_matched_nodes(df, org_chart, lang=lang)
+    org_ids = df["org_id"].unique()
+    unplaced = np.setdiff1d(org_ids, nodes.loc[nodes["own_department"], "org_id"].to_numpy())
+    others = nodes.loc[~nodes["org_id"].isin(org_ids), ["org_id", "root_key"]].drop_duplicates()
+    return pd.concat([pd.DataFrame({"org_id": unplaced, "root_key": None}), others],
+                     ignore_index=True).assign(lang=lang)
+
+def get_fallbacks(candidates):
+    '''
+    Returns the departments whose charts count the employees of an
+    organization of another department, as a dataframe with the "lang",
+    "org_id" and the "dept_id" that counts it. Like attach_headcounts,
+    the first department by name_key wins.
+    Args:
+        candidates: the candidates of every department, as returned by
+            build_shard.
+    '''
+    unplaced = candidates.loc[candidates["root_key"].isna(), ["lang", "org_id"]]
+    others = candidates[candidates["root_key"].notna()]
+    fallbacks = others.merge(unplaced, on=["lang", "org_id"])
+    fallbacks = fallbacks.sort_values(["root_key", "dept_id"], kind="stable")
+    return fallbacks.drop_duplicates(["lang", "org_id"])[["lang", "org_id", "dept_id"]]
+
+def get_fallback_df(df, org_ids, lang):
+    ''' Returns the columns attach_headcounts needs of the employees of the given organizations. '''
+    columns = ["org_id", f"department_{lang}", f"job_title_{lang}"] + get_count_columns(df)
+    return df.loc[df["org_id"].isin(org_ids), columns]
+
+def rebuild_with_fallbacks(df, org_df, dept_df, fallbacks, fallback_indexes, codec, tree_depth=7):
+    '''
+    Builds the departments that count employees of other departments again,
+    with those employees, and replaces their rows in org_df and dept_df.
+    There are few such departments, so they are built in this process.
+    '''
+    rebuilt = {}
+    for dept_id, dept_fallbacks in fallbacks.groupby("dept_id", sort=False):
+        fallback_dfs = dict((lang, get_fallback_df(df, lang_fallbacks["org_id"], lang))
+                            for lang, lang_fallbacks in dept_fallbacks.groupby("lang"))
+        shard = remove_unused_categories(df[df["dept_id"] == dept_id])
+        rebuilt[dept_id] = build_shard(shard, fallback_indexes, codec, tree_depth, fallback_dfs)
+    print(f"Built {len(rebuilt)} departments again to count employees of other departments")
+    def replace(frame, position):
+        return pd.concat([rebuilt[dept_id][position] if dept_id in rebuilt else rows
+                          for dept_id, rows in frame.groupby("dept_id", sort=False)])
+    return replace(org_df, 0), replace(dept_df, 1)
+
+def remove_unused_categories(df):
+    '''
+    Returns df with the categories its rows do not use removed. String methods
+    of categoricals work on the categories, so without this every shard would
+    process the names of the whole dataset.
+    '''
+    return df.assign(**dict((column, df[column].cat.remove_unused_categories())
+                            for column in df.columns if isinstance(df[column].dtype, pd.CategoricalDtype)))
+
+def restore_dtypes(merged_df, df):
+    ''' Casts the columns of merged_df that are categoricals in df back to df's dtype. '''
+    return merged_df.astype(dict((column, df[column].dtype) for column in merged_df.columns
+                                 if column in df.columns
+                                 and isinstance(df[column].dtype, pd.CategoricalDtype)))
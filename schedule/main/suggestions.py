@@ -0,0 +1,369 @@
+'''
+Search suggestions for the names of employees and organizations. Every
+employee and organization gets one suggestion, matched by the prefixes of its
+names (in english and french) with accents and case ignored, and ranked by a
+weight: the total headcount of an organization, so that large organizations
+come first, and EMPLOYEE_WEIGHT for employees.
+
+The suggestions are sent to elasticsearch for its completion suggester (see
+elastic_bulk_upload.py), and written to a standalone sqlite file kept next to
+the database. The file holds every key of every suggestion in a table sorted
+by key, so the suggestions of a prefix are a range of it: SuggestionIndex
+serves them without elasticsearch. The ranges of the shortest prefixes span
+much of the table, so their best suggestions are ranked once, when the file
+is written.
+'''
+import os
+import re
+import sqlite3
+
+import numpy as np
+import pandas as pd
+
+from schedule.main.utils.normalization import fold_name
+
+KINDS = ["employee", "organization"]
+# Weight of employee suggestions; organizations weigh their total headcount
+EMPLOYEE_WEIGHT = 1
+# Number of words of a name a key can start at, from its first word: "jane
+# smith" is found by "ja" and by "smi"
+MAX_KEY_WORDS = 8
+SUGGESTION_COLUMNS = ["suggestion_id", "kind", "entity_id", "name_en", "name_fr", "context_en", "context_fr",
+                      "dept_id", "weight"]
+WORD = re.compile(r"\w+")
+# Sorts after every character, to bound the range of keys starting with a prefix
+MAX_CHARACTER = "\U0010ffff"
+# Prefixes up to this many characters have their best TOP_SUGGESTIONS ranked
+# in advance, for each kind and for both kinds ("")
+TOP_PREFIX_LENGTH = 2
+TOP_SUGGESTIONS = 25
+# Number of keys ranked at a time
+RANK_CHUNK_SIZE = 200000
+# The suggestion file is written from scratch and only replaces the previous
+# one once complete, so it needs no journal
+WRITE_PRAGMAS = ["PRAGMA journal_mode = OFF", "PRAGMA synchronous = OFF"]
+
+def get_suggestion_df(emp_docs, org_docs):
+    '''
+    Returns the suggestions of the employees and organizations, from the
+    documents of merge_dataframes.
+    Returns:
+        A pandas dataframe with the SUGGESTION_COLUMNS and a keys column
+        holding the list of keys each suggestion is found by (see
+        get_name_keys). The context of an employee is their organization, the
+        one of an organization its department.
+    '''
+    return pd.concat([get_organization_suggestions(org_docs), get_employee_suggestions(emp_docs)],
+                     ignore_index=True)
+
+def get_employee_suggestions(emp_docs):
+    ''' Returns the suggestions of employees (see get_suggestion_df). '''
+    return build_suggestions("employee", emp_docs["employee_id"], emp_docs["full_name"],
+                             emp_docs["full_name"], emp_docs["org_name_en"], emp_docs["org_name_fr"],
+                             emp_docs["dept_id"], EMPLOYEE_WEIGHT)
+
+def get_organization_suggestions(org_docs):
+    ''' Returns the suggestions of organizations (see get_suggestion_df). '''
+    # Organizations missing from the org chart have no headcount
+    weight = org_docs["total_headcount"].fillna(0).astype("int64")
+    return build_suggestions("organization", org_docs["org_id"], org_docs["org_name_en"],
+                             org_docs["org_name_fr"], org_docs["department_en"], org_docs["department_fr"],
+                             org_docs["dept_id"], weight)
+
+def build_suggestions(kind, ids, names_en, names_fr, contexts_en, contexts_fr, dept_ids, weight):
+    ''' Returns a suggestions dataframe, leaving out the entities without a name. '''
+    ids = ids.astype("int64")
+    df = pd.DataFrame({
+        "suggestion_id": get_suggestion_ids(kind, ids),
+        "kind": kind,
+        "entity_id": ids.to_numpy(),
+        "name_en": names_en.to_numpy(),
+        "name_fr": names_fr.to_numpy(),
+        "context_en": contexts_en.to_numpy(),
+        "context_fr": contexts_fr.to_numpy(),
+        "dept_id": dept_ids.astype("int64").to_numpy(),
+        "weight": weight.to_numpy() if isinstance(weight, pd.Series) else weight,
+        "keys": get_suggestion_keys([names_en, names_fr]),
+    })
+    return df[df["keys"].str.len() > 0].reset_index(drop=True)
+
+def get_suggestion_ids(kind, ids):
+    ''' Returns the ids of the suggestions of the given employee or organization ids. '''
+    return [f"{kind}-{int(entity_id)}" for entity_id in ids]
+
+def get_suggestion_keys(name_columns):
+    '''
+    Returns, for each row, the keys of the names of the row in any of the
+    given columns, without duplicates. The keys of each distinct name are
+    worked out once.
+    Args:
+        name_columns: a list of pandas series of names, sharing an index.
+    '''
+    row_keys = None
+    for column, names in enumerate(name_columns):
+        # Employees have the same name in both languages
+        if any(names is other for other in name_columns[:column]):
+            continue
+        codes, uniques = pd.factorize(names)
+        keys = [get_name_keys(name) for name in uniques] + [[]]
+        if row_keys is None:
+            row_keys = [keys[code] for code in codes.tolist()]
+        else:
+            row_keys = [row + [key for key in keys[code] if key not in row] if keys[code] != row else row
+                        for row, code in zip(row_keys, codes.tolist())]
+    return row_keys
+
+def get_name_keys(name):
+    '''
+    Returns the keys a name is found by: its folded words (see
+    normalization.fold_name) from each of its first MAX_KEY_WORDS words to its
+    end, so any of them can start a prefix.
+    '''
+    words = get_words(name)
+    return [" ".join(words[start:]) for start in range(min(len(words), MAX_KEY_WORDS))]
+
+def get_prefix_key(prefix):
+    ''' Returns the form of a prefix typed by a user that is compared with the keys. '''
+    return " ".join(get_words(prefix))
+
+def get_words(name):
+    return WORD.findall(fold_name(name)) if isinstance(name, str) else []
+
+def write_suggestion_index(suggestions, path):
+    '''
+    Writes the suggestion file, replacing the previous one once the new one is
+    complete.
+    Args:
+        suggestions: a pandas dataframe of suggestions, as returned by
+            get_suggestion_df, or an iterable of them.
+        path: the path of the sqlite file.
+    Returns:
+        The number of suggestions written.
+    '''
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    part_path = path + ".part"
+    if os.path.exists(part_path):
+        os.remove(part_path)
+    conn = sqlite3.connect(part_path)
+    try:
+        for pragma in WRITE_PRAGMAS:
+            conn.execute(pragma)
+        create_suggestion_tables(conn)
+        create_staging_tables(conn)
+        n_suggestions = sum(insert_suggestions(conn, frame) for frame in
+                            ([suggestions] if isinstance(suggestions, pd.DataFrame) else suggestions))
+        store_suggestions(conn)
+        # Indexed once filled, for the updates of update_suggestion_index
+        conn.execute("CREATE INDEX suggestions_dept_id ON suggestions (dept_id)")
+        conn.execute("CREATE INDEX suggestion_keys_suggestion_id ON suggestion_keys (suggestion_id)")
+        rank_top_suggestions(conn)
+        conn.commit()
+    finally:
+        conn.close()
+    os.replace(part_path, path)
+    return n_suggestions
+
+def update_suggestion_index(suggestion_df, dept_ids, path):
+    '''
+    Replaces the suggestions of the given departments in the suggestion file
+    with those of suggestion_df. Returns the number of suggestions written, or
+    None if there is no suggestion file yet.
+    '''
+    if not os.path.isfile(path):
+        print(f"There is no suggestion index at {path} yet; it is written by the next full refresh")
+        return None
+    conn = sqlite3.connect(path)
+    try:
+        placeholders = ", ".join("?" * len(dept_ids))
+        dept_ids = [int(dept_id) for dept_id in dept_ids]
+        conn.execute(f"DELETE FROM suggestion_keys WHERE suggestion_id IN "
+                     f"(SELECT suggestion_id FROM suggestions WHERE dept_id IN ({placeholders}))", dept_ids)
+        conn.execute(f"DELETE FROM suggestions WHERE dept_id IN ({placeholders})", dept_ids)
+        create_staging_tables(conn)
+        n_suggestions = insert_suggestions(conn, suggestion_df)
+        # Suggestions that moved from another department
+        for table in ["suggestion_keys", "suggestions"]:
+            conn.execute(f"DELETE FROM {table} WHERE suggestion_id IN (SELECT suggestion_id FROM new_suggestions)")
+        store_suggestions(conn)
+        rank_top_suggestions(conn)
+        conn.commit()
+    finally:
+        conn.close()
+    return n_suggestions
+
+def create_suggestion_tables(conn):
+    '''
+    Creates the tables of the suggestion file: the suggestions; their keys
+    clustered by key (a table without rowid is stored in the order of its
+    primary key), along with the weight of their suggestion so that ranking
+    the suggestions of a prefix only reads that range; and the ranked
+    suggestions of the short prefixes (see rank_top_suggestions).
+    '''
+    conn.executescript(
+        """
+        CREATE TABLE suggestions (
+            suggestion_id TEXT PRIMARY KEY,
+            kind TEXT NOT NULL,
+            entity_id INTEGER NOT NULL,
+            name_en TEXT,
+            name_fr TEXT,
+            context_en TEXT,
+            context_fr TEXT,
+            dept_id INTEGER NOT NULL,
+            weight INTEGER NOT NULL
+        );
+        CREATE TABLE suggestion_keys (
+            key TEXT NOT NULL,
+            suggestion_id TEXT NOT NULL,
+            kind TEXT NOT NULL,
+            weight INTEGER NOT NULL,
+            PRIMARY KEY (key, suggestion_id)
+        ) WITHOUT ROWID;
+        CREATE TABLE top_suggestions (
+            prefix TEXT NOT NULL,
+            kind TEXT NOT NULL,
+            rank INTEGER NOT NULL,
+            suggestion_id TEXT NOT NULL,
+            weight INTEGER NOT NULL,
+            key_length INTEGER NOT NULL,
+            PRIMARY KEY (prefix, kind, rank)
+        ) WITHOUT ROWID;
+        """)
+
+def create_staging_tables(conn):
+    '''
+    Creates the temporary tables suggestions are inserted into, in the order
+    they come in, before store_suggestions moves them to the tables of the
+    file in the order of their primary keys, which is much quicker than
+    inserting them in random order.
+    '''
+    conn.execute("CREATE TEMP TABLE new_suggestions AS SELECT * FROM suggestions WHERE 0")
+    conn.execute("CREATE TEMP TABLE new_suggestion_keys AS SELECT * FROM suggestion_keys WHERE 0")
+
+def store_suggestions(conn):
+    ''' Moves the suggestions of the staging tables to the tables of the file. '''
+    conn.execute("INSERT INTO suggestions SELECT * FROM new_suggestions ORDER BY suggestion_id")
+    conn.execute("INSERT INTO suggestion_keys SELECT * FROM new_suggestion_keys ORDER BY key, suggestion_id")
+    conn.execute("DELETE FROM new_suggestions")
+    conn.execute("DELETE FROM new_suggestion_keys")
+
+def rank_top_suggestions(conn):
+    '''
+    Ranks the TOP_SUGGESTIONS best suggestions of every prefix of up to
+    TOP_PREFIX_LENGTH characters, in the order SuggestionIndex.suggest ranks
+    them: heaviest first, then by their shortest key starting with the prefix.
+    The keys are read RANK_CHUNK_SIZE at a time, keeping the best suggestions
+    of the keys read so far.
+    '''
+    top = None
+    for keys in pd.read_sql_query("SELECT key, suggestion_id, kind, weight FROM suggestion_keys", conn,
+                                  chunksize=RANK_CHUNK_SIZE):
+        top = keep_top_suggestions(pd.concat([top, get_prefix_candidates(keys)]))
+    if top is None:
+        return
+    # The best suggestions of both kinds are among the best of each kind
+    top = pd.concat([top, keep_top_suggestions(top.assign(kind=""))], ignore_index=True)
+    top["rank"] = top.groupby(["prefix", "kind"], sort=False).cumcount() + 1
+    conn.execute("DELETE FROM top_suggestions")
+    conn.executemany("INSERT INTO top_suggestions VALUES (?, ?, ?, ?, ?, ?)", zip(*(
+        top[column].tolist() for column in ["prefix", "kind", "rank", "suggestion_id", "weight", "key_length"])))
+
+def get_prefix_candidates(keys):
+    '''
+    Returns the prefixes of up to TOP_PREFIX_LENGTH characters of keys (a
+    dataframe of rows of the suggestion_keys table), with the suggestion of
+    each key, its weight and the length of the key.
+    '''
+    key_lengths = keys["key"].str.len()
+    return pd.concat([
+        keys[key_lengths >= length].assign(prefix=keys["key"].str[:length], key_length=key_lengths)
+        for length in range(1, TOP_PREFIX_LENGTH + 1)]).drop(columns="key")
+
+def keep_top_suggestions(candidates):
+    '''
+    Returns the TOP_SUGGESTIONS best candidates of each prefix and kind (see
+    get_prefix_candidates), best first, each suggestion ranked by its shortest
+    key. The strings are sorted through their codes.
+    '''
+    groups = pd.factorize(candidates["kind"] + " " + candidates["prefix"])[0]
+    suggestions = pd.factorize(candidates["suggestion_id"], sort=True)[0]
+    order = np.lexsort((suggestions, candidates["key_length"].to_numpy(), -candidates["weight"].to_numpy(),
+                        groups))
+    groups, suggestions = groups[order], suggestions[order]
+    first = ~pd.DataFrame({"group": groups, "suggestion": suggestions}).duplicated().to_numpy()
+    candidates, groups = candidates.iloc[order[first]], groups[first]
+    ranks = pd.Series(groups).groupby(groups).cumcount().to_numpy()
+    return candidates[ranks < TOP_SUGGESTIONS]
+
+def insert_suggestions(conn, suggestion_df):
+    '''
+    Inserts suggestions and their keys into the staging tables (see
+    create_staging_tables); returns the number of suggestions.
+    '''
+    values = suggestion_df[SUGGESTION_COLUMNS].astype(object)
+    values = values.where(values.notna(), None)
+    conn.executemany(f"INSERT INTO new_suggestions VALUES ({', '.join('?' * len(SUGGESTION_COLUMNS))})",
+                     zip(*(values[column].tolist() for column in SUGGESTION_COLUMNS)))
+    keys = suggestion_df[["keys", "suggestion_id", "kind", "weight"]].explode("keys").dropna(subset=["keys"])
+    conn.executemany("INSERT INTO new_suggestion_keys VALUES (?, ?, ?, ?)", zip(*(
+        keys[column].tolist() for column in ["keys", "suggestion_id", "kind", "weight"])))
+    return len(suggestion_df)
+
+class SuggestionIndex:
+    '''
+    Read-only access to a suggestion file, for serving suggestions without
+    elasticsearch. Used as a context manager.
+    Args:
+        path: the path of the sqlite file written by write_suggestion_index.
+    '''
+    def __init__(self, path):
+        self.conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True, check_same_thread=False)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        self.conn.close()
+
+    def suggest(self, prefix, limit=10, kind=None):
+        '''
+        Returns the suggestions whose names have a word starting with prefix,
+        accents and case ignored, heaviest first.
+        Args:
+            prefix: the text typed by the user.
+            limit: the maximum number of suggestions returned.
+            kind: "employee" or "organization" to only suggest one kind of
+                entity; both if None.
+        Returns:
+            A list of dicts with the SUGGESTION_COLUMNS.
+        '''
+        key = get_prefix_key(prefix)
+        if not key:
+            return []
+        if len(key) <= TOP_PREFIX_LENGTH and limit <= TOP_SUGGESTIONS:
+            rows = self.conn.execute(
+                f"""
+                SELECT {', '.join('s.' + column for column in SUGGESTION_COLUMNS)}
+                FROM top_suggestions t JOIN suggestions s ON s.suggestion_id = t.suggestion_id
+                WHERE t.prefix = ? AND t.kind = ? ORDER BY t.rank LIMIT ?
+                """, (key, kind or "", limit)).fetchall()
+            return [dict(zip(SUGGESTION_COLUMNS, row)) for row in rows]
+        kind_filter = "" if kind is None else "AND kind = ?"
+        # A suggestion is found by its closest key first: "smi" ranks "smith"
+        # before "smithers" among suggestions of the same weight
+        rows = self.conn.execute(
+            f"""
+            SELECT {', '.join('s.' + column for column in SUGGESTION_COLUMNS)}
+            FROM (SELECT suggestion_id, weight, MIN(LENGTH(key)) AS key_length FROM suggestion_keys
+                  WHERE key >= ? AND key < ? {kind_filter}
+                  GROUP BY suggestion_id, weight
+                  ORDER BY weight DESC, key_length, suggestion_id LIMIT ?) k
+            JOIN suggestions s ON s.suggestion_id = k.suggestion_id
+            ORDER BY k.weight DESC, k.key_length, k.suggestion_id
+            """, [key, key + MAX_CHARACTER] + ([] if kind is None else [kind]) + [limit]).fetchall()
+        return [dict(zip(SUGGESTION_COLUMNS, row)) for row in rows]
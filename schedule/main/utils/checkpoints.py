@@ -0,0 +1,195 @@
+'''
+On-disk checkpoints of the stages of the scheduled job, so a failed run can be
+resumed instead of started over. Every stage has a fingerprint: a hash of its
+name, of its settings and of the fingerprints of the stages it takes its
+inputs from. Once a stage succeeds its fingerprint is recorded in a manifest,
+along with its outputs (frames, org charts) for the stages that compute
+rather than write. On the next run:
+
+- a stage that computes is restored from its checkpoint if its fingerprint is
+  unchanged, and run otherwise;
+- a stage that writes to the database, elasticsearch or the snapshot is
+  skipped if its fingerprint is unchanged, since what it wrote is still there.
+
+The checkpoints belong to one version of the GEDS data: when the fingerprint
+of a source stage (prepare_data) changes, every checkpoint is discarded.
+
+A run can also be pointed at a stage: from_stage runs it and every stage after
+it, only_stage runs it alone. The stages before it are restored or computed,
+but never write.
+'''
+import glob
+import hashlib
+import json
+import os
+import time
+
+import pandas as pd
+
+from schedule.main.utils.instrumentation import write_atomically
+
+# Version of the checkpoints; bumping it invalidates the checkpoints written by
+# earlier versions of the code.
+CHECKPOINT_VERSION = 2
+MANIFEST_NAME = "manifest.json"
+# Bytes of a file read at a time when hashing it
+HASH_BLOCK_SIZE = 2 ** 20
+
+class StopPipeline(Exception):
+    ''' Raised when the stage a run was limited to (only_stage) has run. '''
+
+class Checkpoints:
+    '''
+    Runs the stages of a pipeline, restoring or skipping the ones whose inputs
+    did not change since they last succeeded.
+    Args:
+        directory: the directory the checkpoints are kept in; if None, nothing
+            is saved and every stage is run.
+        from_stage: the name of the stage to resume from; it and the stages
+            after it are run whether they changed or not.
+        only_stage: the name of the only stage to run.
+    '''
+    def __init__(self, directory=None, from_stage=None, only_stage=None):
+        self.directory = directory
+        self.from_stage = from_stage
+        self.only_stage = only_stage
+        self.target = from_stage or only_stage
+        self.target_reached = False
+        self.fingerprints = {}
+        self.manifest = {"version": CHECKPOINT_VERSION, "stages": {}}
+        if directory is not None and os.path.isfile(self.get_path(MANIFEST_NAME)):
+            with open(self.get_path(MANIFEST_NAME)) as f:
+                manifest = json.load(f)
+            if manifest.get("version") == CHECKPOINT_VERSION:
+                self.manifest = manifest
+
+    def run(self, report, name, func, inputs=(), settings=None, rows_in=None, writes=False,
+            save=True, source=None):
+        '''
+        Runs a stage, restores it from its checkpoint or skips it.
+        Args:
+            report: the RunReport of the run.
+            name: the name of the stage.
+            func: the function doing the work of the stage; it is passed the
+                StageMetrics of the stage and returns its outputs.
+            inputs: the names of the stages whose outputs the stage uses.
+            settings: a dict of the settings the stage depends on.
+            rows_in: the number of rows the stage reads, for the report.
+            writes: whether the stage writes outside of the pipeline (to the
+                database, elasticsearch or the snapshot); such stages return
+                nothing.
+            save: whether the stage is checkpointed; stages that are not are
+                run every time they are reached.
+            source: for stages that read the data of the pipeline, a function
+                returning a fingerprint of that data, called once the stage
+                ran. Source stages are run every time.
+        Returns:
+            The outputs of the stage, or None for stages that write.
+        '''
+        if self.only_stage is not None and self.target_reached:
+            raise StopPipeline()
+        if name == self.target:
+            self.target_reached = True
+        # Stages before the target stage never write; the target stage, and
+        # the stages after it when resuming from it, always run
+        before_target = self.target is not None and not self.target_reached
+        forced = self.target is not None and self.target_reached
+        fingerprint = self.get_fingerprint(name, inputs, settings)
+        record = self.manifest["stages"].get(name)
+        unchanged = save and source is None and record is not None and record["fingerprint"] == fingerprint
+        if writes and (before_target or (unchanged and not forced)):
+            with report.stage(name) as stage:
+                stage.details["checkpoint"] = "skipped"
+                print(f"Skipping {name}: " + ("it comes before " + self.target if before_target
+                                              else "its inputs did not change since it last ran"))
+            self.fingerprints[name] = fingerprint
+            return None
+        if not writes and unchanged and not forced and self.has_outputs(name):
+            with report.stage(name) as stage:
+                outputs = pd.read_pickle(self.get_path(f"{name}.pkl"))
+                stage.details["checkpoint"] = "restored"
+                print(f"Restored {name} from its checkpoint")
+            self.fingerprints[name] = fingerprint
+            return outputs
+        self.discard(name)
+        with report.stage(name, rows_in=rows_in) as stage:
+            outputs = func(stage)
+        if source is not None:
+            fingerprint = self.get_fingerprint(name, inputs, dict(settings or {}, source=source()))
+            if record is not None and record["fingerprint"] != fingerprint:
+                # The data changed: nothing checkpointed from it still holds
+                self.clear()
+        self.fingerprints[name] = fingerprint
+        self.record(name, fingerprint, outputs if save and not writes else None)
+        return outputs
+
+    def get_fingerprint(self, name, inputs, settings):
+        ''' Returns the fingerprint of a stage with the given inputs and settings. '''
+        content = {
+            "stage": name,
+            "version": CHECKPOINT_VERSION,
+            "inputs": dict((input_name, self.fingerprints[input_name]) for input_name in inputs),
+            "settings": settings or {},
+        }
+        return hashlib.sha256(json.dumps(content, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+    def record(self, name, fingerprint, outputs):
+        ''' Records a stage as succeeded, saving its outputs if any. '''
+        if self.directory is None:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        if outputs is not None:
+            path = self.get_path(f"{name}.pkl")
+            pd.to_pickle(outputs, path + ".part")
+            os.replace(path + ".part", path)
+        self.manifest["stages"][name] = {
+            "fingerprint": fingerprint,
+            "completed_at": time.time(),
+            "has_outputs": outputs is not None,
+        }
+        self.write_manifest()
+
+    def discard(self, name):
+        ''' Forgets a stage, before it is run again, so a failure leaves no stale checkpoint. '''
+        if self.manifest["stages"].pop(name, None) is not None:
+            self.write_manifest()
+
+    def clear(self):
+        ''' Discards every checkpoint. '''
+        self.manifest["stages"] = {}
+        if self.directory is None:
+            return
+        for path in glob.glob(self.get_path("*.pkl")):
+            os.remove(path)
+        self.write_manifest()
+
+    def has_outputs(self, name):
+        record = self.manifest["stages"].get(name)
+        return (self.directory is not None and record is not None and record["has_outputs"]
+                and os.path.isfile(self.get_path(f"{name}.pkl")))
+
+    def check_target_reached(self):
+        ''' Raises a ValueError if the run never reached its target stage. '''
+        if self.target is not None and not self.target_reached:
+            raise ValueError(f"{self.target} is not a stage of this run")
+
+    def write_manifest(self):
+        if self.directory is not None:
+            write_atomically(self.get_path(MANIFEST_NAME), json.dumps(self.manifest, indent=2))
+
+    def get_path(self, filename):
+        return os.path.join(self.directory, filename)
+
+def hash_file(path):
+    ''' Returns a sha256 hex digest of the content of a file, or None if there is no such file. '''
+    if not os.path.isfile(path):
+        return None
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def get_settings(config_class):
+    ''' Returns the settings of a configuration class (e.g. SQLAlchemyConfig) as a dict. '''
+    return dict((name, value) for name, value in vars(config_class).items() if name.isupper())
@@ -1,3 +1,20 @@
+from sqlalchemy import bindparam, create_engine, inspect, text
+
+from schedule.config import SQLAlchemyConfig
+
+# Engine shared by every stage of the job, created on first use
+_engine = None
+
+def get_engine():
+    '''
+    Returns the SQLAlchemy engine of the configured database. The engine (and
+    its connection pool) is created once and reused by every caller.
+    '''
+    global _engine
+    if _engine is None:
+        _engine = create_engine(assemble_sqlalchemy_url(SQLAlchemyConfig))
+    return _engine
+
 def assemble_sqlalchemy_url(db_config):
     '''
     Assembles the URL expected by SQLAlchemy according to their documentation:
@@ -21,4 +38,72 @@ def assemble_sqlalchemy_url(db_config):
         return f"sqlite:///{name}.db"
     else:
         # This url assumes the default DB API used by sqlalchemy.
-        return f"{dialect}://{user}:{password}@{host}:{port}/{name}"
\ No newline at end of file
+        return f"{dialect}://{user}:{password}@{host}:{port}/{name}"
+
+def upsert_rows(engine, table_name, key, df, dtype, deleted_keys=()):
+    '''
+    Replaces the rows of a table whose key appears in df with the rows of df,
+    and removes the rows whose key is in deleted_keys, in a single transaction.
+
+    Args:
+        engine:
+            A SQLAlchemy engine.
+        table_name:
+            A string containing the name of the table to update.
+        key:
+            A string containing the name of the column identifying each row.
+        df:
+            A pandas dataframe containing the new or updated rows.
+        dtype:
+            A dict of column name to SQLAlchemy type, as passed to to_sql.
+        deleted_keys:
+            An iterable of keys whose rows should be removed.
+    '''
+    stale_keys = [int(k) for k in df[key].unique()] + [int(k) for k in deleted_keys]
+    delete = text(f"DELETE FROM {table_name} WHERE {key} IN :keys").bindparams(
+        bindparam("keys", expanding=True))
+    with engine.begin() as conn:
+        # Delete in batches to stay under the dialect's bound parameter limit
+        for i in range(0, len(stale_keys), 500):
+            conn.execute(delete, keys=stale_keys[i:i + 500])
+        df.to_sql(table_name, conn, if_exists="append", index=False, chunksize=1000, dtype=dtype)
+
+def select_keys(engine, table_name, key, column, values):
+    '''
+    Returns the keys of the rows of a table whose column is one of values, or
+    an empty list if the table does not exist yet.
+
+    Args:
+        engine:
+            A SQLAlchemy engine.
+        table_name:
+            A string containing the name of the table to query.
+        key:
+            A string containing the name of the column identifying each row.
+        column:
+            A string containing the name of the column to filter on.
+        values:
+            An iterable of the values of column to select.
+    '''
+    if not table_exists(engine, table_name):
+        return []
+    values = [int(v) for v in values]
+    select = text(f"SELECT {key} FROM {table_name} WHERE {column} IN :values").bindparams(
+        bindparam("values", expanding=True))
+    keys = []
+    with engine.connect() as conn:
+        for i in range(0, len(values), 500):
+            keys.extend(row[0] for row in conn.execute(select, values=values[i:i + 500]))
+    return keys
+
+def table_exists(engine, table_name):
+    ''' Returns whether the database has a table of the given name. '''
+    with engine.connect() as conn:
+        return engine.dialect.has_table(conn, table_name)
+
+def has_columns(engine, table_name, columns):
+    ''' Returns whether the database has a table of the given name with all of the given columns. '''
+    if not table_exists(engine, table_name):
+        return False
+    table_columns = set(column["name"] for column in inspect(engine).get_columns(table_name))
+    return set(columns) <= table_columns
@@ -0,0 +1,56 @@
+'''
+Compact dtypes for the prepared GEDS dataframe. Most text columns repeat a
+small set of values (departments, organizations, org structures, cities...)
+and are stored as categoricals; the table keys are stored as 32 bit integers.
+The text columns that are close to unique (names, emails, phone numbers) are
+stored as Arrow strings when pyarrow and a pandas with the pyarrow string
+dtype (1.3 or later) are installed, and kept as python strings otherwise.
+The dtypes survive the drop_duplicates and merges of the later stages, so the
+organization, department and elasticsearch dataframes stay compact as well.
+'''
+import numpy as np
+import pandas as pd
+
+# Text columns with few distinct values compared to the number of employees
+CATEGORY_COLUMNS = [
+    "job_title_en", "job_title_fr", "address_en", "address_fr", "province_en", "province_fr",
+    "city_en", "city_fr", "postal_code", "department_acronym", "department_en", "department_fr",
+    "org_acronym", "org_name_en", "org_name_fr", "org_structure_en", "org_structure_fr",
+    "compound_name_en", "compound_name_fr",
+]
+# Text columns with about one distinct value per employee
+STRING_COLUMNS = ["last_name", "first_name", "full_name", "email", "phone_number"]
+# Integer keys of the employees, organizations and departments
+ID_COLUMNS = ["employee_id", "org_id", "dept_id"]
+ID_DTYPE = np.int32
+
+try:
+    STRING_DTYPE = pd.StringDtype("pyarrow")
+except (ImportError, TypeError):
+    # pyarrow is not installed, or pandas predates the pyarrow string dtype
+    STRING_DTYPE = None
+
+def apply_dtype_plan(df):
+    '''
+    Returns the dataframe with the compact dtypes applied, and prints its
+    memory usage before and after.
+    Args:
+        df: a pandas dataframe, as returned by create_table_keys.
+    '''
+    before = get_memory_usage(df)
+    dtypes = {column: "category" for column in CATEGORY_COLUMNS if column in df.columns}
+    dtypes.update({column: ID_DTYPE for column in ID_COLUMNS if column in df.columns})
+    if STRING_DTYPE is not None:
+        # read_csv parses columns without any text (phone numbers, at times)
+        # as numbers; those are left as they are
+        dtypes.update({column: STRING_DTYPE for column in STRING_COLUMNS
+                       if column in df.columns and df[column].dtype == object})
+    df = df.astype(dtypes)
+    after = get_memory_usage(df)
+    print(f"Geds data uses {after / 2 ** 20:.1f}MiB of memory "
+          f"({before / 2 ** 20:.1f}MiB before applying the dtype plan)")
+    return df
+
+def get_memory_usage(df):
+    ''' Returns the number of bytes used by a dataframe, including python strings. '''
+    return int(df.memory_usage(deep=True).sum())
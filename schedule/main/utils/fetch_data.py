@@ -1,11 +1,29 @@
 import csv
-from io import BytesIO
+import io
+import json
+import os
+import shutil
+import tempfile
+import time
 
 import pandas as pd
-from urllib.request import urlopen
+from urllib.error import HTTPError
+from urllib.request import Request, urlopen
 from zipfile import ZipFile
 
-def fetch_geds(url, subset=None):
+from schedule.main.utils.checkpoints import hash_file
+from schedule.main.utils.instrumentation import write_atomically
+
+# Number of fields in a correctly parsed row of the geds csv
+GEDS_NUM_COLUMNS = 44
+# Size (in bytes) of the blocks used to spool the download to disk
+DOWNLOAD_BLOCK_SIZE = 1024 * 1024
+# Suffix of the file holding the metadata of a download, next to it
+METADATA_SUFFIX = ".json"
+# Suffix of an incomplete download
+PARTIAL_SUFFIX = ".part"
+
+def fetch_geds(url, subset=None, chunksize=100000):
     '''
     Fetches the geds dataset from Canada's Open Data Portal
 
@@ -15,35 +33,239 @@ def fetch_geds(url, subset=None):
             that downloads a zipped csv containing the geds dataset.
         subset:
             A string containing the acronym found in the "Department Acronym"
-            field in the geds dataframe (e.g. "ESDC-EDSC") - used to build the
-            org chart tool for only a subset of geds.
-    
+            field in the geds dataframe (e.g. "ESDC-EDSC"), or a collection of
+            such acronyms - used to build the org chart tool for only a subset
+            of geds.
+        chunksize:
+            An int specifying the number of rows parsed at a time.
+
     Returns:
         df:
             A pandas dataframe containing the original contents of the zipped
             csv file.
     '''
-    # Fetch the response from the geds url
-    resp = urlopen(url)
-    # Extract the file from the bytes object returned by urlopen
-    zipped_file = ZipFile(BytesIO(resp.read()))
-    # Extract the csv contents line-by-line
-    lines = []
-    # Note that zipped_file.namelist() returns ['gedsOpenData.csv'], so
-    # zipped_file.namelist()[0] returns the file name
-    for idx, line in enumerate(zipped_file.open(zipped_file.namelist()[0]).readlines()):
-        # Need to use the csv module to read the string returned by line.decode()
-        # Reason is csv module contains the logic to parse commas that are
-        # contained within double quotes.
-        decoded = [str(line.decode('ISO-8859-1'))]
-        line = [item for item in csv.reader(decoded)][0]
+    chunks = list(fetch_geds_chunks(url, subset=subset, chunksize=chunksize))
+    return pd.concat(chunks, ignore_index=True)
+
+def fetch_geds_chunks(url, subset=None, chunksize=100000):
+    '''
+    Streams the geds dataset from Canada's Open Data Portal. The download is
+    spooled to a temporary file and the zipped csv is parsed incrementally, so
+    memory use is bounded by the chunk size rather than the size of the dataset.
+
+    Args:
+        url:
+            A string containing the url that downloads a zipped csv containing
+            the geds dataset.
+        subset:
+            A string containing the acronym found in the "Department Acronym"
+            field (e.g. "ESDC-EDSC"), or a collection of acronyms; only rows of
+            those departments are kept.
+        chunksize:
+            An int specifying the maximum number of rows in each chunk.
+
+    Returns:
+        A generator of pandas dataframes with the geds column names; every
+        field is a string.
+    '''
+    with tempfile.TemporaryFile() as spool:
+        download_to_file(url, spool)
+        spool.seek(0)
+        yield from read_geds_zip(spool, subset=subset, chunksize=chunksize)
+
+def read_geds_zip(zip_file, subset=None, chunksize=100000):
+    '''
+    Parses the zipped geds csv incrementally, like fetch_geds_chunks.
+    Args:
+        zip_file: the path of the zip, or an open binary file.
+    '''
+    with ZipFile(zip_file) as zipped_file:
+        # Note that zipped_file.namelist() returns ['gedsOpenData.csv'], so
+        # zipped_file.namelist()[0] returns the file name
+        with zipped_file.open(zipped_file.namelist()[0]) as member:
+            text = io.TextIOWrapper(member, encoding='ISO-8859-1', newline='')
+            yield from parse_geds_csv(text, subset=subset, chunksize=chunksize)
+
+def download_to_file(url, file_obj):
+    '''
+    Copies the response body of a url into an open binary file, one block at
+    a time.
+    '''
+    with urlopen(url) as resp:
+        shutil.copyfileobj(resp, file_obj, DOWNLOAD_BLOCK_SIZE)
+
+def download_if_changed(url, path, max_age=0, timeout=None):
+    '''
+    Keeps a local copy of a url up to date. The ETag, Last-Modified and size
+    of the copy are stored next to it (see METADATA_SUFFIX), so it is only
+    downloaded again when the server reports a change. An interrupted
+    download is kept and resumed with a range request, provided the server
+    still serves the same version of the file.
+    Args:
+        url: the url to download.
+        path: the path of the local copy.
+        max_age: the number of seconds a copy is used for without asking the
+            server whether it changed.
+        timeout: the timeout of the request in seconds.
+    Returns:
+        A dict with the "status" of the copy ("fresh", "not_modified",
+        "downloaded" or "resumed"), whether its content "changed" and the
+        number of "bytes" received.
+    '''
+    metadata = load_download_metadata(path)
+    if metadata is not None and metadata.get("url") == url and time.time() - metadata["checked_at"] < max_age:
+        return {"status": "fresh", "changed": False, "bytes": 0}
+    partial_path = path + PARTIAL_SUFFIX
+    partial = load_download_metadata(partial_path)
+    offset = os.path.getsize(partial_path) if partial is not None and partial.get("url") == url else 0
+    headers = {}
+    if offset and (partial.get("etag") or partial.get("last_modified")):
+        # Resume, unless the file changed since the partial copy was started
+        headers["Range"] = f"bytes={offset}-"
+        headers["If-Range"] = partial.get("etag") or partial["last_modified"]
+    elif metadata is not None and metadata.get("url") == url:
+        offset = 0
+        if metadata.get("etag"):
+            headers["If-None-Match"] = metadata["etag"]
+        if metadata.get("last_modified"):
+            headers["If-Modified-Since"] = metadata["last_modified"]
+    else:
+        offset = 0
+    try:
+        resp = urlopen(Request(url, headers=headers), timeout=timeout)
+    except HTTPError as e:
+        if e.code == 304:
+            metadata["checked_at"] = time.time()
+            save_download_metadata(path, metadata)
+            return {"status": "not_modified", "changed": False, "bytes": 0}
+        if e.code == 416 and offset:
+            # The partial copy does not fit the file any more; start over
+            remove_download(partial_path)
+            return download_if_changed(url, path, max_age=max_age, timeout=timeout)
+        raise
+    resumed = resp.status == 206
+    if resumed and ("Range" not in headers or get_range_start(resp.headers.get("Content-Range")) != offset):
+        # Only part of the file was sent, and not the part that follows the
+        # partial copy: discard the copy and ask for the whole file
+        resp.close()
+        remove_download(partial_path)
+        if "Range" not in headers:
+            raise IOError(f"Received part of {url} without asking for a range")
+        return download_if_changed(url, path, max_age=max_age, timeout=timeout)
+    if not resumed:
+        offset = 0
+    with resp:
+        length = resp.headers.get("Content-Length")
+        download = {
+            "url": url,
+            "etag": resp.headers.get("ETag"),
+            "last_modified": resp.headers.get("Last-Modified"),
+            "size": offset + int(length) if length is not None else None,
+        }
+        # Recorded first, so an interruption can be resumed
+        save_download_metadata(partial_path, download)
+        with open(partial_path, "ab" if resumed else "wb") as f:
+            shutil.copyfileobj(resp, f, DOWNLOAD_BLOCK_SIZE)
+    received = os.path.getsize(partial_path)
+    if download["size"] is not None and received != download["size"]:
+        raise IOError(f"Downloaded {received} of the {download['size']} bytes of {url}")
+    download["sha256"] = hash_file(partial_path)
+    download["size"] = received
+    # The server may not support conditional requests, so compare contents
+    changed = metadata is None or metadata.get("sha256") != download["sha256"]
+    os.replace(partial_path, path)
+    remove_download(partial_path)
+    now = time.time()
+    save_download_metadata(path, dict(download, checked_at=now, downloaded_at=now,
+                                      processed=not changed and metadata.get("processed", False)))
+    return {"status": "resumed" if resumed else "downloaded", "changed": changed,
+            "bytes": received - offset}
+
+def get_range_start(content_range):
+    ''' Returns the first byte of a Content-Range header (e.g. "bytes 100-199/200"), or None. '''
+    if not content_range or not content_range.startswith("bytes "):
+        return None
+    return int(content_range[len("bytes "):].split("-")[0])
+
+def load_download_metadata(path):
+    ''' Returns the metadata stored next to a downloaded file, or None if there is no such file. '''
+    if not os.path.isfile(path) or not os.path.isfile(path + METADATA_SUFFIX):
+        return None
+    with open(path + METADATA_SUFFIX) as f:
+        return json.load(f)
+
+def save_download_metadata(path, metadata):
+    write_atomically(path + METADATA_SUFFIX, json.dumps(metadata, indent=2))
+
+def remove_download(path):
+    ''' Deletes a downloaded file and its metadata, if they exist. '''
+    for file_path in [path, path + METADATA_SUFFIX]:
+        if os.path.exists(file_path):
+            os.remove(file_path)
+
+def mark_processed(path):
+    '''
+    Records that the current copy of a download went through the pipeline, so
+    later runs can stop early while it does not change.
+    '''
+    metadata = load_download_metadata(path)
+    if metadata is not None:
+        metadata["processed"] = True
+        save_download_metadata(path, metadata)
+
+def is_processed(path):
+    ''' Returns whether the current copy of a download went through the pipeline. '''
+    metadata = load_download_metadata(path)
+    return metadata is not None and metadata.get("processed", False)
+
+def parse_geds_csv(text, subset=None, chunksize=100000):
+    '''
+    Parses the geds csv from a text stream with a single csv reader, yielding
+    dataframes of at most chunksize rows.
+
+    Args:
+        text:
+            A text file-like object containing the geds csv.
+        subset:
+            A "Department Acronym", or a collection of them, to filter on (if any).
+        chunksize:
+            An int specifying the maximum number of rows in each chunk.
+    '''
+    # The csv module contains the logic to parse commas that are contained
+    # within double quotes.
+    reader = csv.reader(text)
+    columns = next(reader)
+    subset = get_department_subset(subset)
+    subset_idx = columns.index("Department Acronym") if subset is not None else None
+    rows = []
+    num_chunks = 0
+    for line in reader:
         # There are a few observations (~90) that are not parsed correctly - this
         # needs to be investigated further.
-        if len(line) == 44:
-            lines.append(line)
-    # Convert to pandas dataframe
-    df = pd.DataFrame(lines[1:], columns=lines[0])
-    # Select a subset of the dataframe (if any)
-    if subset is not None:
-        df = df[df["Department Acronym"] == subset]
-    return df
\ No newline at end of file
+        if len(line) != GEDS_NUM_COLUMNS:
+            continue
+        # Select a subset of the dataset (if any)
+        if subset_idx is not None and line[subset_idx] not in subset:
+            continue
+        rows.append(line)
+        if len(rows) >= chunksize:
+            yield pd.DataFrame(rows, columns=columns)
+            rows = []
+            num_chunks += 1
+    # Yield the remaining rows; an empty chunk is yielded if nothing matched so
+    # that callers still receive the column names.
+    if rows or num_chunks == 0:
+        yield pd.DataFrame(rows, columns=columns)
+
+def get_department_subset(subset):
+    '''
+    Returns the set of department acronyms to keep, or None to keep every
+    department.
+    Args:
+        subset: None, a single acronym or a collection of acronyms.
+    '''
+    if subset is None:
+        return None
+    if isinstance(subset, str):
+        return {subset}
+    return set(subset)
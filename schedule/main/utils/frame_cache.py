@@ -0,0 +1,106 @@
+'''
+Columnar cache of the prepared GEDS dataframe. The frame is stored once it has
+been preprocessed and keyed, under a key made of a hash of the source csv and
+of the [data] configuration, so later runs can skip parsing and preprocessing
+the csv until either of them changes.
+
+The cache is an uncompressed Feather (Arrow IPC) file that is memory-mapped
+on load. With the Arrow string dtype (see dtype_plan.STRING_DTYPE), the string
+columns keep pointing into the mapped file, and so do the numeric columns
+without missing values, so they are paged in from the file as they are used
+rather than copied onto the heap. Categorical columns, and every column when
+the Arrow string dtype is not available, are still copied. pyarrow is
+optional: without it the frame is pickled instead.
+
+The columns that point into the file are read-only: the frame can be
+reassigned column by column, but not updated in place. The mapping outlives
+the file being replaced or deleted on POSIX systems, where os.replace and
+os.remove only unlink the file.
+'''
+import glob
+import hashlib
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.feather as feather
+except ImportError:
+    feather = None
+
+from schedule.main.utils.dtype_plan import STRING_DTYPE
+
+# Bytes of the source file read at a time when hashing it
+HASH_BLOCK_SIZE = 2 ** 20
+# Version of the preprocessing; bumping it invalidates the frames cached by
+# earlier versions of the code.
+PREPARED_FRAME_VERSION = 3
+
+def load_cached_frame(cache_dir, key):
+    '''
+    Returns the frame cached under the given key, or None if there is none.
+    '''
+    path = get_cache_path(cache_dir, key)
+    if not os.path.isfile(path):
+        return None
+    if path.endswith(".feather"):
+        table = feather.read_table(path, memory_map=True)
+        if STRING_DTYPE is not None:
+            # Wrap the buffers of the mapped file rather than copying them;
+            # self_destruct releases each column of the table once converted
+            return table.to_pandas(split_blocks=True, self_destruct=True,
+                                   types_mapper={pa.string(): STRING_DTYPE}.get)
+        df = table.to_pandas()
+        # Arrow turns missing strings into None; restore the NaN read_csv uses
+        # so the cached frame is identical to a freshly prepared one.
+        for name in table.column_names:
+            if table.column(name).null_count and df[name].dtype == object:
+                values = df[name].to_numpy(copy=True)
+                values[pd.isna(values)] = np.nan
+                df[name] = values
+        return df
+    return pd.read_pickle(path)
+
+def save_cached_frame(df, cache_dir, key):
+    '''
+    Caches a frame under the given key and deletes the frames cached under
+    any other key.
+    '''
+    os.makedirs(cache_dir, exist_ok=True)
+    path = get_cache_path(cache_dir, key)
+    partial_path = path + ".part"
+    if feather is not None:
+        # Feather only stores a default index; the employee ids are kept as a
+        # column already.
+        feather.write_feather(df.reset_index(drop=True), partial_path, compression="uncompressed")
+    else:
+        df.to_pickle(partial_path)
+    os.replace(partial_path, path)
+    for stale_path in glob.glob(os.path.join(cache_dir, "geds_*")):
+        if stale_path != path:
+            os.remove(stale_path)
+
+def get_cache_path(cache_dir, key):
+    ''' Returns the path of the frame cached under the given key. '''
+    extension = "feather" if feather is not None else "pkl"
+    return os.path.join(cache_dir, f"geds_{key}.{extension}")
+
+def get_cache_key(source_path, data_config):
+    '''
+    Returns a key identifying the prepared frame built from a source csv with a
+    given configuration.
+    Args:
+        source_path: the path of the source csv.
+        data_config: the DataConfig class; every setting in it is part of the key.
+    '''
+    digest = hashlib.sha256()
+    with open(source_path, "rb") as f:
+        for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b""):
+            digest.update(block)
+    settings = {name: value for name, value in vars(data_config).items() if name.isupper()}
+    settings["prepared_frame_version"] = PREPARED_FRAME_VERSION
+    digest.update(json.dumps(settings, sort_keys=True).encode("utf-8"))
+    return digest.hexdigest()[:32]
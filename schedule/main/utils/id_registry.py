@@ -0,0 +1,148 @@
+'''
+Persistent registry of the ids of employees, organizations and departments.
+Each entity is identified by a natural key (an email, a compound organization
+name, a department name) that is given an id the first time it is seen; the
+id is kept for as long as the registry file is, so an entity keeps its id
+when rows are added or removed elsewhere in the GEDS data, and ids are never
+reused. Run after run, only what actually changed gets new rows in the tables
+and new documents in elasticsearch.
+
+The registry is a sqlite file next to the data. New ids are handed out in the
+order the keys are given in, starting from 0, so on the first run they are
+the positional ids create_table_keys gives.
+'''
+import os
+import sqlite3
+
+import numpy as np
+import pandas as pd
+
+from schedule.config import DataConfig
+
+# Kinds of entities, by the name of their key column
+KINDS = {"employee_id": "employee", "org_id": "organization", "dept_id": "department"}
+# Number of keys sent per sqlite statement
+BATCH_SIZE = 50000
+
+class IdRegistry:
+    '''
+    A connection to the registry file. Keys are registered and looked up in
+    batches through a temporary table, so the registry is never loaded in
+    memory as a whole. Used as a context manager: the ids handed out are
+    committed when it exits without an error.
+    Args:
+        path: the path of the sqlite file; created if needed.
+    '''
+    def __init__(self, path):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.conn = sqlite3.connect(path)
+        self.conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS ids (
+                kind TEXT NOT NULL,
+                key TEXT NOT NULL,
+                id INTEGER NOT NULL,
+                PRIMARY KEY (kind, key),
+                UNIQUE (kind, id)
+            );
+            CREATE TEMP TABLE batch_keys (position INTEGER PRIMARY KEY, key TEXT NOT NULL);
+            CREATE TEMP TABLE occurrences (key TEXT PRIMARY KEY, count INTEGER NOT NULL);
+            """)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close(commit=exc_type is None)
+
+    def close(self, commit=True):
+        ''' Closes the registry, committing the ids handed out unless commit is False. '''
+        if commit:
+            self.conn.commit()
+        else:
+            self.conn.rollback()
+        self.conn.close()
+
+    def get_ids(self, kind, keys):
+        '''
+        Returns the ids of the given keys as a numpy array, registering the
+        keys seen for the first time.
+        Args:
+            kind: the kind of entity (a value of KINDS).
+            keys: a sequence of distinct strings.
+        '''
+        keys = list(keys)
+        ids = np.empty(len(keys), dtype=np.int64)
+        for start in range(0, len(keys), BATCH_SIZE):
+            ids[start:start + BATCH_SIZE] = self.get_batch_ids(kind, keys[start:start + BATCH_SIZE])
+        return ids
+
+    def get_batch_ids(self, kind, keys):
+        ''' Returns the ids of a batch of distinct keys (see get_ids). '''
+        self.conn.execute("DELETE FROM batch_keys")
+        self.conn.executemany("INSERT INTO batch_keys VALUES (?, ?)", enumerate(keys))
+        ids = np.full(len(keys), -1, dtype=np.int64)
+        found = self.conn.execute(
+            "SELECT b.position, i.id FROM batch_keys b JOIN ids i ON i.kind = ? AND i.key = b.key",
+            (kind,)).fetchall()
+        if found:
+            positions, found_ids = zip(*found)
+            ids[list(positions)] = found_ids
+        new = np.flatnonzero(ids == -1)
+        if len(new):
+            next_id = self.conn.execute("SELECT COALESCE(MAX(id), -1) + 1 FROM ids WHERE kind = ?",
+                                        (kind,)).fetchone()[0]
+            ids[new] = np.arange(next_id, next_id + len(new))
+            self.conn.executemany("INSERT INTO ids VALUES (?, ?, ?)",
+                                  [(kind, keys[position], int(ids[position])) for position in new])
+        return ids
+
+    def get_employee_ids(self, df):
+        '''
+        Returns the ids of the employees of df (see get_employee_keys).
+        Employees sharing a key are told apart by the order they come in, so
+        with a dataset split in chunks, the chunks must all be passed to the
+        same IdRegistry, in order.
+        '''
+        keys = get_employee_keys(df)
+        # Number each key's occurrences, carrying on from earlier chunks
+        previous = self.get_occurrences(keys.unique())
+        occurrence = keys.map(previous).to_numpy() + keys.groupby(keys).cumcount().to_numpy()
+        counts = keys.value_counts()
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO occurrences VALUES (?, ?)",
+            [(key, int(previous[key] + count)) for key, count in counts.items()])
+        keys = [key if n == 0 else f"{key}#{n + 1}" for key, n in zip(keys.tolist(), occurrence.tolist())]
+        return self.get_ids(KINDS["employee_id"], keys)
+
+    def get_occurrences(self, keys):
+        ''' Returns a dict of key to the number of times it was seen by get_employee_ids. '''
+        occurrences = dict((key, 0) for key in keys)
+        for start in range(0, len(keys), BATCH_SIZE):
+            self.conn.execute("DELETE FROM batch_keys")
+            self.conn.executemany("INSERT INTO batch_keys VALUES (?, ?)",
+                                  enumerate(keys[start:start + BATCH_SIZE]))
+            occurrences.update(self.conn.execute(
+                "SELECT o.key, o.count FROM batch_keys b JOIN occurrences o ON o.key = b.key"))
+        return occurrences
+
+def open_id_registry(path=None):
+    '''
+    Returns an IdRegistry of the file at path (by default the configured
+    id_registry_path), or None if the registry is disabled.
+    '''
+    path = DataConfig.ID_REGISTRY_PATH if path is None else path
+    return IdRegistry(path) if path else None
+
+def get_employee_keys(df):
+    '''
+    Returns the natural key of each employee of df as a pandas series: their
+    email, or their name and organization for employees without one.
+    '''
+    email = df["email"].astype("string").str.strip().str.lower()
+    names = (df["last_name"].astype("string").fillna("") + "|" + df["first_name"].astype("string").fillna("")
+             + "|" + df["compound_name_en"].astype("string").fillna(""))
+    keys = email.where(email.notna() & (email != ""), "name:" + names.str.lower())
+    return pd.Series(keys.astype(object).to_numpy(), index=df.index)
@@ -0,0 +1,234 @@
+'''
+Lightweight instrumentation of the stages of the scheduled job. Each stage
+records its wall and CPU time, peak memory and row counts; at the end of a run
+they are written to a JSON report and, optionally, to a Prometheus textfile
+(as read by the node exporter's textfile collector).
+'''
+import cProfile
+import io
+import json
+import os
+import pstats
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+import numpy as np
+
+try:
+    import resource
+except ImportError:
+    # The resource module is not available on Windows
+    resource = None
+
+# Prefix of the metric names written to the Prometheus textfile
+METRIC_PREFIX = "geds_pipeline"
+# Number of functions printed from the profile of a stage
+PROFILE_PRINT_LIMIT = 25
+
+class StageMetrics:
+    '''
+    Metrics of a single stage. rows_in and rows_out can be set by the code
+    running the stage; everything else is filled in by RunReport.stage.
+    '''
+    def __init__(self, name, rows_in=None):
+        self.name = name
+        self.rows_in = rows_in
+        self.rows_out = None
+        self.status = "running"
+        self.wall_time = None
+        self.cpu_time = None
+        self.peak_rss_bytes = None
+        self.peak_traced_bytes = None
+        # Any other figures worth keeping in the report
+        self.details = {}
+
+    def throughput(self):
+        '''
+        Returns the rows output per second of wall time, or None unless the
+        stage succeeded and set rows_out: the rows a stage reads say nothing
+        of how fast it worked through them if it failed or output nothing.
+        '''
+        if self.status != "success" or self.rows_out is None or not self.wall_time:
+            return None
+        return self.rows_out / self.wall_time
+
+    def to_dict(self):
+        return {
+            "name": self.name,
+            "status": self.status,
+            "wall_time": self.wall_time,
+            "cpu_time": self.cpu_time,
+            "peak_rss_bytes": self.peak_rss_bytes,
+            "peak_traced_bytes": self.peak_traced_bytes,
+            "rows_in": self.rows_in,
+            "rows_out": self.rows_out,
+            "rows_per_second": self.throughput(),
+            "details": self.details,
+        }
+
+class RunReport:
+    '''
+    Collects the metrics of every stage of a run.
+    Args:
+        trace_memory: if set, python allocations are traced with tracemalloc
+            to report the peak memory allocated by each stage. This slows
+            the job down noticeably.
+        profile_stage: the name of a stage to run under cProfile (or None).
+        profile_path: the path the stats of the profiled stage are dumped to.
+    '''
+    def __init__(self, trace_memory=False, profile_stage=None, profile_path=None):
+        self.trace_memory = trace_memory
+        self.profile_stage = profile_stage
+        self.profile_path = profile_path
+        self.stages = []
+        self.status = "running"
+        self.started_at = time.time()
+        self.finished_at = None
+        self._start_counter = time.perf_counter()
+        self.wall_time = None
+
+    @contextmanager
+    def stage(self, name, rows_in=None):
+        '''
+        Measures the code run within the context. Yields the StageMetrics of
+        the stage so the caller can record its row counts, e.g.
+
+            with report.stage("prepare_data") as stage:
+                df = prepare_data()
+                stage.rows_out = len(df)
+        '''
+        metrics = StageMetrics(name, rows_in)
+        self.stages.append(metrics)
+        profiler = cProfile.Profile() if name == self.profile_stage else None
+        if self.trace_memory:
+            if tracemalloc.is_tracing():
+                tracemalloc.stop()
+            tracemalloc.start()
+        start_wall = time.perf_counter()
+        start_cpu = time.process_time()
+        if profiler is not None:
+            profiler.enable()
+        try:
+            yield metrics
+            metrics.status = "success"
+        except BaseException:
+            metrics.status = "failed"
+            raise
+        finally:
+            if profiler is not None:
+                profiler.disable()
+            metrics.wall_time = time.perf_counter() - start_wall
+            metrics.cpu_time = time.process_time() - start_cpu
+            if self.trace_memory:
+                metrics.peak_traced_bytes = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+            metrics.peak_rss_bytes = get_peak_rss()
+            if profiler is not None:
+                self.save_profile(profiler)
+            print_stage(metrics)
+
+    def save_profile(self, profiler):
+        ''' Dumps the stats of the profiled stage and prints the costliest calls. '''
+        if self.profile_path:
+            make_parent_dirs(self.profile_path)
+            profiler.dump_stats(self.profile_path)
+            print(f"Profile of {self.profile_stage} saved to {self.profile_path}")
+        output = io.StringIO()
+        pstats.Stats(profiler, stream=output).sort_stats("cumulative").print_stats(PROFILE_PRINT_LIMIT)
+        print(output.getvalue())
+
+    def finish(self, status):
+        ''' Marks the run as finished with the given status ("success" or "failed"). '''
+        self.status = status
+        self.finished_at = time.time()
+        self.wall_time = time.perf_counter() - self._start_counter
+
+    def to_dict(self):
+        return {
+            "status": self.status,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "wall_time": self.wall_time,
+            "peak_rss_bytes": get_peak_rss(),
+            "stages": [stage.to_dict() for stage in self.stages],
+        }
+
+    def write_json(self, path):
+        ''' Writes the report as JSON to the given path. '''
+        write_atomically(path, json.dumps(self.to_dict(), indent=2, default=to_builtin))
+
+    def write_prometheus(self, path):
+        '''
+        Writes the report in the Prometheus text format. The file is replaced
+        atomically so the textfile collector never reads a partial file.
+        '''
+        lines = [
+            f"# HELP {METRIC_PREFIX}_last_run_timestamp_seconds Time the last run finished.",
+            f"# TYPE {METRIC_PREFIX}_last_run_timestamp_seconds gauge",
+            f"{METRIC_PREFIX}_last_run_timestamp_seconds {self.finished_at}",
+            f"# HELP {METRIC_PREFIX}_last_run_success Whether the last run succeeded.",
+            f"# TYPE {METRIC_PREFIX}_last_run_success gauge",
+            f"{METRIC_PREFIX}_last_run_success {int(self.status == 'success')}",
+            f"# HELP {METRIC_PREFIX}_last_run_duration_seconds Wall time of the last run.",
+            f"# TYPE {METRIC_PREFIX}_last_run_duration_seconds gauge",
+            f"{METRIC_PREFIX}_last_run_duration_seconds {self.wall_time}",
+        ]
+        stage_metrics = [
+            ("stage_wall_seconds", "Wall time of each stage.", "wall_time"),
+            ("stage_cpu_seconds", "CPU time of each stage.", "cpu_time"),
+            ("stage_peak_rss_bytes", "Peak resident memory of the process at the end of each stage.",
+             "peak_rss_bytes"),
+            ("stage_peak_traced_bytes", "Peak memory allocated by python during each stage.",
+             "peak_traced_bytes"),
+            ("stage_rows_in", "Rows read by each stage.", "rows_in"),
+            ("stage_rows_out", "Rows written by each stage.", "rows_out"),
+        ]
+        for metric, help_text, attribute in stage_metrics:
+            samples = [(stage.name, getattr(stage, attribute)) for stage in self.stages
+                       if getattr(stage, attribute) is not None]
+            if not samples:
+                continue
+            lines.append(f"# HELP {METRIC_PREFIX}_{metric} {help_text}")
+            lines.append(f"# TYPE {METRIC_PREFIX}_{metric} gauge")
+            lines.extend(f'{METRIC_PREFIX}_{metric}{{stage="{name}"}} {value}' for name, value in samples)
+        write_atomically(path, "\n".join(lines) + "\n")
+
+def to_builtin(value):
+    ''' Converts the numpy scalars found in stage details for json. '''
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+def get_peak_rss():
+    ''' Returns the peak resident memory of the process in bytes (or None). '''
+    if resource is None:
+        return None
+    # ru_maxrss is in kilobytes on linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+def print_stage(metrics):
+    ''' Prints a one line summary of a stage. '''
+    summary = f"[{metrics.name}] {metrics.status} in {metrics.wall_time:.2f}s (cpu {metrics.cpu_time:.2f}s)"
+    if metrics.rows_out is not None:
+        summary += f", {metrics.rows_out} rows"
+    if metrics.throughput() is not None:
+        summary += f" ({metrics.throughput():.0f} rows/s)"
+    if metrics.peak_rss_bytes is not None:
+        summary += f", peak rss {metrics.peak_rss_bytes / 2 ** 20:.0f}MiB"
+    if metrics.peak_traced_bytes is not None:
+        summary += f", peak traced {metrics.peak_traced_bytes / 2 ** 20:.0f}MiB"
+    print(summary)
+
+def make_parent_dirs(path):
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+def write_atomically(path, content):
+    ''' Writes a text file through a temporary file so readers never see it half-written. '''
+    make_parent_dirs(path)
+    tmp_path = path + ".part"
+    with open(tmp_path, "w") as f:
+        f.write(content)
+    os.replace(tmp_path, path)
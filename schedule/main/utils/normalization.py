@@ -0,0 +1,88 @@
+'''
+Normalization of organization and department names, and of the org structure
+paths the org charts are built from. The units of a path are cleaned like the
+name columns, and both are compared through name_key, so the nodes of the org
+charts match the organizations they stand for. The string work is done once
+per distinct value (see map_unique), not once per employee.
+
+Search suggestions compare names through fold_name, which also ignores accents
+so that english and french spellings match whatever keyboard typed them.
+'''
+import re
+import unicodedata
+
+import numpy as np
+import pandas as pd
+
+from schedule.config import DataConfig
+
+# Separator of the org units in the org structure strings
+UNIT_SEPARATOR = " :"
+# Parenthesized text (mostly acronyms) is left out of the org chart
+PARENTHESES = re.compile(r"\(.*?\)")
+WHITESPACE = re.compile(r"\s+")
+# Characters ignored when names are compared
+SPECIAL_CHARACTERS = re.compile("|".join(re.escape(character) for character
+                                         in DataConfig.ORG_SPECIAL_CHARACTERS))
+
+def clean_name(name):
+    ''' Returns a name without surrounding spaces and with inner runs of spaces collapsed. '''
+    return WHITESPACE.sub(" ", name).strip()
+
+def name_key(name):
+    '''
+    Returns the form of a name used to compare it with other names: case,
+    parenthesized text, special characters and spacing are ignored.
+    '''
+    name = SPECIAL_CHARACTERS.sub(" ", PARENTHESES.sub(" ", name))
+    return WHITESPACE.sub(" ", name).strip().lower()
+
+def fold_name(name):
+    '''
+    Returns the form of a name search suggestions are matched on: accents are
+    removed, case is folded and spacing is collapsed (e.g. "  Défense
+    NATIONALE" becomes "defense nationale").
+    '''
+    # Most names are plain ascii, with nothing to decompose
+    if not name.isascii():
+        decomposed = unicodedata.normalize("NFKD", name)
+        name = "".join(character for character in decomposed if not unicodedata.combining(character))
+    return WHITESPACE.sub(" ", name.casefold()).strip()
+
+def split_paths(structures, max_units=None):
+    '''
+    Splits org structures into their org units, without their parenthesized
+    text and cleaned like the name columns. Each distinct unit of a level is
+    cleaned once.
+    Args:
+        structures: an iterable of org structure strings.
+        max_units: the number of units to keep from the root down; all of
+            them if None.
+    Returns:
+        A pandas dataframe with one row per structure and one column per
+        level; shorter paths are padded with missing values.
+    '''
+    paths = pd.DataFrame([PARENTHESES.sub("", structure).split(UNIT_SEPARATOR)[:max_units]
+                          for structure in structures])
+    return paths.apply(lambda column: map_unique(column, clean_name))
+
+def map_unique(values, func):
+    '''
+    Applies func to every distinct value of a Series and maps the results back
+    to the rows through the codes of the values. Missing values are left out.
+    Args:
+        values: a pandas Series.
+        func: a function of a single value.
+    Returns:
+        A pandas Series with the index of values; it is categorical if values
+        is, otherwise of object dtype.
+    '''
+    codes, uniques = pd.factorize(values)
+    mapped = np.array([func(value) for value in uniques], dtype=object)
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        mapped_codes, categories = pd.factorize(mapped)
+        # The appended code is the one picked for missing values (code -1)
+        codes = np.append(mapped_codes, -1)[codes]
+        return pd.Series(pd.Categorical.from_codes(codes, categories),
+                         index=values.index, name=values.name)
+    return pd.Series(np.append(mapped, np.nan)[codes], index=values.index, name=values.name)
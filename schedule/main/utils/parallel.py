@@ -0,0 +1,31 @@
+'''
+Helpers to run independent pieces of work (e.g. the english and french org
+charts) in a pool of processes.
+'''
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+def get_worker_count(configured):
+    ''' Returns the number of worker processes to use; 0 means one per core. '''
+    if configured <= 0:
+        return os.cpu_count() or 1
+    return configured
+
+def map_in_processes(func, tasks, workers):
+    '''
+    Calls func(*task) for every task, in up to workers processes.
+    Args:
+        func: a function defined at the top level of a module, so it can be
+            sent to the worker processes.
+        tasks: a list of tuples of arguments.
+        workers: the number of processes; with 1 (or a single task) the tasks
+            run one after the other in this process.
+    Returns:
+        The list of results, in the order of the tasks whatever order they
+        finish in.
+    '''
+    if workers <= 1 or len(tasks) <= 1:
+        return [func(*task) for task in tasks]
+    with ProcessPoolExecutor(max_workers=min(workers, len(tasks))) as executor:
+        futures = [executor.submit(func, *task) for task in tasks]
+        return [future.result() for future in futures]
@@ -0,0 +1,51 @@
+'''
+JSON encoding and compression of the blobs stored in the database. orjson and
+zstandard are optional: without orjson the standard library encoder is used
+(with the same compact output), and zstd compression falls back to gzip.
+'''
+import gzip
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Compression codecs that can be configured
+COMPRESSION_CODECS = ("none", "gzip", "zstd")
+
+def dumps(obj):
+    ''' Serializes an object to a compact JSON string. '''
+    if orjson is not None:
+        return orjson.dumps(obj).decode("utf-8")
+    return json.dumps(obj, separators=(",", ":"), ensure_ascii=False)
+
+def get_codec(codec):
+    '''
+    Returns the compression codec that will actually be used for a configured
+    codec: zstd is replaced by gzip when zstandard is not installed.
+    '''
+    if codec not in COMPRESSION_CODECS:
+        raise ValueError(f"Unknown compression codec {codec!r}, expected one of {COMPRESSION_CODECS}")
+    if codec == "zstd" and zstandard is None:
+        print("zstandard is not installed, compressing with gzip instead")
+        return "gzip"
+    return codec
+
+def compress(data, codec):
+    '''
+    Compresses a string with a codec returned by get_codec. Returns the
+    compressed bytes, or None if the codec is "none".
+    '''
+    if codec == "none":
+        return None
+    data = data.encode("utf-8")
+    if codec == "zstd":
+        return zstandard.ZstdCompressor().compress(data)
+    # mtime=0 makes the output depend on the data only
+    return gzip.compress(data, mtime=0)
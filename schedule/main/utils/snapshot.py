@@ -0,0 +1,113 @@
+'''
+Content-hash snapshots of the data written by the previous run, used to work
+out which employees, organizations and departments changed since then.
+'''
+import os
+
+import pandas as pd
+
+from schedule.main.elasticsearch.elastic_bulk_upload import (
+    merge_dataframes, get_document_lookups, merge_employees)
+from schedule.main.prepare_org_chart import EMPLOYEE_COUNT_COLUMN
+
+# Columns of the organizations dataframe written to the organizations table or
+# to the organization documents.
+ORGANIZATION_COLUMNS = ["org_id", "org_name_en", "org_name_fr", "dept_id", "department_en",
+                        "department_fr", "org_chart_path", "direct_headcount", "total_headcount",
+                        "job_title_count", "descendant_org_count", "lft", "rgt"]
+# Columns of the employees that determine the content of a department's org
+# chart: its org structure, and the headcounts and job titles rolled up in it.
+DEPARTMENT_STRUCTURE_COLUMNS = ["department_en", "department_fr", "org_name_en", "org_name_fr",
+                                "org_structure_en", "org_structure_fr", "org_id", "job_title_en",
+                                "job_title_fr"]
+
+def take_snapshot(df, org_df, dept_df):
+    '''
+    Hashes the content of every employee, organization and department.
+    Args:
+        df: a pandas dataframe containing the prepared geds dataset, or a
+            ChunkedFrame of it (see chunked.py).
+        org_df: a pandas dataframe with one row per organization.
+        dept_df: a pandas dataframe with one row per department.
+    Returns:
+        snapshot: a dict of {"employees", "organizations", "departments"} to a
+            pandas series of row hashes indexed by the entity's id.
+    '''
+    # Hash the employee documents sent to elasticsearch, since they contain
+    # every column written to the employees table.
+    if isinstance(df, pd.DataFrame):
+        emp_docs, _ = merge_dataframes(df, org_df, dept_df)
+        employee_hashes = hash_rows(emp_docs, "employee_id")
+        department_hashes = hash_departments(df)
+    else:
+        # Employees are hashed a chunk at a time, departments from the org
+        # structures; every employee id is in a single chunk
+        org_lookup, dept_lookup = get_document_lookups(org_df, dept_df)
+        employee_hashes = pd.concat([hash_rows(merge_employees(chunk, org_lookup, dept_lookup),
+                                               "employee_id") for chunk in df])
+        department_hashes = hash_departments(df.structure)
+    return {
+        "employees": employee_hashes,
+        "organizations": hash_organizations(org_df),
+        "departments": department_hashes,
+    }
+
+def hash_rows(df, key):
+    '''
+    Returns a pandas series containing a hash of every row, indexed by the
+    values of the key column. Rows sharing a key are combined into one hash.
+    '''
+    hashes = pd.util.hash_pandas_object(df.drop(columns=key), index=False)
+    return hashes.groupby(df[key].values).sum()
+
+def hash_organizations(org_df):
+    '''
+    Returns a pandas series containing a hash of every organization, indexed by
+    org_id. All the rows of an org_id are hashed, since each of them is written
+    to the organizations table.
+    '''
+    return hash_rows(org_df[ORGANIZATION_COLUMNS], "org_id")
+
+def hash_departments(df):
+    '''
+    Returns a pandas series containing a hash of the org structure of each
+    department, indexed by dept_id. Every employee is hashed, so the hash
+    changes with the headcounts of the department's organizations but not
+    with the order of the rows. Rows standing for several employees (see
+    prepare_org_chart.EMPLOYEE_COUNT_COLUMN) are hashed once per employee.
+    '''
+    row_hashes = pd.util.hash_pandas_object(df[DEPARTMENT_STRUCTURE_COLUMNS], index=False)
+    if EMPLOYEE_COUNT_COLUMN in df.columns:
+        row_hashes = row_hashes * df[EMPLOYEE_COUNT_COLUMN].to_numpy().astype("uint64")
+    # Summing (with uint64 overflow) combines the hashes independently of order
+    return row_hashes.groupby(df["dept_id"].values).sum()
+
+def compute_delta(previous, current):
+    '''
+    Compares two series of row hashes.
+    Args:
+        previous: a pandas series of hashes from the last run, indexed by id.
+        current: a pandas series of hashes from this run, indexed by id.
+    Returns:
+        delta: a dict of lists of ids under the keys "inserts", "updates" and
+            "deletes".
+    '''
+    common = current.index.intersection(previous.index)
+    changed = current[common] != previous[common]
+    return {
+        "inserts": current.index.difference(previous.index).tolist(),
+        "updates": common[changed.values].tolist(),
+        "deletes": previous.index.difference(current.index).tolist(),
+    }
+
+def load_snapshot(path):
+    ''' Returns the snapshot saved at path, or None if there is none. '''
+    if not os.path.isfile(path):
+        return None
+    return pd.read_pickle(path)
+
+def save_snapshot(snapshot, path):
+    ''' Writes a snapshot to disk, replacing the previous one. '''
+    partial_path = path + ".part"
+    pd.to_pickle(snapshot, partial_path)
+    os.replace(partial_path, path)
@@ -0,0 +1,162 @@
+'''
+Fast bulk loading of dataframes into the SQL database. A table is loaded into
+a staging table using the fastest method the dialect offers, then swapped in
+for the live table; keys and indexes are only created once the data is in.
+'''
+import csv
+import io
+from contextlib import contextmanager
+
+import pandas as pd
+from sqlalchemy import text
+
+from schedule.main.utils.db_utils import get_engine
+
+# Number of rows sent per INSERT statement when using multi-row inserts
+MULTI_INSERT_CHUNKSIZE = 1000
+
+def load_table(df, table_name, dtype, primary_key=None, indexes=()):
+    '''
+    Replaces a table with the contents of a dataframe.
+
+    Args:
+        df:
+            A pandas dataframe containing exactly the columns of the table,
+            or an iterable of such dataframes, appended one after the other
+            so that only one of them is held in memory at a time.
+        table_name:
+            A string containing the name of the table.
+        dtype:
+            A dict of column name to SQLAlchemy type, as passed to to_sql.
+        primary_key:
+            The name of the column to use as primary key (if any). If its
+            values are not unique an ordinary index is created instead.
+        indexes:
+            Names of other columns to index, or tuples of names for indexes
+            over several columns.
+    '''
+    engine = get_engine()
+    staging_name = f"{table_name}_staging"
+    dialect = engine.dialect.name
+    with engine.connect() as conn:
+        if dialect == "sqlite":
+            # Trade durability for speed during the load; the write-ahead log
+            # also lets readers keep using the live table meanwhile. Both
+            # settings are put back once the table is loaded.
+            pragmas = dict((pragma, conn.execute(text(f"PRAGMA {pragma}")).scalar())
+                           for pragma in ["journal_mode", "synchronous"])
+            conn.execute(text("PRAGMA journal_mode=WAL"))
+            conn.execute(text("PRAGMA synchronous=OFF"))
+        try:
+            with conn.begin():
+                conn.execute(text(f"DROP TABLE IF EXISTS {staging_name}"))
+                unique = insert_frames(conn, dialect, staging_name, df, dtype, primary_key)
+            if primary_key is not None and not unique:
+                print(f"{table_name}.{primary_key} is not unique, indexing it without a primary key")
+                indexes = [primary_key] + list(indexes)
+                primary_key = None
+            with ddl_transaction(conn, dialect):
+                swap_tables(conn, dialect, table_name, staging_name)
+                create_keys(conn, dialect, table_name, primary_key, indexes)
+        finally:
+            if dialect == "sqlite":
+                for pragma, value in pragmas.items():
+                    conn.execute(text(f"PRAGMA {pragma}={value}"))
+
+@contextmanager
+def ddl_transaction(conn, dialect):
+    '''
+    Runs the statements of the block in a single transaction, DDL included.
+    pysqlite does not begin a transaction before DDL statements, so each of
+    them would be committed on its own; for sqlite the transaction is begun
+    explicitly, with the driver's own transaction handling turned off.
+    '''
+    if dialect != "sqlite":
+        with conn.begin():
+            yield
+        return
+    dbapi_connection = conn.connection.connection
+    isolation_level = dbapi_connection.isolation_level
+    dbapi_connection.isolation_level = None
+    try:
+        with conn.begin():
+            conn.execute(text("BEGIN"))
+            yield
+    finally:
+        dbapi_connection.isolation_level = isolation_level
+
+def insert_frames(conn, dialect, table_name, df, dtype, key=None):
+    '''
+    Inserts a dataframe, or each of an iterable of dataframes, into a table,
+    creating it if needed. Returns whether the values of the key column are
+    unique, or None if there is no key.
+    '''
+    frames = [df] if isinstance(df, pd.DataFrame) else df
+    unique = True
+    n_frames = 0
+    for frame in frames:
+        frame.to_sql(table_name, conn, index=False, dtype=dtype, if_exists="append",
+                     **insert_options(dialect, frame))
+        unique = unique and (key is None or frame[key].is_unique)
+        n_frames += 1
+    if key is None:
+        return None
+    if unique and n_frames > 1:
+        # Keys can also repeat across frames
+        rows, distinct = conn.execute(text(
+            f"SELECT COUNT(*), COUNT(DISTINCT {key}) FROM {table_name}")).fetchone()
+        unique = rows == distinct
+    return unique
+
+def insert_options(dialect, df):
+    ''' Returns the to_sql options giving the fastest inserts for a dialect. '''
+    if dialect == "postgresql":
+        return {"method": copy_from_stdin}
+    if dialect == "sqlite":
+        # executemany within a single transaction is the fastest for sqlite
+        return {"method": None}
+    return {"method": "multi", "chunksize": MULTI_INSERT_CHUNKSIZE}
+
+def copy_from_stdin(table, conn, keys, data_iter):
+    '''
+    Inserts rows with PostgreSQL's COPY FROM STDIN; used as the method of
+    to_sql (see the insertion method section of the pandas to_sql docs).
+    '''
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(data_iter)
+    buffer.seek(0)
+    columns = ", ".join(f'"{key}"' for key in keys)
+    name = f"{table.schema}.{table.name}" if table.schema else table.name
+    with conn.connection.cursor() as cursor:
+        cursor.copy_expert(f"COPY {name} ({columns}) FROM STDIN WITH CSV", buffer)
+
+def swap_tables(conn, dialect, table_name, staging_name):
+    '''
+    Replaces a table by its staging table. This is atomic on mysql, and on
+    dialects with transactional DDL (sqlite, postgresql) when run in a
+    ddl_transaction.
+    '''
+    if dialect == "mysql":
+        old_name = f"{table_name}_old"
+        conn.execute(text(f"DROP TABLE IF EXISTS {old_name}"))
+        conn.execute(text(f"CREATE TABLE IF NOT EXISTS {table_name} LIKE {staging_name}"))
+        conn.execute(text(f"RENAME TABLE {table_name} TO {old_name}, {staging_name} TO {table_name}"))
+        conn.execute(text(f"DROP TABLE {old_name}"))
+    else:
+        conn.execute(text(f"DROP TABLE IF EXISTS {table_name}"))
+        conn.execute(text(f"ALTER TABLE {staging_name} RENAME TO {table_name}"))
+
+def create_keys(conn, dialect, table_name, primary_key=None, indexes=()):
+    ''' Creates the primary key and indexes of a freshly loaded table. '''
+    if primary_key is not None:
+        if dialect == "sqlite":
+            # sqlite cannot add a primary key to an existing table; a unique
+            # index gives the same lookups and guarantees.
+            conn.execute(text(
+                f"CREATE UNIQUE INDEX pk_{table_name} ON {table_name} ({primary_key})"))
+        else:
+            conn.execute(text(f"ALTER TABLE {table_name} ADD PRIMARY KEY ({primary_key})"))
+    for columns in indexes:
+        columns = [columns] if isinstance(columns, str) else list(columns)
+        conn.execute(text(f"CREATE INDEX ix_{table_name}_{'_'.join(columns)} "
+                          f"ON {table_name} ({', '.join(columns)})"))
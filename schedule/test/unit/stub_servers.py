@@ -0,0 +1,230 @@
+'''
+Local HTTP servers that stand in for the services the pipeline talks to, so
+the code that calls them can be tested without a network. Each server runs
+in a thread of the test process on a free port of localhost.
+'''
+import json
+import threading
+from collections import namedtuple
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# A request received by a stub server
+StubRequest = namedtuple("StubRequest", ["method", "path", "headers", "body"])
+
+@contextmanager
+def run_server(handler_class, **state):
+    '''
+    Serves requests with handler_class from a background thread.
+    Args:
+        handler_class: a BaseHTTPRequestHandler subclass.
+        **state: attributes set on the server, where handlers can read and
+            update them.
+    Returns:
+        The server; its url attribute is the base url to send requests to,
+        and its requests attribute lists the StubRequest received.
+    '''
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler_class)
+    server.lock = threading.Lock()
+    server.requests = []
+    for name, value in state.items():
+        setattr(server, name, value)
+    server.url = f"http://127.0.0.1:{server.server_address[1]}"
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield server
+    finally:
+        server.shutdown()
+        server.server_close()
+        thread.join()
+
+class StubHandler(BaseHTTPRequestHandler):
+    ''' Records every request on the server and keeps the test output quiet. '''
+
+    def log_message(self, format, *args):
+        pass
+
+    def read_body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return self.rfile.read(length) if length else b""
+
+    def record(self, body=b""):
+        with self.server.lock:
+            self.server.requests.append(StubRequest(self.command, self.path, dict(self.headers), body))
+
+    def send_body(self, status, body=b"", headers=None, content_type="application/octet-stream"):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(body)
+
+class StubElasticsearchHandler(StubHandler):
+    '''
+    Speaks the parts of the elasticsearch REST API used by bulk_indexer: the
+    bulk endpoint, and index creation, settings and refreshes. The server
+    state is:
+        indices: a dict of index name to a dict with the "settings" and the
+            "documents" (by id) of the index.
+        reject: a dict of document id to the number of times indexing it is
+            rejected with a 429 before it is accepted.
+        invalid: a set of document ids rejected with a 400 mapping error.
+    '''
+
+    def send_json(self, status, payload):
+        self.send_body(status, json.dumps(payload).encode("utf-8"), content_type="application/json",
+                       headers={"X-Elastic-Product": "Elasticsearch"})
+
+    def parse_path(self):
+        return [part for part in self.path.split("?", 1)[0].split("/") if part]
+
+    def do_HEAD(self):
+        self.record()
+        parts = self.parse_path()
+        with self.server.lock:
+            exists = len(parts) == 1 and parts[0] in self.server.indices
+        self.send_json(200 if exists else 404, {})
+
+    def do_GET(self):
+        self.record()
+        parts = self.parse_path()
+        if not parts:
+            # The client checks that it is talking to elasticsearch
+            self.send_json(200, {"version": {"number": "7.17.0", "build_flavor": "default"},
+                                 "tagline": "You Know, for Search"})
+        elif len(parts) == 2 and parts[1] == "_settings" and parts[0] in self.server.indices:
+            with self.server.lock:
+                settings = dict(self.server.indices[parts[0]]["settings"])
+            self.send_json(200, {parts[0]: {"settings": {"index": settings}}})
+        else:
+            self.send_json(404, {"error": {"type": "index_not_found_exception"}, "status": 404})
+
+    def do_PUT(self):
+        body = self.read_body()
+        self.record(body)
+        parts = self.parse_path()
+        payload = json.loads(body or b"{}")
+        with self.server.lock:
+            if len(parts) == 1:
+                settings = payload.get("settings", {}).get("index", {})
+                self.server.indices[parts[0]] = {"settings": dict(settings), "documents": {}}
+                self.send_json(200, {"acknowledged": True, "index": parts[0]})
+            elif len(parts) == 2 and parts[1] == "_settings" and parts[0] in self.server.indices:
+                self.server.indices[parts[0]]["settings"].update(payload.get("index", {}))
+                self.send_json(200, {"acknowledged": True})
+            else:
+                self.send_json(404, {"error": {"type": "index_not_found_exception"}, "status": 404})
+
+    def do_POST(self):
+        body = self.read_body()
+        self.record(body)
+        parts = self.parse_path()
+        if parts and parts[-1] == "_refresh":
+            self.send_json(200, {"_shards": {"total": 1, "successful": 1, "failed": 0}})
+        elif parts and parts[-1] == "_bulk":
+            self.send_json(200, self.bulk(body.decode("utf-8").splitlines()))
+        else:
+            self.send_json(404, {"error": {"type": "illegal_argument_exception"}, "status": 404})
+
+    def bulk(self, lines):
+        ''' Applies the actions of a bulk request and returns the response. '''
+        items = []
+        lines = iter(lines)
+        with self.server.lock:
+            for line in lines:
+                (op_type, meta), = json.loads(line).items()
+                document = None if op_type == "delete" else json.loads(next(lines))
+                items.append({op_type: self.apply(op_type, meta, document)})
+        errors = any(item[op_type]["status"] >= 300 for item in items for op_type in item)
+        return {"took": 1, "errors": errors, "items": items}
+
+    def apply(self, op_type, meta, document):
+        ''' Applies one bulk action and returns its item in the response. '''
+        index, doc_id = meta["_index"], str(meta["_id"])
+        item = {"_index": index, "_id": doc_id}
+        documents = self.server.indices.setdefault(
+            index, {"settings": {}, "documents": {}})["documents"]
+        if self.server.reject.get(doc_id, 0) > 0:
+            self.server.reject[doc_id] -= 1
+            item.update(status=429, error={"type": "es_rejected_execution_exception",
+                                           "reason": "rejected execution"})
+        elif doc_id in self.server.invalid:
+            item.update(status=400, error={"type": "mapper_parsing_exception",
+                                           "reason": "failed to parse"})
+        elif op_type == "delete":
+            found = documents.pop(doc_id, None) is not None
+            item.update(status=200 if found else 404, result="deleted" if found else "not_found")
+        else:
+            created = doc_id not in documents
+            documents[doc_id] = document.get("doc", document) if op_type == "update" else document
+            item.update(status=201 if created else 200, result="created" if created else "updated")
+        return item
+
+@contextmanager
+def run_elasticsearch(indices=None, reject=None, invalid=()):
+    ''' Runs a StubElasticsearchHandler server; see its docstring for the state. '''
+    with run_server(StubElasticsearchHandler, indices=indices if indices is not None else {},
+                    reject=dict(reject or {}), invalid=set(invalid)) as server:
+        yield server
+
+class StubFileHandler(StubHandler):
+    '''
+    Serves a single file at every path, like the GEDS download url. The server
+    state is:
+        content: the bytes of the file.
+        etag, last_modified: the validators of the file, or None; requests
+            are only answered conditionally (If-None-Match, If-Modified-Since,
+            If-Range) when they are set.
+        truncate_at: if set, the next full response is cut off after this
+            many bytes of the body, as if the connection dropped.
+        range_shift: added to the start of the ranges served, to send a part
+            of the file other than the one requested.
+    '''
+
+    def do_GET(self):
+        self.record()
+        with self.server.lock:
+            content, etag, last_modified = self.server.content, self.server.etag, self.server.last_modified
+            truncate_at, self.server.truncate_at = self.server.truncate_at, None
+            range_shift = self.server.range_shift
+        validators = {}
+        if etag:
+            validators["ETag"] = etag
+        if last_modified:
+            validators["Last-Modified"] = last_modified
+        if etag and self.headers.get("If-None-Match") == etag:
+            return self.send_body(304, headers=validators)
+        if not etag and last_modified and self.headers.get("If-Modified-Since") == last_modified:
+            return self.send_body(304, headers=validators)
+        requested = self.headers.get("Range")
+        if_range = self.headers.get("If-Range")
+        if requested and (etag or last_modified) and if_range in (etag, last_modified):
+            start = int(requested[len("bytes="):].split("-")[0])
+            if start >= len(content):
+                return self.send_body(416, headers={"Content-Range": f"bytes */{len(content)}"})
+            start = max(0, min(start + range_shift, len(content) - 1))
+            part = content[start:]
+            headers = dict(validators, **{"Content-Range": f"bytes {start}-{len(content) - 1}/{len(content)}"})
+            return self.send_body(206, part, headers=headers)
+        if truncate_at is None:
+            return self.send_body(200, content, headers=validators)
+        # Announce the whole file but only send part of it
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(content)))
+        for name, value in validators.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(content[:truncate_at])
+        self.wfile.flush()
+        self.close_connection = True
+
+@contextmanager
+def run_file_server(content, etag=None, last_modified=None):
+    ''' Runs a StubFileHandler server; see its docstring for the state. '''
+    with run_server(StubFileHandler, content=content, etag=etag, last_modified=last_modified,
+                    truncate_at=None, range_shift=0) as server:
+        yield server
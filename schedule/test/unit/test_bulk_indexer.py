@@ -0,0 +1,132 @@
+'''
+Tests of the parallel bulk indexer against a local stub of the elasticsearch
+bulk API.
+'''
+import json
+import time
+import unittest
+from unittest import mock
+
+from elasticsearch import Elasticsearch
+
+from schedule.config import ElasticConfig
+from schedule.main.elasticsearch.bulk_indexer import bulk_index, bulk_load_settings
+from schedule.test.unit.stub_servers import run_elasticsearch
+
+INDEX = "employee_test"
+INITIAL_BACKOFF = 0.2
+
+def index_actions(ids):
+    ''' Index actions for a document per id. '''
+    return [{"_op_type": "index", "_index": INDEX, "_id": doc_id, "_source": {"name": f"name {doc_id}"}}
+            for doc_id in ids]
+
+def delete_actions(ids):
+    ''' Delete actions for a document per id. '''
+    return [{"_op_type": "delete", "_index": INDEX, "_id": doc_id} for doc_id in ids]
+
+class BulkIndexerTest(unittest.TestCase):
+
+    def setUp(self):
+        # Small batches so several requests are in flight, and a short backoff
+        patches = [mock.patch.object(ElasticConfig, "CHUNK_SIZE", 10),
+                   mock.patch.object(ElasticConfig, "THREAD_COUNT", 2),
+                   mock.patch.object(ElasticConfig, "MAX_RETRIES", 3),
+                   mock.patch.object(ElasticConfig, "INITIAL_BACKOFF", INITIAL_BACKOFF),
+                   mock.patch.object(ElasticConfig, "MAX_BACKOFF", 1)]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def test_index(self):
+        with run_elasticsearch() as server:
+            stats = bulk_index(Elasticsearch([server.url]), index_actions(range(45)))
+        self.assertEqual(stats["success"], 45)
+        self.assertEqual(stats["failed"], 0)
+        self.assertEqual(len(server.indices[INDEX]["documents"]), 45)
+
+    def test_rejected_documents_are_retried_with_backoff(self):
+        with run_elasticsearch(reject={"3": 2}) as server:
+            bulk_sent = []
+            es = Elasticsearch([server.url])
+            original_bulk = es.bulk
+            def timed_bulk(*args, **kwargs):
+                bulk_sent.append(time.monotonic())
+                return original_bulk(*args, **kwargs)
+            es.bulk = timed_bulk
+            stats = bulk_index(es, index_actions(range(5)))
+        self.assertEqual(stats["success"], 5)
+        self.assertEqual(stats["failed"], 0)
+        self.assertIn("3", server.indices[INDEX]["documents"])
+        # Rejected twice, so sent three times; the second retry waits twice as long
+        self.assertEqual(len(bulk_sent), 3)
+        self.assertGreaterEqual(bulk_sent[1] - bulk_sent[0], INITIAL_BACKOFF)
+        self.assertGreaterEqual(bulk_sent[2] - bulk_sent[1], 2 * INITIAL_BACKOFF)
+        # Only the rejected document is sent again
+        retried = [json.loads(request.body.splitlines()[0]) for request in server.requests
+                   if request.path.startswith("/_bulk")][1:]
+        self.assertEqual([str(action["index"]["_id"]) for action in retried], ["3", "3"])
+
+    def test_rejected_documents_fail_after_max_retries(self):
+        with run_elasticsearch(reject={"3": 10}) as server:
+            stats = bulk_index(Elasticsearch([server.url]), index_actions(range(5)))
+        self.assertEqual(stats["success"], 4)
+        self.assertEqual(stats["failed"], 1)
+        self.assertEqual(stats["errors"], {"429 es_rejected_execution_exception": 1})
+
+    def test_invalid_documents_are_counted_as_failed(self):
+        with run_elasticsearch(invalid={"7", "12"}) as server:
+            stats = bulk_index(Elasticsearch([server.url]), index_actions(range(20)))
+        self.assertEqual(stats["success"], 18)
+        self.assertEqual(stats["failed"], 2)
+        self.assertEqual(stats["errors"], {"400 mapper_parsing_exception": 2})
+        self.assertEqual(sorted(failure["_id"] for failure in stats["failures"]), ["12", "7"])
+        self.assertTrue(all(failure["status"] == 400 and failure["op_type"] == "index"
+                            for failure in stats["failures"]))
+        # A 400 is not retried
+        self.assertEqual(len([request for request in server.requests
+                              if request.path.startswith("/_bulk")]), 2)
+
+    def test_delete_of_missing_document_is_not_a_failure(self):
+        indices = {INDEX: {"settings": {}, "documents": {"1": {}, "2": {}}}}
+        with run_elasticsearch(indices=indices) as server:
+            stats = bulk_index(Elasticsearch([server.url]), delete_actions(["1", "2", "3"]))
+        self.assertEqual(stats["success"], 3)
+        self.assertEqual(stats["failed"], 0)
+        self.assertEqual(server.indices[INDEX]["documents"], {})
+
+    def test_bulk_load_settings_are_restored(self):
+        settings = {"refresh_interval": "30s", "number_of_replicas": "2"}
+        indices = {INDEX: {"settings": dict(settings), "documents": {}}}
+        with run_elasticsearch(indices=indices) as server:
+            stats = bulk_index(Elasticsearch([server.url]), index_actions(range(5)),
+                               bulk_load_indices=[INDEX])
+            bulk_load = [json.loads(request.body) for request in server.requests
+                         if request.method == "PUT" and request.path.startswith(f"/{INDEX}/_settings")][0]
+            refreshed = any(request.path.startswith(f"/{INDEX}/_refresh") for request in server.requests)
+        self.assertEqual(stats["success"], 5)
+        self.assertEqual(bulk_load["index"], {"refresh_interval": "-1", "number_of_replicas": 0})
+        self.assertEqual(server.indices[INDEX]["settings"], settings)
+        self.assertTrue(refreshed)
+
+    def test_bulk_load_settings_are_restored_on_error(self):
+        settings = {"refresh_interval": "30s", "number_of_replicas": "2"}
+        indices = {INDEX: {"settings": dict(settings), "documents": {}}}
+        with run_elasticsearch(indices=indices) as server:
+            with self.assertRaises(RuntimeError):
+                with bulk_load_settings(Elasticsearch([server.url]), [INDEX]):
+                    self.assertEqual(server.indices[INDEX]["settings"]["refresh_interval"], "-1")
+                    raise RuntimeError("load failed")
+        self.assertEqual(server.indices[INDEX]["settings"], settings)
+
+    def test_bulk_load_settings_create_missing_index(self):
+        with run_elasticsearch() as server:
+            with bulk_load_settings(Elasticsearch([server.url]), [INDEX]):
+                self.assertEqual(server.indices[INDEX]["settings"],
+                                 {"refresh_interval": "-1", "number_of_replicas": 0})
+        # A null refresh_interval restores the default
+        self.assertEqual(server.indices[INDEX]["settings"],
+                         {"refresh_interval": None, "number_of_replicas": 1})
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,152 @@
+'''
+Checks which stages Checkpoints runs, restores, skips or discards, on a small
+pipeline of stub stages checkpointed in a temporary directory.
+'''
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import pandas as pd
+
+from schedule.main.utils.checkpoints import MANIFEST_NAME, Checkpoints, StopPipeline
+from schedule.main.utils.instrumentation import RunReport
+
+STAGES = ["prepare_data", "build_organizations", "create_organization_table", "build_index"]
+
+class CheckpointsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+        self.data_version = "v1"
+        self.settings = {"tree_depth": 7}
+        # Names of the stages whose function was called, and the rows written
+        self.calls = []
+        self.written = []
+
+    def run_pipeline(self, directory=True, **kwargs):
+        '''
+        Runs the stub pipeline: a source stage, a stage that computes from it,
+        a stage that writes what was computed and another stage computing
+        from it. Returns the checkpoint status of each stage of the report.
+        '''
+        checkpoints = Checkpoints(self.dir if directory else None, **kwargs)
+        report = RunReport()
+        def stage_func(name, outputs):
+            def func(stage):
+                self.calls.append(name)
+                return outputs()
+            return func
+        try:
+            df = checkpoints.run(report, "prepare_data",
+                                 stage_func("prepare_data", lambda: pd.DataFrame({"org_id": [1, 2, 3]})),
+                                 save=False, source=lambda: self.data_version)
+            org_df = checkpoints.run(report, "build_organizations",
+                                     stage_func("build_organizations", lambda: df.assign(depth=1)),
+                                     inputs=["prepare_data"], settings=self.settings)
+            checkpoints.run(report, "create_organization_table",
+                            stage_func("create_organization_table", lambda: self.written.append(len(org_df))),
+                            inputs=["build_organizations"], writes=True)
+            checkpoints.run(report, "build_index",
+                            stage_func("build_index", lambda: org_df["org_id"].tolist()),
+                            inputs=["build_organizations"])
+        except StopPipeline:
+            pass
+        checkpoints.check_target_reached()
+        return dict((stage.name, stage.details.get("checkpoint", "ran")) for stage in report.stages)
+
+    def read_manifest(self):
+        with open(os.path.join(self.dir, MANIFEST_NAME)) as f:
+            return json.load(f)
+
+    def test_unchanged_stages_are_restored_or_skipped(self):
+        self.assertEqual(self.run_pipeline(), dict.fromkeys(STAGES, "ran"))
+        self.calls = []
+        self.assertEqual(self.run_pipeline(), {
+            "prepare_data": "ran",
+            "build_organizations": "restored",
+            "create_organization_table": "skipped",
+            "build_index": "restored",
+        })
+        # Source stages are run every time; nothing was written twice
+        self.assertEqual(self.calls, ["prepare_data"])
+        self.assertEqual(self.written, [3])
+
+    def test_changed_settings_run_stage_and_those_after_it(self):
+        self.run_pipeline()
+        self.calls = []
+        self.settings = {"tree_depth": 5}
+        self.run_pipeline()
+        self.assertEqual(self.calls, STAGES)
+        self.assertEqual(self.written, [3, 3])
+
+    def test_changed_data_discards_every_checkpoint(self):
+        self.run_pipeline()
+        self.assertEqual(len([name for name in os.listdir(self.dir) if name.endswith(".pkl")]), 2)
+        self.data_version = "v2"
+        self.assertEqual(self.run_pipeline(only_stage="prepare_data"), {"prepare_data": "ran"})
+        self.assertEqual(list(self.read_manifest()["stages"]), ["prepare_data"])
+        self.assertEqual([name for name in os.listdir(self.dir) if name.endswith(".pkl")], [])
+        self.calls = []
+        self.run_pipeline()
+        self.assertEqual(self.calls, STAGES)
+
+    def test_from_stage_runs_it_and_every_stage_after_it(self):
+        self.run_pipeline()
+        self.calls = []
+        self.assertEqual(self.run_pipeline(from_stage="create_organization_table"), {
+            "prepare_data": "ran",
+            "build_organizations": "restored",
+            "create_organization_table": "ran",
+            "build_index": "ran",
+        })
+        self.assertEqual(self.written, [3, 3])
+
+    def test_stages_before_target_never_write(self):
+        # Without checkpoints the stages before the target are computed, but
+        # the stage writing is skipped all the same
+        self.assertEqual(self.run_pipeline(from_stage="build_index"), {
+            "prepare_data": "ran",
+            "build_organizations": "ran",
+            "create_organization_table": "skipped",
+            "build_index": "ran",
+        })
+        self.assertEqual(self.written, [])
+        self.assertNotIn("create_organization_table", self.read_manifest()["stages"])
+
+    def test_only_stage_runs_it_alone(self):
+        self.run_pipeline()
+        self.calls = []
+        self.assertEqual(self.run_pipeline(only_stage="build_organizations"), {
+            "prepare_data": "ran",
+            "build_organizations": "ran",
+        })
+        self.assertEqual(self.calls, ["prepare_data", "build_organizations"])
+        self.assertEqual(self.written, [3])
+
+    def test_unknown_target_is_an_error(self):
+        with self.assertRaises(ValueError):
+            self.run_pipeline(from_stage="build_departments")
+
+    def test_failed_stage_leaves_no_checkpoint(self):
+        self.run_pipeline()
+        self.settings = {"tree_depth": 5}
+        checkpoints = Checkpoints(self.dir)
+        report = RunReport()
+        checkpoints.run(report, "prepare_data", lambda stage: None, save=False, source=lambda: self.data_version)
+        def fail(stage):
+            raise RuntimeError("out of memory")
+        with self.assertRaises(RuntimeError):
+            checkpoints.run(report, "build_organizations", fail, inputs=["prepare_data"], settings=self.settings)
+        self.assertNotIn("build_organizations", self.read_manifest()["stages"])
+
+    def test_without_directory_every_stage_runs(self):
+        self.run_pipeline(directory=False)
+        self.run_pipeline(directory=False)
+        self.assertEqual(self.calls, STAGES * 2)
+        self.assertEqual(os.listdir(self.dir), [])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,128 @@
+'''
+Tests of the conditional and resumable GEDS download against a local stub of
+the download server.
+'''
+import os
+import shutil
+import tempfile
+import unittest
+
+from schedule.main.utils.fetch_data import (
+    download_if_changed, is_processed, load_download_metadata, mark_processed, PARTIAL_SUFFIX)
+from schedule.test.unit.stub_servers import run_file_server
+
+CONTENT = bytes(range(256)) * 64
+ETAG = '"v1"'
+LAST_MODIFIED = "Fri, 01 May 2020 12:00:00 GMT"
+
+class DownloadIfChangedTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+        self.path = os.path.join(self.dir, "gedsOpenData.zip")
+        self.partial_path = self.path + PARTIAL_SUFFIX
+
+    def read(self, path=None):
+        with open(path or self.path, "rb") as f:
+            return f.read()
+
+    def interrupt_download(self, server, received):
+        ''' Leaves a partial copy of the first received bytes of the file. '''
+        server.truncate_at = received
+        with self.assertRaises(Exception):
+            download_if_changed(server.url, self.path)
+        self.assertEqual(self.read(self.partial_path), CONTENT[:received])
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_download(self):
+        with run_file_server(CONTENT, etag=ETAG) as server:
+            result = download_if_changed(server.url, self.path)
+        self.assertEqual(result, {"status": "downloaded", "changed": True, "bytes": len(CONTENT)})
+        self.assertEqual(self.read(), CONTENT)
+        self.assertFalse(os.path.exists(self.partial_path))
+        metadata = load_download_metadata(self.path)
+        self.assertEqual(metadata["etag"], ETAG)
+        self.assertEqual(metadata["size"], len(CONTENT))
+
+    def test_not_modified(self):
+        with run_file_server(CONTENT, etag=ETAG) as server:
+            download_if_changed(server.url, self.path)
+            result = download_if_changed(server.url, self.path)
+        self.assertEqual(result, {"status": "not_modified", "changed": False, "bytes": 0})
+        self.assertEqual(server.requests[-1].headers.get("If-None-Match"), ETAG)
+        self.assertEqual(self.read(), CONTENT)
+
+    def test_not_modified_since(self):
+        with run_file_server(CONTENT, last_modified=LAST_MODIFIED) as server:
+            download_if_changed(server.url, self.path)
+            result = download_if_changed(server.url, self.path)
+        self.assertEqual(result["status"], "not_modified")
+        self.assertEqual(server.requests[-1].headers.get("If-Modified-Since"), LAST_MODIFIED)
+
+    def test_fresh_copy_is_not_checked(self):
+        with run_file_server(CONTENT, etag=ETAG) as server:
+            download_if_changed(server.url, self.path)
+            result = download_if_changed(server.url, self.path, max_age=3600)
+        self.assertEqual(result["status"], "fresh")
+        self.assertEqual(len(server.requests), 1)
+
+    def test_resume(self):
+        with run_file_server(CONTENT, etag=ETAG) as server:
+            self.interrupt_download(server, 1000)
+            result = download_if_changed(server.url, self.path)
+        self.assertEqual(server.requests[-1].headers.get("Range"), "bytes=1000-")
+        self.assertEqual(result, {"status": "resumed", "changed": True, "bytes": len(CONTENT) - 1000})
+        self.assertEqual(self.read(), CONTENT)
+        self.assertFalse(os.path.exists(self.partial_path))
+
+    def test_resume_from_wrong_range_starts_over(self):
+        with run_file_server(CONTENT, etag=ETAG) as server:
+            self.interrupt_download(server, 1000)
+            # The server answers the range request from another offset
+            server.range_shift = 24
+            result = download_if_changed(server.url, self.path)
+        # The partial copy is discarded and the file requested again in full
+        self.assertEqual([request.headers.get("Range") for request in server.requests[-2:]],
+                         ["bytes=1000-", None])
+        self.assertEqual(result, {"status": "downloaded", "changed": True, "bytes": len(CONTENT)})
+        self.assertEqual(self.read(), CONTENT)
+        self.assertFalse(os.path.exists(self.partial_path))
+
+    def test_resume_of_changed_file_starts_over(self):
+        with run_file_server(CONTENT, etag=ETAG) as server:
+            self.interrupt_download(server, 1000)
+            server.content, server.etag = CONTENT[::-1], '"v2"'
+            result = download_if_changed(server.url, self.path)
+        self.assertEqual(result["status"], "downloaded")
+        self.assertEqual(self.read(), CONTENT[::-1])
+
+    def test_unsatisfiable_range_starts_over(self):
+        with run_file_server(CONTENT, etag=ETAG) as server:
+            self.interrupt_download(server, 1000)
+            # The file shrank without changing its ETag
+            server.content = CONTENT[:500]
+            result = download_if_changed(server.url, self.path)
+        self.assertEqual([request.headers.get("Range") for request in server.requests[-2:]],
+                         ["bytes=1000-", None])
+        self.assertEqual(result, {"status": "downloaded", "changed": True, "bytes": 500})
+        self.assertEqual(self.read(), CONTENT[:500])
+
+    def test_unchanged_content_stops_early(self):
+        # Without validators every check downloads the file again, and the
+        # content is compared instead
+        with run_file_server(CONTENT) as server:
+            first = download_if_changed(server.url, self.path)
+            self.assertFalse(is_processed(self.path))
+            mark_processed(self.path)
+            second = download_if_changed(server.url, self.path)
+            self.assertTrue(is_processed(self.path))
+            server.content = CONTENT[::-1]
+            third = download_if_changed(server.url, self.path)
+            self.assertFalse(is_processed(self.path))
+        self.assertTrue(first["changed"])
+        self.assertEqual(second, {"status": "downloaded", "changed": False, "bytes": len(CONTENT)})
+        self.assertTrue(third["changed"])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,97 @@
+'''
+Tests of the id registry, against a temporary sqlite file.
+'''
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+from unittest import mock
+
+import pandas as pd
+
+from schedule.main.utils import id_registry
+from schedule.main.utils.id_registry import IdRegistry
+
+def employee_df(n_rows):
+    '''
+    Returns n_rows employees; one in three shares the email of another, and
+    one in five has no email and shares their name with another.
+    '''
+    records = []
+    for i in range(n_rows):
+        email = f"Person.{i % 7}@canada.ca " if i % 3 == 0 else f"person.{i}@canada.ca"
+        if i % 5 == 0:
+            email = "" if i % 2 else None
+        records.append((email, f"Name {i % 4}", "First", f"Transport Canada: Unit {i % 2}"))
+    return pd.DataFrame(records, columns=["email", "last_name", "first_name", "compound_name_en"])
+
+class IdRegistryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+        self.path = os.path.join(self.dir, "registry", "ids.db")
+
+    def get_ids(self, kind, keys):
+        with IdRegistry(self.path) as registry:
+            return registry.get_ids(kind, keys).tolist()
+
+    def get_employee_ids(self, chunks):
+        with IdRegistry(self.path) as registry:
+            return [i for chunk in chunks for i in registry.get_employee_ids(chunk).tolist()]
+
+    def read_keys(self, kind):
+        with sqlite3.connect(self.path) as conn:
+            return dict(conn.execute("SELECT key, id FROM ids WHERE kind = ?", (kind,)))
+
+    def test_ids_are_stable_across_runs(self):
+        self.assertEqual(self.get_ids("organization", ["b", "a", "c"]), [0, 1, 2])
+        self.assertEqual(self.get_ids("organization", ["d", "c", "b"]), [3, 2, 0])
+        # The id of a key that went away is not reused
+        self.assertEqual(self.get_ids("organization", ["e"]), [4])
+        # Every kind is numbered on its own
+        self.assertEqual(self.get_ids("department", ["a", "b"]), [0, 1])
+
+    def test_duplicate_keys_are_numbered(self):
+        df = pd.DataFrame({
+            "email": ["Ann@canada.ca", "bob@canada.ca", " ann@canada.ca", None, None],
+            "last_name": ["Smith", "Jones", "Smith", "Lee", "Lee"],
+            "first_name": ["Ann", "Bob", "Ann", "Kim", "Kim"],
+            "compound_name_en": ["Transport Canada: Audit"] * 5,
+        })
+        self.assertEqual(self.get_employee_ids([df]), [0, 1, 2, 3, 4])
+        self.assertEqual(self.read_keys("employee"), {
+            "ann@canada.ca": 0,
+            "bob@canada.ca": 1,
+            "ann@canada.ca#2": 2,
+            "name:lee|kim|transport canada: audit": 3,
+            "name:lee|kim|transport canada: audit#2": 4,
+        })
+        # Occurrences are numbered again on every run, in the order of the rows
+        self.assertEqual(self.get_employee_ids([df.iloc[::-1]]), [3, 4, 0, 1, 2])
+
+    def test_chunked_registration_matches_in_memory_registration(self):
+        df = employee_df(100)
+        expected = self.get_employee_ids([df])
+        self.assertEqual(sorted(expected), list(range(100)))
+        shutil.rmtree(self.dir)
+        # Keys are sent in several batches within each chunk too
+        with mock.patch.object(id_registry, "BATCH_SIZE", 4):
+            chunks = [df.iloc[start:start + 13] for start in range(0, len(df), 13)]
+            self.assertEqual(self.get_employee_ids(chunks), expected)
+            # A later run finds every employee where it left them
+            self.assertEqual(self.get_employee_ids(chunks), expected)
+
+    def test_ids_are_committed_only_without_error(self):
+        self.get_ids("organization", ["a"])
+        with self.assertRaises(RuntimeError):
+            with IdRegistry(self.path) as registry:
+                self.assertEqual(registry.get_ids("organization", ["b", "c"]).tolist(), [1, 2])
+                raise RuntimeError("the run failed")
+        self.assertEqual(self.read_keys("organization"), {"a": 0})
+        self.assertEqual(self.get_ids("organization", ["c"]), [1])
+        self.assertEqual(self.read_keys("organization"), {"a": 0, "c": 1})
+
+if __name__ == "__main__":
+    unittest.main()
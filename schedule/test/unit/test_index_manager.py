@@ -0,0 +1,99 @@
+'''
+Checks which indices are versions of an alias, how new versions are named and
+which versions are pruned, against an in-memory stand-in for the indices API.
+'''
+import fnmatch
+import unittest
+from unittest import mock
+
+from schedule.main.elasticsearch import index_manager
+from schedule.main.elasticsearch.index_manager import (
+    create_versioned_index, get_versions, prune_old_indices, swap_alias)
+
+class StubIndices:
+    ''' The parts of es.indices used by index_manager, over a dict of index name to its aliases. '''
+
+    def __init__(self, indices):
+        self.indices = dict((index, set()) for index in indices)
+
+    def create(self, index, body):
+        if index in self.indices:
+            raise ValueError(f"{index} already exists")
+        self.indices[index] = set()
+
+    def delete(self, index):
+        for name in index.split(","):
+            del self.indices[name]
+
+    def exists(self, index):
+        return index in self.indices
+
+    def exists_alias(self, name):
+        return any(name in aliases for aliases in self.indices.values())
+
+    def get_alias(self, index=None, name=None):
+        return dict((index_name, {"aliases": dict.fromkeys(aliases, {})})
+                    for index_name, aliases in self.indices.items()
+                    if (index is None or fnmatch.fnmatch(index_name, index))
+                    and (name is None or name in aliases))
+
+    def update_aliases(self, body):
+        for action in body["actions"]:
+            (kind, params), = action.items()
+            if kind == "add":
+                self.indices[params["index"]].add(params["alias"])
+            elif kind == "remove":
+                self.indices[params["index"]].discard(params["alias"])
+            else:
+                del self.indices[params["index"]]
+
+class IndexManagerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.es = mock.Mock()
+        self.es.indices = StubIndices([
+            "employee_20200501120000",
+            "employee_20200502120000_1",
+            "employee_20200502120000_2",
+            "employee_20200502120000_10",
+            "employee_suggestions_20200501120000",
+            "employee_20200501120000_backup",
+            "employee_2020",
+            "organization_20200501120000",
+        ])
+
+    def test_only_versions_of_the_alias_are_listed(self):
+        self.assertEqual(get_versions(self.es, "employee"), [
+            "employee_20200501120000",
+            "employee_20200502120000_1",
+            "employee_20200502120000_2",
+            "employee_20200502120000_10",
+        ])
+        self.assertEqual(get_versions(self.es, "employee_suggestions"), ["employee_suggestions_20200501120000"])
+
+    def test_versions_created_within_a_second_are_numbered(self):
+        with mock.patch.object(index_manager.time, "strftime", return_value="20200502120000"):
+            self.assertEqual(create_versioned_index(self.es, "employee", {}), "employee_20200502120000_11")
+            self.assertEqual(create_versioned_index(self.es, "employee", {}), "employee_20200502120000_12")
+        with mock.patch.object(index_manager.time, "strftime", return_value="20200501120000"):
+            self.assertEqual(create_versioned_index(self.es, "employee", {}), "employee_20200501120000_2")
+        with mock.patch.object(index_manager.time, "strftime", return_value="20200503120000"):
+            self.assertEqual(create_versioned_index(self.es, "employee", {}), "employee_20200503120000_1")
+        self.assertEqual(get_versions(self.es, "employee")[-1], "employee_20200503120000_1")
+
+    def test_prune_keeps_other_indices_and_the_live_version(self):
+        swap_alias(self.es, "employee", "employee_20200501120000")
+        stale = prune_old_indices(self.es, "employee", keep=2)
+        self.assertEqual(stale, ["employee_20200502120000_1"])
+        self.assertEqual(sorted(self.es.indices.indices), [
+            "employee_2020",
+            "employee_20200501120000",
+            "employee_20200501120000_backup",
+            "employee_20200502120000_10",
+            "employee_20200502120000_2",
+            "employee_suggestions_20200501120000",
+            "organization_20200501120000",
+        ])
+
+if __name__ == "__main__":
+    unittest.main()
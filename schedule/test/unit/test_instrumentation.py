@@ -0,0 +1,36 @@
+'''
+Checks the throughput reported for the stages of a run.
+'''
+import unittest
+
+from schedule.main.utils.instrumentation import RunReport
+
+class ThroughputTest(unittest.TestCase):
+
+    def run_stage(self, rows_in=None, rows_out=None, fail=False):
+        report = RunReport()
+        try:
+            with report.stage("build_organizations", rows_in=rows_in) as stage:
+                stage.rows_out = rows_out
+                if fail:
+                    raise RuntimeError("out of memory")
+        except RuntimeError:
+            pass
+        return report.stages[0]
+
+    def test_succeeded_stage_with_rows_out(self):
+        stage = self.run_stage(rows_in=10, rows_out=1000)
+        self.assertEqual(stage.throughput(), 1000 / stage.wall_time)
+        self.assertEqual(stage.to_dict()["rows_per_second"], stage.throughput())
+
+    def test_stage_without_rows_out(self):
+        self.assertIsNone(self.run_stage(rows_in=1000).throughput())
+
+    def test_failed_stage(self):
+        stage = self.run_stage(rows_in=1000, rows_out=1000, fail=True)
+        self.assertEqual(stage.status, "failed")
+        self.assertIsNone(stage.throughput())
+        self.assertIsNone(stage.to_dict()["rows_per_second"])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,83 @@
+'''
+Checks get_closure_df against a brute force closure of a small org chart,
+worked out both from the nested set numbers and from the paths of the nodes.
+'''
+import itertools
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from schedule.main.organization.org_closure import CLOSURE_COLUMNS, get_closure_df
+from schedule.main.organization.org_tree import NO_NODE, OrgTree
+from schedule.main.organization.organization_table import attach_nested_sets
+
+ROOT = "Government of Canada"
+PATHS = [
+    [ROOT, "Transport Canada", "Security Branch", "Audit Division", "Review Unit"],
+    [ROOT, "Transport Canada", "Security Branch", "Audit Division", "Field Unit"],
+    [ROOT, "Transport Canada", "Finance Branch", "Pay Unit", None],
+    [ROOT, "Transport Canada", "Finance Branch", "Budget Unit", None],
+    [ROOT, "Agriculture Canada", "Finance Branch", "Pay Unit", None],
+    [ROOT, "Agriculture Canada", "Communications Branch", None, None],
+    [ROOT, "Health Canada", None, None, None],
+]
+
+def get_org_df():
+    '''
+    Returns an org chart and an org_df with an organization for every node of
+    the chart, organizations sharing a node with another one, and
+    organizations missing from the chart.
+    '''
+    org_chart = OrgTree.from_paths(pd.DataFrame(PATHS))
+    nodes = list(range(len(org_chart)))
+    # Several organizations can be matched to the same node
+    nodes += [nodes[3], nodes[3], nodes[-1], nodes[0]]
+    nodes += [NO_NODE, NO_NODE]
+    # Each department root is a department of its own
+    dept_ids = [int(org_chart.root[node]) if node != NO_NODE else 0 for node in nodes]
+    org_df = pd.DataFrame({"org_id": np.arange(len(nodes)) + 100, "dept_id": dept_ids})
+    return org_chart, attach_nested_sets(org_df, org_chart, np.array(nodes, dtype=np.int64)), nodes
+
+def to_pairs(closure_df):
+    return sorted(closure_df[CLOSURE_COLUMNS].itertuples(index=False, name=None))
+
+class GetClosureDfTest(unittest.TestCase):
+
+    def setUp(self):
+        self.org_chart, self.org_df, self.nodes = get_org_df()
+        self.orgs = [org for org, node in zip(self.org_df.itertuples(index=False), self.nodes)
+                     if node != NO_NODE]
+
+    def test_matches_nested_sets(self):
+        expected = [(ancestor.org_id, descendant.org_id,
+                     descendant.org_chart_depth - ancestor.org_chart_depth, ancestor.dept_id)
+                    for ancestor, descendant in itertools.product(self.orgs, repeat=2)
+                    if ancestor.dept_id == descendant.dept_id
+                    and ancestor.lft <= descendant.lft <= ancestor.rgt]
+        self.assertEqual(to_pairs(get_closure_df(self.org_df)), sorted(expected))
+
+    def test_matches_path_prefixes(self):
+        org_nodes = [node for node in self.nodes if node != NO_NODE]
+        paths = [(int(self.org_chart.root[node]), self.org_chart.path(node)) for node in org_nodes]
+        expected = []
+        for (ancestor, (ancestor_root, ancestor_path)), (descendant, (descendant_root, descendant_path)) \
+                in itertools.product(zip(self.orgs, paths), repeat=2):
+            if ancestor_root == descendant_root and descendant_path[:len(ancestor_path)] == ancestor_path:
+                expected.append((ancestor.org_id, descendant.org_id,
+                                 len(descendant_path) - len(ancestor_path), ancestor.dept_id))
+        closure_df = get_closure_df(self.org_df)
+        self.assertEqual(to_pairs(closure_df), sorted(expected))
+        # Organizations missing from the chart have no rows
+        missing = set(self.org_df["org_id"][self.org_df["lft"].isna()])
+        self.assertEqual(len(missing), 2)
+        self.assertFalse(missing & set(closure_df["ancestor_id"]) | missing & set(closure_df["descendant_id"]))
+
+    def test_closure_of_departments_is_their_part_of_the_whole(self):
+        closure_df = get_closure_df(self.org_df)
+        for dept_id, orgs in self.org_df.groupby("dept_id"):
+            self.assertEqual(to_pairs(get_closure_df(orgs)),
+                             to_pairs(closure_df[closure_df["dept_id"] == dept_id]))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,43 @@
+'''
+Checks that the org chart built by OrgTree.from_paths does not depend on the
+order of the org structure paths.
+'''
+import unittest
+
+import pandas as pd
+
+from schedule.main.organization.org_tree import OrgTree
+
+PATHS = [
+    ["Government of Canada", "Transport Canada", "Security Branch", "Audit Division"],
+    ["Government of Canada", "Agriculture Canada", "finance branch", None],
+    ["Government of Canada", "Transport Canada", "Finance Branch", "Pay Unit"],
+    ["Government of Canada", "Agriculture Canada", "Communications Branch", None],
+    ["Government of Canada", "Transport Canada", "Finance Branch", "Budget Unit"],
+    ["Government of Canada", "Agriculture Canada", "Finance Branch", None],
+]
+
+class FromPathsTest(unittest.TestCase):
+
+    def test_siblings_are_ordered_by_name(self):
+        org_chart = OrgTree.from_paths(pd.DataFrame(PATHS))
+        labels = lambda nodes: [org_chart.label(node) for node in nodes]
+        self.assertEqual(labels(org_chart.roots), ["Agriculture Canada", "Transport Canada"])
+        agriculture, transport = [org_chart.children(root)[0] for root in org_chart.roots]
+        # Names with the same key are ordered by name
+        self.assertEqual(labels(org_chart.children(agriculture)),
+                         ["Communications Branch", "Finance Branch", "finance branch"])
+        finance = org_chart.children(transport)[0]
+        self.assertEqual(labels(org_chart.children(finance)), ["Budget Unit", "Pay Unit"])
+        self.assertEqual(org_chart.path(org_chart.children(finance)[1]), [0, 0, 1])
+
+    def test_chart_does_not_depend_on_row_order(self):
+        paths = pd.DataFrame(PATHS)
+        expected = OrgTree.from_paths(paths)
+        for seed in range(5):
+            org_chart = OrgTree.from_paths(paths.sample(frac=1, random_state=seed))
+            self.assertEqual(org_chart.to_list(), expected.to_list())
+            self.assertEqual(org_chart.tin.tolist(), expected.tin.tolist())
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,184 @@
+'''
+Compares remove_duplicates with the row-by-row prefix collapse it replaced, on
+the small test extract and on a synthetic org structure of about 500k paths,
+and checks under which org chart nodes employees are counted.
+'''
+import os
+import unittest
+
+import pandas as pd
+
+from schedule.config import TestConfig
+from schedule.main.prepare_org_chart import build_org_chart, remove_duplicates
+
+TEST_CSV_PATH = os.path.join(TestConfig.TEST_DATA_PATH, "geds_small.csv")
+# Number of children of every node at each level of the synthetic org
+# structure, from the root down; 8 levels for the default tree depth of 7.
+SYNTHETIC_FAN_OUT = [1, 17, 8, 6, 5, 5, 4, 5]
+ROOT = "Government of Canada"
+
+def baseline_remove_duplicates(df, columns):
+    '''
+    The prefix collapse that remove_duplicates replaced: walking the rows in
+    order, a row is dropped when the next one has fewer missing units. Rows
+    are collected in a list rather than appended to a dataframe one at a
+    time, which only changes how long it takes.
+    Args:
+        df: a pandas dataframe with one org unit per column, listed in tree
+            order.
+        columns: the list of columns that make up a path.
+    Returns:
+        A pandas dataframe containing the rows that were kept.
+    '''
+    kept = []
+    rows = df[columns].itertuples(name=None)
+    past_idx, *past_row = next(rows)
+    for idx, *row in rows:
+        past_nones = sum(unit is None for unit in past_row[1:])
+        current_nones = sum(unit is None for unit in row[1:])
+        if past_nones - current_nones <= 0:
+            kept.append(past_idx)
+        past_idx, past_row = idx, row
+    return df.loc[kept, columns]
+
+def terminate(df):
+    '''
+    Adds a row without any org unit at the end of df. The baseline never
+    keeps the last row it is given, so this lets it keep the last path; the
+    empty row itself is never kept by either implementation.
+    '''
+    return pd.concat([df, pd.DataFrame([[None] * len(df.columns)], columns=df.columns,
+                                       index=[len(df)])])
+
+def split_structures(structures, separator):
+    '''
+    Splits distinct org structures into one column per org unit, padding
+    shorter paths with None.
+    '''
+    structures = pd.Series(structures).drop_duplicates().reset_index(drop=True)
+    return structures.str.split(separator, expand=True)
+
+def tree_order(paths):
+    '''
+    Sorts paths so that every path is followed by its descendants, the order
+    the baseline expects its input in.
+    '''
+    return paths.sort_values(list(paths.columns), na_position="first")
+
+def synthetic_paths(fan_out):
+    '''
+    Builds every path of an org structure with the given number of children
+    per level, in tree order (every path is followed by its descendants).
+    Args:
+        fan_out: a list with the number of children of every node at each
+            level.
+    Returns:
+        A pandas dataframe with one row per path and one column per level.
+    '''
+    depth = len(fan_out)
+    paths = []
+    def visit(path):
+        paths.append(path + [None] * (depth - len(path)))
+        if len(path) < depth:
+            for child in range(fan_out[len(path)]):
+                visit(path + [f"unit {len(path)}.{child}"])
+    for root in range(fan_out[0]):
+        visit([f"root {root}"])
+    return pd.DataFrame(paths)
+
+class RemoveDuplicatesTest(unittest.TestCase):
+
+    def assert_frames_equal(self, left, right):
+        # assert_frame_equal compares object columns value by value, which is
+        # slow on the synthetic paths
+        pd.testing.assert_index_equal(left.index, right.index)
+        pd.testing.assert_index_equal(left.columns, right.columns)
+        self.assertTrue(left.equals(right))
+
+    def assert_same_as_baseline(self, paths):
+        ''' Compares both implementations on paths listed in tree order. '''
+        columns = list(paths.columns)
+        expected = baseline_remove_duplicates(terminate(paths), columns)
+        result = remove_duplicates(paths, columns)
+        self.assert_frames_equal(result, expected)
+        # The result does not depend on rows arriving in tree order
+        shuffled = remove_duplicates(paths.sample(frac=1, random_state=0), columns)
+        self.assert_frames_equal(shuffled.sort_index(), expected.sort_index())
+
+    def test_geds_small(self):
+        df = pd.read_csv(TEST_CSV_PATH)
+        paths = tree_order(split_structures(df["org_structure"], ":"))
+        self.assertLess(len(remove_duplicates(paths, list(paths.columns))), len(paths))
+        self.assert_same_as_baseline(paths)
+
+    def test_synthetic_paths(self):
+        paths = synthetic_paths(SYNTHETIC_FAN_OUT)
+        self.assertGreaterEqual(len(paths), 500000)
+        self.assert_same_as_baseline(paths)
+
+def employee_df(rows):
+    '''
+    Returns a frame of employees with the columns build_org_chart takes.
+    Args:
+        rows: a list of (department, org_name, org_id, org structure below
+            the department, number of employees) tuples.
+    '''
+    records = []
+    for department, org_name, org_id, units, n_employees in rows:
+        structure = " : ".join([ROOT, department] + units)
+        records += [(structure, department, org_name, f"Title {i}", org_id) for i in range(n_employees)]
+    return pd.DataFrame(records, columns=["org_structure_en", "department_en", "org_name_en",
+                                          "job_title_en", "org_id"])
+
+class AttachHeadcountsTest(unittest.TestCase):
+
+    def get_node(self, org_chart, department, *units):
+        ''' Returns the node reached from a department root through the named units. '''
+        node = next(root for root in org_chart.roots if org_chart.label(root) == department)
+        for unit in (department,) + units:
+            node = next(child for child in org_chart.children(node) if org_chart.label(child) == unit)
+        return node
+
+    def test_employees_are_counted_in_their_own_department(self):
+        # Environment has a "Finance Branch" unit without employees of its
+        # own, so its node is matched to Employment's Finance Branch through
+        # the index of all organizations. Environment comes first in the
+        # chart, but Employment's employees belong under Employment's node.
+        df = employee_df([
+            ("Environment Canada", "Budget Division", 1, ["Finance Branch", "Budget Division"], 2),
+            ("Employment Canada", "Finance Branch", 2, ["Finance Branch"], 5),
+        ])
+        org_chart = build_org_chart(df, "en")
+        environment = self.get_node(org_chart, "Environment Canada", "Finance Branch")
+        employment = self.get_node(org_chart, "Employment Canada", "Finance Branch")
+        self.assertEqual(org_chart.org_id[environment], 2)
+        self.assertEqual(org_chart.org_id[employment], 2)
+        self.assertEqual(org_chart.direct_headcount[environment], 0)
+        self.assertEqual(org_chart.total_headcount[environment], 2)
+        self.assertEqual(org_chart.job_title_count[environment], 2)
+        self.assertEqual(org_chart.direct_headcount[employment], 5)
+        self.assertEqual(org_chart.total_headcount[employment], 5)
+        self.assertEqual(org_chart.job_title_count[employment], 5)
+        for root in org_chart.roots:
+            expected = 2 if org_chart.label(root) == "Environment Canada" else 5
+            self.assertEqual(org_chart.total_headcount[root], expected)
+
+    def test_organizations_missing_from_their_department_fall_back(self):
+        # The structure of Employment's Finance Branch stops at the
+        # department, so its employees can only be counted under the
+        # Finance Branch of another department.
+        df = employee_df([
+            ("Environment Canada", "Budget Division", 1, ["Finance Branch", "Budget Division"], 2),
+            ("Employment Canada", "Finance Branch", 2, [], 5),
+            ("Transport Canada", "Audit Division", 3, ["Finance Branch", "Audit Division"], 1),
+        ])
+        org_chart = build_org_chart(df, "en")
+        environment = self.get_node(org_chart, "Environment Canada", "Finance Branch")
+        transport = self.get_node(org_chart, "Transport Canada", "Finance Branch")
+        # Counted once, under the first of the departments by name
+        self.assertEqual(org_chart.direct_headcount[environment], 5)
+        self.assertEqual(org_chart.direct_headcount[transport], 0)
+        self.assertEqual(org_chart.direct_headcount.sum(), 8)
+
+if __name__ == "__main__":
+    unittest.main()
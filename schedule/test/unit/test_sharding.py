@@ -0,0 +1,88 @@
+'''
+Checks that the sharded build of the organizations and departments gives the
+frames of a full refresh, on generated GEDS data.
+'''
+import unittest
+
+import pandas as pd
+
+from schedule.benchmark.generate_geds import generate_geds, ROOT_EN, ROOT_FR
+from schedule.main.department.department_table import (
+    DEPARTMENT_COLUMNS, get_department_df, serialize_department_org_charts)
+from schedule.main.organization.org_chart_index import OrgChartIndex
+from schedule.main.organization.organization_table import get_organization_df
+from schedule.main.prepare_data import create_table_keys, preprocess_columns
+from schedule.main.prepare_org_chart import prepare_org_chart
+from schedule.main.sharding import build_shards
+from schedule.main.utils.dtype_plan import apply_dtype_plan
+
+N_EMPLOYEES = 20000
+
+def prepare(raw_df, extra_rows=()):
+    '''
+    Prepares generated GEDS data like prepare_data does.
+    Args:
+        raw_df: a dataframe returned by generate_geds.
+        extra_rows: dicts of preprocessed columns overriding those of the
+            first employee, added as employees at the end.
+    '''
+    df = preprocess_columns(raw_df)
+    extra = pd.DataFrame([dict(df.iloc[0], **row) for row in extra_rows], columns=df.columns)
+    df = pd.concat([df, extra], ignore_index=True)
+    for lang in ["en", "fr"]:
+        df[f"compound_name_{lang}"] = df[f"department_{lang}"] + ": " + df[f"org_name_{lang}"]
+    return apply_dtype_plan(create_table_keys(df))
+
+def employee(department, org_name, units):
+    ''' Returns the columns of an employee of org_name, whose org structure has the given units. '''
+    return {"department_acronym": department[:3].upper(),
+            "department_en": department, "department_fr": department,
+            "org_name_en": org_name, "org_name_fr": org_name,
+            "org_structure_en": " : ".join([ROOT_EN, department] + units),
+            "org_structure_fr": " : ".join([ROOT_FR, department] + units)}
+
+def full_refresh_frames(df):
+    ''' Returns the organizations and departments of df as full_refresh builds them. '''
+    org_chart_en, org_chart_fr = prepare_org_chart(df, workers=1)
+    org_index_en, org_index_fr = OrgChartIndex(org_chart_en), OrgChartIndex(org_chart_fr)
+    dept_df = serialize_department_org_charts(get_department_df(df), org_index_en, org_index_fr, workers=1)
+    org_df = get_organization_df(df, org_chart_en, org_index_en=org_index_en)
+    return org_df, dept_df
+
+class BuildShardsTest(unittest.TestCase):
+
+    def assert_same_frames(self, left, right, key):
+        # Organizations with several org structures have several rows, which
+        # keep their order within each department
+        left = left.sort_values(key, kind="stable").reset_index(drop=True)
+        right = right[left.columns].sort_values(key, kind="stable").reset_index(drop=True)
+        pd.testing.assert_frame_equal(left, right)
+
+    def assert_same_as_full_refresh(self, df):
+        org_df, dept_df = full_refresh_frames(df)
+        shard_org_df, shard_dept_df = build_shards(df, workers=2)
+        self.assert_same_frames(org_df, shard_org_df, "org_id")
+        self.assert_same_frames(dept_df[DEPARTMENT_COLUMNS], shard_dept_df, "dept_id")
+        return org_df, dept_df
+
+    def test_generated_data(self):
+        self.assert_same_as_full_refresh(prepare(generate_geds(N_EMPLOYEES, seed=0)))
+
+    def test_employees_counted_in_another_department(self):
+        # The org structure of Zeta's Finance Branch stops at the department,
+        # so its employees are counted under the Finance Branch of Alpha,
+        # which comes before Beta by name, in another shard.
+        extra_rows = ([employee("Zeta Agency", "Zeta Finance Branch", [])] * 3
+                      + [employee("Beta Office", "Audit Unit", ["Zeta Finance Branch", "Audit Unit"]),
+                         employee("Alpha Office", "Pay Unit", ["Zeta Finance Branch", "Pay Unit"])])
+        org_df, dept_df = self.assert_same_as_full_refresh(prepare(generate_geds(2000, seed=1), extra_rows))
+        headcounts = org_df.set_index("org_name_en")["total_headcount"]
+        self.assertTrue(pd.isna(headcounts["Zeta Finance Branch"]))
+        self.assertEqual(headcounts["Pay Unit"], 1)
+        self.assertEqual(headcounts["Audit Unit"], 1)
+        charts = dept_df.set_index("department_en")["org_chart_en"]
+        self.assertIn('"direct_headcount":3', charts["Alpha Office"])
+        self.assertNotIn('"direct_headcount":3', charts["Beta Office"])
+
+if __name__ == "__main__":
+    unittest.main()
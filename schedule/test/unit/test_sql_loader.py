@@ -0,0 +1,72 @@
+'''
+Tests of the bulk loading of tables into a temporary sqlite database.
+'''
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+from unittest import mock
+
+import pandas as pd
+from sqlalchemy import create_engine, text
+from sqlalchemy.pool import StaticPool
+from sqlalchemy.types import Integer, Text
+
+from schedule.main.utils import sql_loader
+from schedule.main.utils.sql_loader import load_table
+
+DTYPE = {"org_id": Integer, "name": Text}
+
+def frame(n_rows, name="org"):
+    return pd.DataFrame({"org_id": range(n_rows), "name": [f"{name} {i}" for i in range(n_rows)]})
+
+class LoadTableTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+        self.path = os.path.join(self.dir, "employees.db")
+        # A single connection, so settings of the connection can be checked
+        self.engine = create_engine(f"sqlite:///{self.path}", poolclass=StaticPool)
+        self.addCleanup(self.engine.dispose)
+        patcher = mock.patch.object(sql_loader, "get_engine", return_value=self.engine)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def read(self, query):
+        with sqlite3.connect(self.path) as conn:
+            return conn.execute(query).fetchall()
+
+    def test_load_replaces_table(self):
+        load_table(frame(10), "organizations", DTYPE, primary_key="org_id")
+        load_table(frame(5, "new"), "organizations", DTYPE, primary_key="org_id")
+        self.assertEqual(self.read("SELECT COUNT(*), MIN(name) FROM organizations"), [(5, "new 0")])
+        self.assertEqual(self.read("SELECT name FROM sqlite_master WHERE type = 'index'"),
+                         [("pk_organizations",)])
+        self.assertEqual(self.read("SELECT name FROM sqlite_master WHERE name LIKE '%staging%'"), [])
+
+    def test_chunks_with_repeated_keys_are_indexed_without_primary_key(self):
+        load_table(iter([frame(3), frame(3)]), "organizations", DTYPE, primary_key="org_id")
+        self.assertEqual(self.read("SELECT COUNT(*) FROM organizations"), [(6,)])
+        self.assertEqual(self.read("SELECT name FROM sqlite_master WHERE type = 'index'"),
+                         [("ix_organizations_org_id",)])
+
+    def test_failed_swap_keeps_live_table(self):
+        load_table(frame(10), "organizations", DTYPE, primary_key="org_id")
+        with mock.patch.object(sql_loader, "create_keys", side_effect=RuntimeError("no keys")):
+            with self.assertRaises(RuntimeError):
+                load_table(frame(5, "new"), "organizations", DTYPE, primary_key="org_id")
+        # The table was neither dropped nor replaced
+        self.assertEqual(self.read("SELECT COUNT(*), MIN(name) FROM organizations"), [(10, "org 0")])
+
+    def test_pragmas_are_restored(self):
+        with self.engine.connect() as conn:
+            conn.execute(text("PRAGMA synchronous=NORMAL"))
+        load_table(frame(10), "organizations", DTYPE, primary_key="org_id")
+        self.assertEqual(self.read("PRAGMA journal_mode"), [("delete",)])
+        with self.engine.connect() as conn:
+            self.assertEqual(conn.execute(text("PRAGMA synchronous")).scalar(), 1)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,128 @@
+'''
+Checks the suggestion file on a small suggestions frame: the suggestions of
+short prefixes, ranked when the file is written, against those found by
+scanning the range of their keys, and the updates of some departments against
+writing the whole file again.
+'''
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy as np
+import pandas as pd
+
+from schedule.main import suggestions
+from schedule.main.suggestions import (
+    SuggestionIndex, get_suggestion_df, update_suggestion_index, write_suggestion_index)
+
+FIRST_NAMES = ["Jane", "Jean", "Jérôme", "Anne", "Anna", "Ali", "Zoé", "Marc"]
+LAST_NAMES = ["Smith", "Smithers", "Tremblay", "Roy", "Ahmed", "Lee", "Côté", "Bouchard", "Li"]
+UNITS = ["Finance", "Audit", "Human Resources", "Security", "Legal Services", "Accounting"]
+DEPARTMENTS = ["Transport Canada", "Agriculture Canada", "Health Canada", "Justice Canada"]
+# Prefixes of one and two characters, and longer ones
+PREFIXES = ["a", "j", "s", "z", "t", "an", "je", "sm", "AN", "É", "le", "ac", "ca", "smi", "jean s",
+            "human r", "tr", "x", "li"]
+
+def get_docs(n_employees, seed):
+    '''
+    Returns employee and organization documents with the columns
+    get_suggestion_df reads; many suggestions share a weight.
+    '''
+    rng = np.random.RandomState(seed)
+    org_names = [f"{unit} {department.split()[0]}" for department in DEPARTMENTS for unit in UNITS]
+    org_docs = pd.DataFrame({
+        "org_id": range(len(org_names)),
+        "org_name_en": org_names,
+        "org_name_fr": [f"Direction {name}" for name in org_names],
+        "department_en": [department for department in DEPARTMENTS for unit in UNITS],
+        "department_fr": [f"Ministère {department}" for department in DEPARTMENTS for unit in UNITS],
+        "dept_id": [dept_id for dept_id in range(len(DEPARTMENTS)) for unit in UNITS],
+        "total_headcount": pd.array(rng.choice([None, 1, 3, 3, 10], size=len(org_names)), dtype="Int64"),
+    })
+    org_ids = rng.randint(0, len(org_docs), size=n_employees)
+    emp_docs = pd.DataFrame({
+        "employee_id": range(n_employees),
+        "full_name": [f"{first} {last}" for first, last in zip(rng.choice(FIRST_NAMES, n_employees),
+                                                              rng.choice(LAST_NAMES, n_employees))],
+        "org_name_en": org_docs["org_name_en"].to_numpy()[org_ids],
+        "org_name_fr": org_docs["org_name_fr"].to_numpy()[org_ids],
+        "dept_id": org_docs["dept_id"].to_numpy()[org_ids],
+    })
+    return emp_docs, org_docs
+
+def read_tables(path):
+    ''' Returns the rows of every table of a suggestion file, sorted. '''
+    with sqlite3.connect(path) as conn:
+        return dict((table, sorted(conn.execute(f"SELECT * FROM {table}").fetchall()))
+                    for table in ["suggestions", "suggestion_keys", "top_suggestions"])
+
+class SuggestionIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+        self.path = os.path.join(self.dir, "suggestions.db")
+
+    def assert_short_prefixes_match_range_scan(self):
+        with SuggestionIndex(self.path) as index:
+            for prefix in PREFIXES:
+                for kind in [None, "employee", "organization"]:
+                    for limit in [1, 10, suggestions.TOP_SUGGESTIONS]:
+                        ranked = index.suggest(prefix, limit=limit, kind=kind)
+                        with mock.patch.object(suggestions, "TOP_PREFIX_LENGTH", 0):
+                            scanned = index.suggest(prefix, limit=limit, kind=kind)
+                        self.assertEqual(ranked, scanned, (prefix, kind, limit))
+
+    def test_short_prefixes_match_range_scan(self):
+        suggestion_df = get_suggestion_df(*get_docs(300, seed=0))
+        write_suggestion_index(suggestion_df, self.path)
+        self.assert_short_prefixes_match_range_scan()
+        with SuggestionIndex(self.path) as index:
+            self.assertEqual(len(index.suggest("j", limit=suggestions.TOP_SUGGESTIONS)),
+                             suggestions.TOP_SUGGESTIONS)
+            # Accents and case are ignored; the heaviest suggestion comes first
+            self.assertEqual([row["name_en"] for row in index.suggest("zoe", limit=1000)],
+                             [row["name_en"] for row in index.suggest("ZO", limit=1000)])
+            weights = [row["weight"] for row in index.suggest("a", limit=25)]
+            self.assertEqual(weights, sorted(weights, reverse=True))
+
+    def test_ranking_in_chunks_matches_ranking_at_once(self):
+        suggestion_df = get_suggestion_df(*get_docs(300, seed=1))
+        write_suggestion_index(suggestion_df, self.path)
+        expected = read_tables(self.path)
+        with mock.patch.object(suggestions, "RANK_CHUNK_SIZE", 97):
+            write_suggestion_index(suggestion_df, self.path)
+        self.assertEqual(read_tables(self.path), expected)
+
+    def test_update_matches_full_rewrite(self):
+        emp_docs, org_docs = get_docs(300, seed=2)
+        write_suggestion_index(get_suggestion_df(emp_docs, org_docs), self.path)
+        # In departments 1 and 2, employees leave, arrive and change names,
+        # organizations change headcounts, and employees of department 3 move
+        # to department 1
+        changed = emp_docs.copy()
+        changed = changed[~((changed["dept_id"] == 2) & (changed["employee_id"] % 4 == 0))]
+        changed.loc[changed["dept_id"] == 1, "full_name"] = changed["full_name"] + " Junior"
+        moved = changed["dept_id"] == 3
+        changed.loc[moved & (changed["employee_id"] % 2 == 0), "dept_id"] = 1
+        arrived = get_docs(20, seed=3)[0].assign(dept_id=2, employee_id=lambda df: df["employee_id"] + 1000)
+        changed = pd.concat([changed, arrived], ignore_index=True)
+        changed_orgs = org_docs.copy()
+        changed_orgs.loc[changed_orgs["dept_id"].isin([1, 2]), "total_headcount"] = 7
+        suggestion_df = get_suggestion_df(changed, changed_orgs)
+        update_suggestion_index(suggestion_df[suggestion_df["dept_id"].isin([1, 2])], [1, 2], self.path)
+        updated = read_tables(self.path)
+        self.assert_short_prefixes_match_range_scan()
+        write_suggestion_index(suggestion_df, self.path)
+        self.assertEqual(updated, read_tables(self.path))
+
+    def test_update_without_file(self):
+        suggestion_df = get_suggestion_df(*get_docs(10, seed=0))
+        self.assertIsNone(update_suggestion_index(suggestion_df, [0], self.path))
+        self.assertFalse(os.path.exists(self.path))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,4 +1,12 @@
-from schedule.main import main
+import argparse
+
+from schedule.main import main, STAGES
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Run the GEDS data pipeline.")
+    target = parser.add_mutually_exclusive_group()
+    target.add_argument("--from-stage", choices=STAGES,
+                        help="run this stage and every stage after it, even if their inputs did not change")
+    target.add_argument("--only-stage", choices=STAGES, help="only run this stage")
+    args = parser.parse_args()
+    main(from_stage=args.from_stage, only_stage=args.only_stage)